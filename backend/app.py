@@ -1,10 +1,23 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
+import datetime
+import json
 import os
+import threading
+import time
+import zipfile
 from werkzeug.utils import secure_filename
 
-from excel_store_fast import save_order_from_json
-from llm_extractor import extract_invoice_image
+from batch import BATCH_MAX_FILES, iter_extractions
+from dedupe_index import DEDUPE_ENABLED, DEDUPE_FUZZY, SaveInProgress, get_dedupe_index
+from extraction_cache import get_cache
+from extraction_pipeline import EXTRACTION_MODE, MODES, extract_document, routing_stats, warm_up_extraction
+from jobs import JobManager, QueueFull
+from llm_extractor import llm_stats
+from metrics import HTTP_SECONDS, METRICS_ENABLED, UPLOAD_BYTES, end_request, observe, render, start_request, timed
+from order_index import date_key
+from order_store import find_duplicate_image, get_store, save_order_unique, save_orders_unique
+from uploads import MAX_UPLOAD_BYTES, UploadError, make_upload
 
 app = Flask(__name__)
 
@@ -16,69 +29,274 @@ CORS(
     ]}}
 )
 
-UPLOAD_DIR = "uploads"
-ALLOWED_EXT = {".png", ".jpg", ".jpeg"}
+# Reject oversized request bodies before they are parsed (batches get headroom)
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_BYTES * 10
 
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+# The order store (ORDER_STORE_BACKEND=excel|sqlite) is opened once, in a
+# background thread, so /api/health answers while the workbook and indexes
+# load; requests that need the store meanwhile wait for it. It is flushed in
+# the background and on interpreter shutdown.
+#
+# Nothing starts at import (scripts and a gunicorn --preload master import
+# this module too): the server starts warm-up under __main__, gunicorn
+# workers from gunicorn.conf.py, and otherwise the first request does.
+# WARM_UP=0 leaves everything to first use.
+WARM_UP = os.getenv("WARM_UP", "1") != "0"
+warm_state = {"ready": not WARM_UP, "seconds": None}
+_warm_up_started = False
+_warm_up_lock = threading.Lock()
 
 
-def normalize_extracted(extracted: dict):
-    subtotal = float(extracted.get("subtotal", 0) or 0)
-    tax = float(extracted.get("tax", 0) or 0)
-    freight = float(extracted.get("freight", 0) or 0)
+def warm_up():
+    started = time.perf_counter()
+    try:
+        get_store()
+        get_cache()
+        if DEDUPE_ENABLED:
+            get_dedupe_index()
+        warm_up_extraction()
+    except Exception as e:
+        # Each piece is opened again on first use
+        print("ERROR: warm-up failed:", e)
+    warm_state["seconds"] = round(time.perf_counter() - started, 3)
+    warm_state["ready"] = True
+    print(f"INFO: warm-up done in {warm_state['seconds']} s")
+
+
+def start_warm_up():
+    # Once per process; safe to call from every entry point
+    global _warm_up_started
+    if not WARM_UP or _warm_up_started:
+        return
+    with _warm_up_lock:
+        if _warm_up_started:
+            return
+        _warm_up_started = True
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+job_manager = JobManager()
 
-    # Fix taxRate if clearly wrong
-    if subtotal > 0:
-        inferred_rate = tax / subtotal
-        if 0 <= inferred_rate <= 0.2:
-            extracted["taxRate"] = round(inferred_rate, 4)
 
-    # Recompute totalDue if missing
-    computed_total = subtotal + tax + freight
-    if not extracted.get("totalDue"):
-        extracted["totalDue"] = round(computed_total, 2)
+@app.before_request
+def start_timing():
+    start_warm_up()
+    g.started = time.perf_counter()
+    g.timing_token = start_request()
 
-    return extracted
 
+@app.after_request
+def finish_timing(response):
+    # Streamed responses are timed up to their first byte
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    observe(HTTP_SECONDS, time.perf_counter() - g.started, endpoint=endpoint, status=response.status_code)
+    server_timing = end_request(g.pop("timing_token", None))
+    if server_timing:
+        response.headers["Server-Timing"] = server_timing
+    return response
 
-def validate_and_save_upload():
+
+def read_validated_upload():
+    # Streams the `file` part into memory (size-capped, type sniffed);
+    # nothing is written under uploads/ unless KEEP_UPLOADS=1.
     if "file" not in request.files:
-        return None, None, (jsonify({"error": "Missing file field"}), 400)
+        return None, (jsonify({"error": "Missing file field"}), 400)
 
     f = request.files["file"]
     if not f or not f.filename:
-        return None, None, (jsonify({"error": "Empty file"}), 400)
+        return None, (jsonify({"error": "Empty file"}), 400)
+
+    try:
+        with timed("upload_read"):
+            upload = make_upload(secure_filename(f.filename), f.stream)
+    except UploadError as e:
+        return None, (jsonify({"error": str(e)}), 400)
+
+    observe(UPLOAD_BYTES, upload.size, mime=upload.mime)
+    return upload, None
+
+
+def request_flag(name, default="1"):
+    return request.values.get(name, default).lower() not in ("0", "false", "no")
+
+
+def use_cache_requested():
+    # ?cache=0 (or form field cache=0) forces a fresh LLM call
+    return request_flag("cache")
+
+
+def fuzzy_requested():
+    # ?fuzzy=1 also treats near-identical invoices (same number/date, total within 1%) as duplicates
+    return request_flag("fuzzy", "1" if DEDUPE_FUZZY else "0")
+
+
+def mode_requested():
+    # ?mode=image skips OCR; ?mode=text_first tries the text route first
+    mode = request.values.get("mode", EXTRACTION_MODE)
+    return mode if mode in MODES else EXTRACTION_MODE
+
+
+def collect_batch_uploads():
+    # Accepts any number of `files` (or `file`) parts; .zip parts are expanded.
+    # Returns (uploads, rejected) where uploads is a list of Upload objects.
+    parts = request.files.getlist("files") + request.files.getlist("file")
+    uploads, rejected = [], []
 
-    filename = secure_filename(f.filename)
-    ext = os.path.splitext(filename.lower())[1]
+    def add(name, stream):
+        try:
+            uploads.append(make_upload(secure_filename(name), stream))
+        except UploadError as e:
+            rejected.append({"filename": name, "error": str(e)})
 
-    if ext not in ALLOWED_EXT:
-        return None, None, (jsonify({"error": f"Unsupported file type: {ext}. Use png/jpg/jpeg"}), 400)
+    for f in parts:
+        if not f or not f.filename:
+            continue
+        if f.filename.lower().endswith(".zip"):
+            try:
+                with zipfile.ZipFile(f.stream) as zf:
+                    for member in zf.infolist():
+                        if member.is_dir():
+                            continue
+                        if len(uploads) + len(rejected) >= BATCH_MAX_FILES:
+                            break
+                        with zf.open(member) as member_stream:
+                            add(os.path.basename(member.filename), member_stream)
+            except zipfile.BadZipFile:
+                rejected.append({"filename": f.filename, "error": "Invalid zip archive"})
+        else:
+            add(f.filename, f.stream)
 
-    saved_path = os.path.join(UPLOAD_DIR, filename)
-    f.save(saved_path)
+        if len(uploads) + len(rejected) >= BATCH_MAX_FILES:
+            break
 
-    return filename, saved_path, None
+    return uploads, rejected
+
+
+def run_batch(uploads, rejected, save, use_cache, fuzzy, mode=EXTRACTION_MODE):
+    # Yields progress events; all successful orders are saved in one commit.
+    # `index` is the file's position in `uploads`.
+    yield {"event": "started", "total": len(uploads) + len(rejected)}
+
+    for item in rejected:
+        yield {"event": "file", "ok": False, **item}
+
+    # Images already saved before skip the LLM call entirely
+    pending, duplicates = [], 0
+    for index, upload in enumerate(uploads):
+        existing = find_duplicate_image(upload.sha256) if save else None
+        if existing:
+            duplicates += 1
+            yield {"event": "file", "ok": True, "index": index, "filename": upload.filename,
+                   "duplicate": True, "salesOrderId": existing}
+        else:
+            pending.append((index, upload))
+
+    extracted_by_index = {}
+    for pos, filename, result, error in iter_extractions(
+        [upload for _, upload in pending],
+        lambda upload: extract_document(upload.data, upload.mime, use_cache=use_cache, mode=mode)
+    ):
+        index = pending[pos][0]
+        if error:
+            yield {"event": "file", "ok": False, "index": index, "filename": filename, "error": error}
+            continue
+        extracted, validation, routing = result
+        extracted_by_index[index] = (filename, extracted)
+        yield {"event": "file", "ok": True, "index": index, "filename": filename,
+               "extracted": extracted, "validation": validation, "routing": routing}
+
+    if save and extracted_by_index:
+        indexes = sorted(extracted_by_index)
+        try:
+            results = save_orders_unique(
+                [extracted_by_index[i][1] for i in indexes],
+                [uploads[i].sha256 for i in indexes],
+                fuzzy=fuzzy
+            )
+        except SaveInProgress as e:
+            # Another request is still saving some of these; resubmit them
+            results = e.results
+        saved = []
+        for i, result in zip(indexes, results):
+            order = {"index": i, "filename": extracted_by_index[i][0]}
+            if result is None:
+                order.update(salesOrderId=None, pending=True)
+            else:
+                order.update(salesOrderId=result[0], duplicate=result[1])
+            saved.append(order)
+        yield {"event": "saved", "orders": saved}
+
+    yield {
+        "event": "done",
+        "total": len(uploads) + len(rejected),
+        "succeeded": len(extracted_by_index) + duplicates,
+        "failed": len(uploads) + len(rejected) - len(extracted_by_index) - duplicates
+    }
+
+
+def run_extraction_job(upload, save, use_cache, fuzzy=DEDUPE_FUZZY, mode=EXTRACTION_MODE):
+    if save:
+        # Same image saved before: no LLM call, no new order
+        existing = find_duplicate_image(upload.sha256)
+        if existing:
+            return {"filename": upload.filename, "salesOrderId": existing, "duplicate": True}
+
+    extracted, validation, routing = extract_document(upload.data, upload.mime, use_cache=use_cache, mode=mode)
+
+    result = {"filename": upload.filename, "extracted": extracted, "validation": validation, "routing": routing}
+    if save:
+        new_id, duplicate = save_order_unique(extracted, upload.sha256, fuzzy=fuzzy)
+        if not new_id:
+            raise Exception("Order store returned no SalesOrderID. Check save_order_from_json return.")
+        result["salesOrderId"] = new_id
+        result["duplicate"] = duplicate
+    return result
 
 
 @app.get("/api/health")
 def health():
-    return {"status": "ok"}
+    # Answers during warm-up; "ready" turns true once the store is loaded
+    return {"status": "ok", "ready": warm_state["ready"], "warmUpSec": warm_state["seconds"]}
+
+
+@app.get("/api/metrics")
+def metrics_endpoint():
+    # Prometheus text format
+    if not METRICS_ENABLED:
+        return jsonify({"error": "Metrics are disabled (METRICS_ENABLED=0)"}), 404
+    return Response(render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.get("/api/cache/stats")
+def cache_stats():
+    return jsonify(get_cache().stats())
+
+
+@app.get("/api/llm/stats")
+def llm_stats_endpoint():
+    return jsonify(llm_stats.stats())
+
+
+@app.get("/api/routing/stats")
+def routing_stats_endpoint():
+    return jsonify(routing_stats.stats())
 
 
 @app.post("/api/extract-file")
 def extract_file():
-    filename, saved_path, error_resp = validate_and_save_upload()
+    upload, error_resp = read_validated_upload()
     if error_resp:
         return error_resp
 
     try:
-        extracted = extract_invoice_image(saved_path)
-        extracted = normalize_extracted(extracted)
+        extracted, validation, routing = extract_document(
+            upload.data, upload.mime, use_cache=use_cache_requested(), mode=mode_requested()
+        )
 
         return jsonify({
-            "filename": filename,
-            "extracted": extracted
+            "filename": upload.filename,
+            "extracted": extracted,
+            "validation": validation,
+            "routing": routing
         })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -86,27 +304,151 @@ def extract_file():
 
 @app.post("/api/extract-and-save-file")
 def extract_and_save_file():
-    filename, saved_path, error_resp = validate_and_save_upload()
+    upload, error_resp = read_validated_upload()
     if error_resp:
         return error_resp
 
     try:
-        extracted = extract_invoice_image(saved_path)
-        extracted = normalize_extracted(extracted)
+        result = run_extraction_job(upload, True, use_cache_requested(), fuzzy_requested(), mode_requested())
+        if result["duplicate"]:
+            result["message"] = "Duplicate invoice; returning the existing SalesOrderID"
+        else:
+            result["message"] = "Extracted (file) and saved"
+        return jsonify(result)
+    except SaveInProgress as e:
+        # Same invoice mid-save in another request; retrying returns its ID
+        return jsonify({"error": str(e)}), 409, {"Retry-After": "5"}
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        new_id = save_order_from_json(extracted)
-        if not new_id:
-            raise Exception("Excel save returned no SalesOrderID. Check save_order_from_json return.")
 
-        return jsonify({
-            "message": "Extracted (file) and saved",
-            "filename": filename,
-            "salesOrderId": new_id,
-            "extracted": extracted
-        })
+@app.post("/api/jobs")
+def create_job():
+    upload, error_resp = read_validated_upload()
+    if error_resp:
+        return error_resp
+
+    # save=0 extracts only; default extracts and saves
+    save = request_flag("save")
+
+    try:
+        job_id = job_manager.submit(run_extraction_job, upload, save, use_cache_requested(), fuzzy_requested(),
+                                    mode_requested())
+    except QueueFull as e:
+        return jsonify({"error": str(e)}), 429, {"Retry-After": "5"}
+
+    return jsonify({"jobId": job_id, "status": "queued"}), 202, {"Location": f"/api/jobs/{job_id}"}
+
+
+@app.get("/api/jobs/<job_id>")
+def get_job(job_id):
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+
+@app.post("/api/batch")
+def batch_extract():
+    uploads, rejected = collect_batch_uploads()
+    if not uploads and not rejected:
+        return jsonify({"error": "Missing files field"}), 400
+
+    events = run_batch(uploads, rejected, request_flag("save"), use_cache_requested(), fuzzy_requested(),
+                       mode_requested())
+
+    # ?stream=1 streams one JSON event per line as files finish
+    if request_flag("stream", "0"):
+        ndjson = (json.dumps(event) + "\n" for event in events)
+        return Response(stream_with_context(ndjson), mimetype="application/x-ndjson")
+
+    results, summary = [], {}
+    try:
+        for event in events:
+            if event["event"] == "file":
+                results.append({k: v for k, v in event.items() if k != "event"})
+            elif event["event"] == "saved":
+                saved = {o["index"]: o for o in event["orders"]}
+                for r in results:
+                    if r.get("index") in saved:
+                        order = saved[r["index"]]
+                        r["salesOrderId"] = order["salesOrderId"]
+                        if order.get("pending"):
+                            r["pending"] = True
+                        else:
+                            r["duplicate"] = order["duplicate"]
+            elif event["event"] == "done":
+                summary = {k: v for k, v in event.items() if k != "event"}
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return jsonify({"error": str(e), "results": results}), 500
+
+    return jsonify({**summary, "results": results})
+
+
+def jsonable_row(row: dict):
+    # Sheet dates come back as datetimes; send them as ISO strings
+    return {
+        k: v.isoformat() if isinstance(v, (datetime.datetime, datetime.date)) else v
+        for k, v in row.items()
+    }
+
+
+@app.get("/api/orders/<int:sales_order_id>")
+def get_order(sales_order_id):
+    order = get_store().get_order(sales_order_id)
+    if not order:
+        return jsonify({"error": f"SalesOrderID {sales_order_id} not found"}), 404
+
+    return jsonify({
+        "header": jsonable_row(order["header"]),
+        "details": [jsonable_row(d) for d in order["details"]]
+    })
+
+
+@app.get("/api/orders")
+def list_orders():
+    date_from = request.args.get("from")
+    date_to = request.args.get("to")
+    for value in (date_from, date_to):
+        if value and not date_key(value):
+            return jsonify({"error": f"Invalid date: {value}. Use YYYY-MM-DD"}), 400
+
+    try:
+        limit = min(max(int(request.args.get("limit", 100)), 1), 1000)
+        offset = max(int(request.args.get("offset", 0)), 0)
+    except ValueError:
+        return jsonify({"error": "limit and offset must be integers"}), 400
+
+    headers, total = get_store().query_orders(
+        date_from=date_from,
+        date_to=date_to,
+        customer=request.args.get("customer"),
+        po=request.args.get("po"),
+        limit=limit,
+        offset=offset
+    )
+    return jsonify({
+        "total": total,
+        "limit": limit,
+        "offset": offset,
+        "orders": [jsonable_row(h) for h in headers]
+    })
+
+
+@app.get("/api/reports/monthly")
+def monthly_report():
+    date_from = request.args.get("from")
+    date_to = request.args.get("to")
+    for value in (date_from, date_to):
+        if value and not date_key(value):
+            return jsonify({"error": f"Invalid date: {value}. Use YYYY-MM-DD"}), 400
+
+    return jsonify({"months": get_store().monthly_totals(date_from=date_from, date_to=date_to)})
 
 
 if __name__ == "__main__":
+    # With debug=True the reloader's watcher process runs this too; only the
+    # child that serves requests warms up
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_warm_up()
     app.run(host="127.0.0.1", port=5000, debug=True)
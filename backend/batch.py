@@ -0,0 +1,23 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "500"))
+
+
+def iter_extractions(uploads, extract_fn, concurrency=BATCH_CONCURRENCY):
+    # Runs extract_fn(upload) for each Upload with at most `concurrency` calls
+    # in flight, and yields (index, filename, extracted, error) as calls
+    # complete (not in upload order). Rate limits apply per LLM request (see
+    # llm_extractor), so cache and template hits aren't throttled.
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="batch") as pool:
+        futures = {
+            pool.submit(extract_fn, upload): (index, upload.filename)
+            for index, upload in enumerate(uploads)
+        }
+        for future in as_completed(futures):
+            index, filename = futures[future]
+            try:
+                yield index, filename, future.result(), None
+            except Exception as e:
+                yield index, filename, None, str(e)
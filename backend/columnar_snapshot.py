@@ -0,0 +1,302 @@
+import datetime
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+
+from file_lock import FileLock
+from order_index import date_key
+from xlsx_stream import XlsxReader
+
+try:
+    import pyarrow as pa
+except ImportError:  # optional; callers fall back to reading the .xlsx
+    pa = None
+
+COLUMNAR_SNAPSHOT = os.getenv("COLUMNAR_SNAPSHOT", "1") != "0"
+# Derived data (rebuilt from the workbook when missing), so it lives outside
+# the repo by default
+COLUMNAR_DIR = os.getenv("COLUMNAR_DIR", os.path.join(tempfile.gettempdir(), "invoice-columnar"))
+# Appends add one small part file per sheet; merge once there are this many
+COLUMNAR_MAX_PARTS = int(os.getenv("COLUMNAR_MAX_PARTS", "32"))
+# Rows per record batch when a whole sheet is (re)built
+COLUMNAR_CHUNK_ROWS = int(os.getenv("COLUMNAR_CHUNK_ROWS", "65536"))
+
+SHEETS = ("SalesOrderHeader", "SalesOrderDetail")
+
+# Fixed column types, so every part of a sheet shares one schema no matter
+# what mix of values the workbook or the LLM produced. Anything not listed
+# is stored as text.
+INT_COLUMNS = {
+    "SalesOrderID", "SalesOrderDetailID", "RevisionNumber", "Status", "SalesPersonID",
+    "TerritoryID", "BillToAddressID", "ShipToAddressID", "ShipMethodID", "CreditCardID",
+    "CurrencyRateID", "SpecialOfferID"
+}
+FLOAT_COLUMNS = {"SubTotal", "TaxAmt", "Freight", "TotalDue", "OrderQty", "UnitPrice", "UnitPriceDiscount", "LineTotal"}
+DATE_COLUMNS = {"OrderDate", "DueDate", "ShipDate"}
+BOOL_COLUMNS = {"OnlineOrderFlag"}
+# Numbers in the case-study workbook, but codes when they come from an
+# invoice (productNumber, customerId): stored as text, and integer text is
+# turned back into ints on read
+ID_TEXT_COLUMNS = {"CustomerID", "ProductID"}
+_INT_TEXT = re.compile(r"-?\d+")
+
+
+def columnar_available():
+    return COLUMNAR_SNAPSHOT and pa is not None
+
+
+def snapshot_dir_for(xlsx_path):
+    # One snapshot directory per workbook, keyed on its absolute path so two
+    # workbooks with the same name never share one, e.g.
+    # <COLUMNAR_DIR>/Case Study Data_tiny-3f2a9c0e1b7d
+    path = os.path.abspath(xlsx_path)
+    digest = hashlib.sha1(path.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(COLUMNAR_DIR, f"{os.path.splitext(os.path.basename(path))[0]}-{digest}")
+
+
+def xlsx_stamp(xlsx_path):
+    st = os.stat(xlsx_path)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def _column_type(col):
+    if col in INT_COLUMNS:
+        return pa.int64()
+    if col in FLOAT_COLUMNS:
+        return pa.float64()
+    if col in DATE_COLUMNS:
+        return pa.timestamp("us")
+    if col in BOOL_COLUMNS:
+        return pa.bool_()
+    return pa.string()
+
+
+def _coerce(col, value):
+    if value is None or value == "":
+        return None
+    try:
+        if col in INT_COLUMNS:
+            return int(float(value))
+        if col in FLOAT_COLUMNS:
+            return float(value)
+        if col in DATE_COLUMNS:
+            if isinstance(value, datetime.datetime):
+                return value
+            if isinstance(value, datetime.date):
+                return datetime.datetime(value.year, value.month, value.day)
+            try:
+                return datetime.datetime.fromisoformat(str(value))
+            except ValueError:
+                key = date_key(value)
+                return datetime.datetime.fromisoformat(key) if key else None
+        if col in BOOL_COLUMNS:
+            if isinstance(value, str):
+                return value.strip().lower() in ("1", "true", "yes")
+            return bool(value)
+    except (TypeError, ValueError):
+        return None
+    return str(value)
+
+
+def _schema(cols):
+    return pa.schema([(col, _column_type(col)) for col in cols if col is not None])
+
+
+def _batch(cols, rows):
+    # rows are tuples in `cols` order; unnamed columns are dropped
+    arrays = [
+        pa.array([_coerce(col, row[i] if i < len(row) else None) for row in rows], type=_column_type(col))
+        for i, col in enumerate(cols) if col is not None
+    ]
+    return pa.RecordBatch.from_arrays(arrays, schema=_schema(cols))
+
+
+def _table(cols, rows):
+    rows = rows if isinstance(rows, list) else list(rows)
+    return pa.Table.from_batches([_batch(cols, rows)])
+
+
+def _batches(cols, rows, chunk_rows=COLUMNAR_CHUNK_ROWS):
+    # Record batches of up to chunk_rows rows, so a sheet streamed from the
+    # workbook is never held in memory as a whole
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_rows:
+            yield _batch(cols, chunk)
+            chunk = []
+    if chunk:
+        yield _batch(cols, chunk)
+
+
+class ColumnarSnapshot:
+    # Arrow IPC copy of SalesOrderHeader / SalesOrderDetail next to a workbook.
+    # Each sheet is a list of uncompressed part files (memory-mapped on read,
+    # so reads are near zero-copy). manifest.json records the parts and the
+    # workbook stamp (mtime, size) they reflect; a stale stamp means rebuild.
+
+    def __init__(self, xlsx_path, directory=None, max_parts=COLUMNAR_MAX_PARTS):
+        if pa is None:
+            raise Exception("pyarrow is not installed; columnar snapshots are unavailable")
+        self.xlsx_path = xlsx_path
+        self.directory = directory or snapshot_dir_for(xlsx_path)
+        self.manifest_path = os.path.join(self.directory, "manifest.json")
+        self.max_parts = max_parts
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = FileLock(os.path.join(self.directory, "snapshot.lock"))
+
+    def manifest(self):
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def is_current(self, stamp=None):
+        manifest = self.manifest()
+        return bool(manifest) and manifest.get("stamp") == list(stamp or xlsx_stamp(self.xlsx_path))
+
+    def rebuild(self, stamp, sheets):
+        # sheets: {name: (columns, iterable of row tuples)}; rows are consumed
+        # chunk by chunk
+        with self._lock:
+            old = self.manifest()
+            parts = {name: [self._write_part(name, _schema(cols), _batches(cols, rows))]
+                     for name, (cols, rows) in sheets.items()}
+            self._commit(stamp, parts, old)
+
+    def append(self, prev_stamp, stamp, sheets):
+        # sheets: {name: (columns, list of row dicts)}. Only valid on top of
+        # the snapshot taken at prev_stamp; returns False if that isn't the
+        # current one (the caller should rebuild instead).
+        with self._lock:
+            old = self.manifest()
+            if not old or old.get("stamp") != list(prev_stamp):
+                return False
+
+            parts = {name: list(files) for name, files in old["parts"].items()}
+            written = []
+            for name, (cols, rows) in sheets.items():
+                if rows:
+                    table = _table(cols, [[row.get(c) for c in cols] for row in rows])
+                    written.append(self._write_part(name, table.schema, table.to_batches()))
+                    parts.setdefault(name, []).append(written[-1])
+                if len(parts.get(name, [])) > self.max_parts:
+                    merged = pa.concat_tables(self._read_parts(parts[name]))
+                    parts[name] = [self._write_part(name, merged.schema, merged.to_batches())]
+            self._commit(stamp, parts, old, written)
+            return True
+
+    def _write_part(self, name, schema, batches):
+        filename = f"{name}-{time.time_ns():020d}.arrow"
+        tmp_path = os.path.join(self.directory, filename + ".tmp")
+        with pa.OSFile(tmp_path, "wb") as sink:
+            with pa.ipc.new_file(sink, schema) as writer:
+                for batch in batches:
+                    writer.write_batch(batch)
+        os.replace(tmp_path, os.path.join(self.directory, filename))
+        return filename
+
+    def _commit(self, stamp, parts, old, written=()):
+        manifest = {"stamp": list(stamp), "parts": parts}
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+
+        # Parts no longer referenced; open readers keep their mapping on POSIX
+        keep = {f for files in parts.values() for f in files}
+        stale = [f for files in (old or {}).get("parts", {}).values() for f in files]
+        for filename in stale + list(written):
+            if filename not in keep:
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except OSError:
+                    pass
+
+    def _read_parts(self, files, columns=None):
+        tables = []
+        for filename in files:
+            source = pa.memory_map(os.path.join(self.directory, filename), "r")
+            table = pa.ipc.open_file(source).read_all()
+            tables.append(table.select(columns) if columns else table)
+        return tables
+
+    def read_table(self, sheet, columns=None):
+        manifest = self.manifest()
+        if not manifest or sheet not in manifest["parts"]:
+            raise Exception(f"No columnar snapshot of {sheet} for {self.xlsx_path}")
+        tables = self._read_parts(manifest["parts"][sheet], columns)
+        return pa.concat_tables(tables) if len(tables) > 1 else tables[0]
+
+    def read_frame(self, sheet, columns=None):
+        import pandas as pd
+
+        # Nullable ints instead of float64 for ID columns with gaps
+        frame = self.read_table(sheet, columns).to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get)
+        for col in ID_TEXT_COLUMNS.intersection(frame.columns):
+            frame[col] = _restore_ints(frame[col])
+        return frame
+
+    def build_from_xlsx(self):
+        # For workbooks no running store maintains (e.g. the scripts' demo
+        # file) and for the store's own rebuilds; streamed from the sheet XML
+        stamp = xlsx_stamp(self.xlsx_path)
+        with XlsxReader(self.xlsx_path) as reader:
+            self.rebuild(stamp, {name: (reader.header(name), reader.rows(name)) for name in SHEETS})
+
+
+def _restore_ints(series):
+    # Integer text back to ints; an all-numeric column becomes Int64, a mix
+    # of numbers and codes stays object
+    import pandas as pd
+
+    values = [int(v) if isinstance(v, str) and _INT_TEXT.fullmatch(v) else v for v in series]
+    numeric = all(isinstance(v, int) or pd.isna(v) for v in values)
+    return pd.Series(values, index=series.index, dtype="Int64" if numeric else object, name=series.name)
+
+
+def monthly_totals_from_frame(frame, date_from=None, date_to=None):
+    # Orders and amounts per "YYYY-MM" from a SalesOrderHeader frame
+    import pandas as pd
+
+    dates = pd.to_datetime(frame["OrderDate"], errors="coerce")
+    keep = dates.notna()
+    if date_from:
+        keep &= dates >= pd.Timestamp(date_key(date_from))
+    if date_to:
+        keep &= dates < pd.Timestamp(date_key(date_to)) + pd.Timedelta(days=1)
+
+    amounts = frame.loc[keep, ["SubTotal", "TaxAmt", "Freight", "TotalDue"]].apply(pd.to_numeric, errors="coerce")
+    grouped = amounts.groupby(dates[keep].dt.strftime("%Y-%m")).agg(["count", "sum"])
+    return [
+        {
+            "month": month,
+            "orders": int(row[("TotalDue", "count")]),
+            "subTotal": round(float(row[("SubTotal", "sum")]), 2),
+            "taxAmt": round(float(row[("TaxAmt", "sum")]), 2),
+            "freight": round(float(row[("Freight", "sum")]), 2),
+            "totalDue": round(float(row[("TotalDue", "sum")]), 2)
+        }
+        for month, row in grouped.iterrows()
+    ]
+
+
+def read_sheet(xlsx_path, sheet, columns=None):
+    # DataFrame for one sheet of a workbook, served from its columnar snapshot
+    # (built on first use or when the workbook changed). Without pyarrow the
+    # requested columns are streamed straight from the workbook instead.
+    if not columnar_available():
+        import pandas as pd
+        with XlsxReader(xlsx_path) as reader:
+            names = columns or reader.header(sheet)
+            return pd.DataFrame.from_records(reader.rows(sheet, columns), columns=names)
+
+    snapshot = ColumnarSnapshot(xlsx_path)
+    if not snapshot.is_current():
+        print("INFO: building columnar snapshot for", xlsx_path)
+        snapshot.build_from_xlsx()
+    return snapshot.read_frame(sheet, columns)
@@ -0,0 +1,271 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from order_index import date_key
+from order_mapping import to_float
+
+DEDUPE_ENABLED = os.getenv("DEDUPE_ENABLED", "1") != "0"
+DEDUPE_PATH = os.getenv("DEDUPE_PATH", "data/dedupe.sqlite3")
+DEDUPE_FUZZY = os.getenv("DEDUPE_FUZZY", "0") == "1"
+FUZZY_TOTAL_TOLERANCE = 0.01  # 1% of totalDue
+# A reservation not confirmed within this long belongs to a process that died
+# mid-save and no longer blocks the invoice
+PENDING_TTL_SEC = float(os.getenv("DEDUPE_PENDING_TTL_SEC", "300"))
+PENDING_WAIT_SEC = 10
+PENDING = 0  # sales_order_id of a reserved, not yet saved, invoice
+
+
+class SaveInProgress(Exception):
+    # Another request's save of the same invoice was still unconfirmed after
+    # PENDING_WAIT_SEC. `results` is save_unique's list with None for those
+    # invoices (the rest are saved); retrying later returns their IDs.
+    def __init__(self, results):
+        self.results = results
+        pending = sum(1 for result in results if result is None)
+        super().__init__(f"{pending} invoice(s) are still being saved by another request; retry shortly")
+
+
+def _alnum(value):
+    return re.sub(r"[^0-9a-z]", "", str(value or "").lower())
+
+
+def _invoice_key(extracted: dict):
+    # "INV-000123" and "inv 123" normalize to the same key
+    return _alnum(extracted.get("invoiceNumber")).lstrip("0")
+
+
+def _total_cents(extracted: dict):
+    return int(round(to_float(extracted.get("totalDue"), 0) * 100))
+
+
+def _customer_key(extracted: dict):
+    customer = extracted.get("customer") or {}
+    return " ".join(re.sub(r"[^0-9a-z ]", " ", str(customer.get("name") or "").lower()).split())
+
+
+def _identifiable(extracted: dict):
+    # Needs an invoice number, or an order date plus customer. A total alone
+    # (or nothing, for failed extractions) would make different vendors'
+    # invoices collide.
+    return bool(_invoice_key(extracted) or (date_key(extracted.get("orderDate")) and _customer_key(extracted)))
+
+
+def fingerprint(extracted: dict):
+    parts = [
+        _invoice_key(extracted),
+        _customer_key(extracted),
+        date_key(extracted.get("orderDate")) or "",
+        str(_total_cents(extracted))
+    ]
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+
+class DedupeIndex:
+    # Persistent map from invoice fingerprints and image hashes to the
+    # SalesOrderID they were saved as. Fuzzy mode also matches on invoice
+    # number + order date with totals within 1%, ignoring the customer name.
+    # Rows are reserved (PENDING) before the order is saved and confirmed
+    # after, so a save never happens without its fingerprints on record.
+
+    def __init__(self, path=DEDUPE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                fingerprint TEXT PRIMARY KEY,
+                sales_order_id INTEGER NOT NULL,
+                invoice_key TEXT,
+                order_date TEXT,
+                total_cents INTEGER,
+                created REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_fingerprints_fuzzy ON fingerprints(invoice_key, order_date);
+            CREATE TABLE IF NOT EXISTS images (
+                image_hash TEXT PRIMARY KEY,
+                sales_order_id INTEGER NOT NULL,
+                created REAL
+            );
+        """)
+        # Indexes created before reservations had no `created` column
+        if "created" not in [row[1] for row in self._conn.execute("PRAGMA table_info(images)")]:
+            self._conn.execute("ALTER TABLE images ADD COLUMN created REAL")
+
+    def find_image(self, image_hash):
+        if not image_hash:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT sales_order_id FROM images WHERE image_hash = ?", (image_hash,)
+            ).fetchone()
+        return row[0] if row and row[0] != PENDING else None
+
+    def _live(self, sales_order_id, created):
+        # Stale reservations are ignored (and overwritten by the next save)
+        return sales_order_id != PENDING or (created or 0) > time.time() - PENDING_TTL_SEC
+
+    def _find(self, extracted, image_hash, fuzzy):
+        # SalesOrderID, PENDING (another save is in flight) or None
+        if image_hash:
+            row = self._conn.execute(
+                "SELECT sales_order_id, created FROM images WHERE image_hash = ?", (image_hash,)
+            ).fetchone()
+            if row and self._live(*row):
+                return row[0]
+
+        if not _identifiable(extracted):
+            return None
+
+        row = self._conn.execute(
+            "SELECT sales_order_id, created FROM fingerprints WHERE fingerprint = ?", (fingerprint(extracted),)
+        ).fetchone()
+        if row and self._live(*row):
+            return row[0]
+
+        invoice_key = _invoice_key(extracted)
+        if fuzzy and invoice_key:
+            total = _total_cents(extracted)
+            for sales_order_id, other_total, created in self._conn.execute(
+                "SELECT sales_order_id, total_cents, created FROM fingerprints WHERE invoice_key = ? AND order_date = ?",
+                (invoice_key, date_key(extracted.get("orderDate")) or "")
+            ):
+                if self._live(sales_order_id, created) and \
+                        abs(other_total - total) <= max(1, abs(total) * FUZZY_TOTAL_TOLERANCE):
+                    return sales_order_id
+        return None
+
+    def _reserve(self, extracted, image_hash):
+        # REPLACE only ever overwrites a stale reservation: _find saw no live row
+        now = time.time()
+        if _identifiable(extracted):
+            self._conn.execute(
+                "INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?, ?, ?)",
+                (fingerprint(extracted), PENDING, _invoice_key(extracted),
+                 date_key(extracted.get("orderDate")) or "", _total_cents(extracted), now)
+            )
+        if image_hash:
+            self._conn.execute("INSERT OR REPLACE INTO images VALUES (?, ?, ?)", (image_hash, PENDING, now))
+
+    def _keys(self, extracted, image_hash):
+        return (fingerprint(extracted) if _identifiable(extracted) else None), image_hash
+
+    def _settle(self, items, sales_order_ids=None):
+        # Confirms reservations with their SalesOrderIDs, or releases them
+        # (sales_order_ids None) when the save failed
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for n, (extracted, image_hash) in enumerate(items):
+                    fp, image_hash = self._keys(extracted, image_hash)
+                    for table, column, key in (("fingerprints", "fingerprint", fp), ("images", "image_hash", image_hash)):
+                        if key is None:
+                            continue
+                        if sales_order_ids is None:
+                            self._conn.execute(f"DELETE FROM {table} WHERE {column} = ? AND sales_order_id = ?",
+                                               (key, PENDING))
+                        else:
+                            self._conn.execute(f"UPDATE {table} SET sales_order_id = ? WHERE {column} = ?",
+                                               (sales_order_ids[n], key))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _wait_confirmed(self, extracted, image_hash, fuzzy):
+        # SalesOrderID of an invoice another save is writing right now; None
+        # if that save failed (its reservation was released), PENDING if it
+        # is still unconfirmed after PENDING_WAIT_SEC
+        deadline = time.monotonic() + PENDING_WAIT_SEC
+        while True:
+            with self._lock:
+                existing = self._find(extracted, image_hash, fuzzy)
+            if existing != PENDING or time.monotonic() > deadline:
+                return existing
+            time.sleep(0.05)
+
+    def save_unique(self, extracted_list, image_hashes, save_fn, fuzzy=DEDUPE_FUZZY):
+        # Check + reserve in one write transaction, so concurrent retries of
+        # the same invoice (any worker) can't both get saved; then save and
+        # confirm. Returns [(sales_order_id, is_duplicate)] in input order.
+        # Raises SaveInProgress if another save of one of them is still
+        # running after PENDING_WAIT_SEC (never saves it a second time).
+        results = [None] * len(extracted_list)
+        fresh, in_flight = [], []
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                seen = {}
+                for i, (extracted, image_hash) in enumerate(zip(extracted_list, image_hashes)):
+                    existing = self._find(extracted, image_hash, fuzzy)
+                    key = fingerprint(extracted) if _identifiable(extracted) else i
+                    if existing is None and key in seen:
+                        # Same invoice twice in one batch
+                        results[i] = ("batch", seen[key])
+                    elif existing is None:
+                        seen[key] = i
+                        fresh.append(i)
+                        self._reserve(extracted, image_hash)
+                    elif existing == PENDING:
+                        in_flight.append(i)
+                    else:
+                        results[i] = (existing, True)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+        items = [(extracted_list[i], image_hashes[i]) for i in fresh]
+        try:
+            new_ids = save_fn([extracted_list[i] for i in fresh]) if fresh else []
+        except Exception:
+            self._settle(items)
+            raise
+        self._settle(items, new_ids)
+        for i, new_id in zip(fresh, new_ids):
+            results[i] = (new_id, False)
+
+        released, timed_out = [], False
+        for i in in_flight:
+            existing = self._wait_confirmed(extracted_list[i], image_hashes[i], fuzzy)
+            if existing is None:
+                released.append(i)
+            elif existing == PENDING:
+                timed_out = True
+            else:
+                results[i] = (existing, True)
+        if released:
+            # The other save failed and gave its reservation back: this one
+            # goes ahead (reserving afresh, so it can't race a third save)
+            try:
+                retried = self.save_unique([extracted_list[i] for i in released],
+                                           [image_hashes[i] for i in released], save_fn, fuzzy)
+            except SaveInProgress as e:
+                retried, timed_out = e.results, True
+            for i, result in zip(released, retried):
+                results[i] = result
+
+        for i, result in enumerate(results):
+            if result is not None and result[0] == "batch":
+                results[i] = (results[result[1]][0], True)
+        if timed_out:
+            raise SaveInProgress(results)
+        return results
+
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_dedupe_index():
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = DedupeIndex()
+    return _index
@@ -0,0 +1,151 @@
+import io
+import os
+import threading
+
+from PIL import Image, ImageSequence
+
+from metrics import timed
+
+# Multi-page uploads (PDF, TIFF). Pages are opened up front, but a page is
+# only rasterized when something asks for its image; PDF pages with an
+# embedded text layer usually never are.
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+MULTIPAGE_TYPES = {"application/pdf", "image/tiff"}
+
+PDF_RENDER_DPI = int(os.getenv("PDF_RENDER_DPI", "200"))
+DOCUMENT_MAX_PAGES = int(os.getenv("DOCUMENT_MAX_PAGES", "50"))
+# Scanned PDFs often carry no text layer, or a few stray characters
+PDF_MIN_TEXT_CHARS = int(os.getenv("PDF_MIN_TEXT_CHARS", "80"))
+
+HEADER_FIELDS = ("invoiceNumber", "orderDate", "dueDate", "shipDate", "purchaseOrderNumber", "terms", "shipVia")
+TOTAL_FIELDS = ("subtotal", "taxRate", "tax", "freight", "totalDue")
+
+
+class Page:
+    # One page: `text` is the embedded text layer (None if absent or too
+    # short), image() renders the page as PNG bytes on first use
+
+    def __init__(self, number, text, render):
+        self.number = number
+        self.text = text
+        self._render = render
+        self._image = None
+
+    def image(self):
+        if self._image is None:
+            self._image = self._render()
+        return self._image
+
+
+class Document:
+    # PDFium and a seeking PIL image are not thread-safe, so rendering is
+    # serialized; the extraction calls that follow run in parallel.
+
+    def __init__(self, data, mime):
+        self._lock = threading.Lock()
+        self._pdf = None
+        self._tiff = None
+        if mime == "application/pdf":
+            self.pages = self._open_pdf(bytes(data))
+        elif mime == "image/tiff":
+            self.pages = self._open_tiff(bytes(data))
+        else:
+            raise ValueError(f"Not a multi-page document type: {mime}")
+        if not self.pages:
+            raise ValueError("Document has no pages")
+
+    def _open_pdf(self, data):
+        if pdfium is None:
+            raise Exception("PDF support needs pypdfium2 (pip install pypdfium2)")
+        self._pdf = pdfium.PdfDocument(data)
+        count = len(self._pdf)
+        if count > DOCUMENT_MAX_PAGES:
+            raise ValueError(f"PDF has {count} pages (max {DOCUMENT_MAX_PAGES})")
+
+        pages = []
+        for number in range(count):
+            page = self._pdf[number]
+            text = page.get_textpage().get_text_range().strip()
+            pages.append(Page(number + 1, text if len(text) >= PDF_MIN_TEXT_CHARS else None,
+                              lambda number=number: self._render_pdf_page(number)))
+        return pages
+
+    def _render_pdf_page(self, number):
+        with self._lock, timed("page_render"):
+            bitmap = self._pdf[number].render(scale=PDF_RENDER_DPI / 72, grayscale=True)
+            return _png(bitmap.to_pil())
+
+    def _open_tiff(self, data):
+        self._tiff = Image.open(io.BytesIO(data))
+        count = getattr(self._tiff, "n_frames", 1)
+        if count > DOCUMENT_MAX_PAGES:
+            raise ValueError(f"TIFF has {count} pages (max {DOCUMENT_MAX_PAGES})")
+        return [Page(number + 1, None, lambda number=number: self._render_tiff_frame(number))
+                for number in range(count)]
+
+    def _render_tiff_frame(self, number):
+        with timed("page_render"):
+            with self._lock:
+                frame = ImageSequence.Iterator(self._tiff)[number].copy()
+            if frame.mode not in ("1", "L", "RGB"):
+                frame = frame.convert("RGB")
+            return _png(frame)
+
+    def close(self):
+        with self._lock:
+            if self._pdf is not None:
+                self._pdf.close()
+            if self._tiff is not None:
+                self._tiff.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _png(img):
+    buf = io.BytesIO()
+    img.save(buf, "PNG")
+    return buf.getvalue()
+
+
+def _blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def merge_pages(extractions):
+    # One invoice from per-page extractions (in page order). Header fields
+    # come from the first page that has them, totals from the last, line
+    # items are concatenated. Returns (merged, conflicting header fields).
+    merged, conflicts = {}, []
+    for field in HEADER_FIELDS:
+        values = [e.get(field) for e in extractions if not _blank(e.get(field))]
+        merged[field] = values[0] if values else None
+        if len({str(v).strip().lower() for v in values}) > 1:
+            conflicts.append(field)
+
+    customers = [e.get("customer") for e in extractions if isinstance(e.get("customer"), dict)]
+    named = [c for c in customers if not _blank(c.get("name")) or c.get("customerId") or c.get("accountNumber")]
+    merged["customer"] = (named or customers or [{"customerId": 0, "accountNumber": None, "name": None}])[0]
+
+    for field in TOTAL_FIELDS:
+        # A page without totals may still report 0 for them
+        values = [e.get(field) for e in extractions if not _blank(e.get(field))]
+        nonzero = [v for v in values if v not in (0, "0", 0.0)]
+        merged[field] = (nonzero or values or [None])[-1]
+
+    items = []
+    for extraction in extractions:
+        page_items = [it for it in (extraction.get("lineItems") or []) if isinstance(it, dict)]
+        # "Continued" pages sometimes repeat the last row of the previous one
+        if items and page_items and page_items[0] == items[-1]:
+            page_items = page_items[1:]
+        items.extend(page_items)
+    merged["lineItems"] = items
+    return merged, conflicts
@@ -1,106 +1,520 @@
-from openpyxl import load_workbook
-
-DEMO_XLSX = "data/Case Study Data_tiny.xlsx"  # change if needed
-
-def get_columns(ws):
-    return [cell.value for cell in ws[1]]
-
-def get_next_id_from_sheet(ws, id_col):
-    cols = get_columns(ws)
-    if id_col not in cols:
-        raise Exception(f"{id_col} not found in {ws.title}")
-
-    col_idx = cols.index(id_col) + 1
-
-    # Walk backwards to find last non-empty ID
-    for r in range(ws.max_row, 1, -1):
-        val = ws.cell(row=r, column=col_idx).value
-        if val is not None:
-            return int(val) + 1
-
-    return 1
-
-def to_float(val, default=0.0):
-    try:
-        return float(val)
-    except Exception:
-        return default
-
-def save_order_from_json(extracted: dict):
-    wb = load_workbook(DEMO_XLSX)
-
-    ws_header = wb["SalesOrderHeader"]
-    ws_detail = wb["SalesOrderDetail"]
-
-    header_cols = get_columns(ws_header)
-    detail_cols = get_columns(ws_detail)
-
-    # 1) Next IDs (fast, no pandas)
-    sales_order_id = get_next_id_from_sheet(ws_header, "SalesOrderID")
-    detail_id = get_next_id_from_sheet(ws_detail, "SalesOrderDetailID")
-
-    # 2) Line items
-    items = extracted.get("lineItems") or []
-    for it in items:
-        qty = to_float(it.get("qty"), 0)
-        unit = to_float(it.get("unitPrice"), 0)
-        if it.get("lineTotal") is None:
-            it["lineTotal"] = qty * unit
-
-    computed_subtotal = sum(to_float(i.get("lineTotal"), 0) for i in items)
-    subtotal = to_float(extracted.get("subtotal"), computed_subtotal)
-
-    tax = extracted.get("tax")
-    tax_rate = extracted.get("taxRate")
-    if tax is None and tax_rate is not None:
-        tax = subtotal * to_float(tax_rate, 0)
-    tax = to_float(tax, 0)
-
-    freight = to_float(extracted.get("freight"), 0)
-
-    total_due = extracted.get("totalDue")
-    if total_due is None:
-        total_due = subtotal + tax + freight
-    total_due = to_float(total_due, 0)
-
-    # 3) Build header row dict
-    header_row = {
-        "SalesOrderID": sales_order_id,
-        "RevisionNumber": 1,
-        "OrderDate": extracted.get("orderDate"),
-        "DueDate": extracted.get("dueDate"),
-        "ShipDate": extracted.get("shipDate"),
-        "Status": 1,
-        "OnlineOrderFlag": False,
-        "SalesOrderNumber": f"SO-{sales_order_id}",
-        "PurchaseOrderNumber": extracted.get("purchaseOrderNumber") or extracted.get("invoiceNumber"),
-        "AccountNumber": (extracted.get("customer") or {}).get("accountNumber"),
-        "CustomerID": (extracted.get("customer") or {}).get("customerId") or 0,
-        "SubTotal": subtotal,
-        "TaxAmt": tax,
-        "Freight": freight,
-        "TotalDue": total_due,
-        "Comment": f"Fast insert: {extracted.get('invoiceNumber', 'N/A')}"
-    }
-
-    # 4) Append header in correct column order
-    ws_header.append([header_row.get(col, None) for col in header_cols])
-
-    # 5) Append all details (no repeated file open/save)
-    for it in items:
-        detail_row = {
-            "SalesOrderID": sales_order_id,
-            "SalesOrderDetailID": detail_id,
-            "OrderQty": to_float(it.get("qty"), 0),
-            "UnitPrice": to_float(it.get("unitPrice"), 0),
-            "UnitPriceDiscount": to_float(it.get("unitPriceDiscount"), 0),
-            "LineTotal": to_float(it.get("lineTotal"), 0),
-            "ProductID": it.get("productNumber"),
-            "CarrierTrackingNumber": None,
-            "SpecialOfferID": None
+import os
+import shutil
+import threading
+
+from columnar_snapshot import ColumnarSnapshot, columnar_available, monthly_totals_from_frame
+from file_lock import FileLock
+from id_allocator import IdAllocator
+from metrics import WORKBOOK_ORDERS, WORKBOOK_PENDING_ROWS, WORKBOOK_ROWS_WRITTEN, inc, set_gauge, timed
+from order_journal import JOURNAL_DIR, OrderJournal, read_segment
+from order_index import OrderIndex
+from order_mapping import build_order_rows
+from order_store import OrderStore
+# Re-exported so `from excel_store_fast import save_order_from_json` keeps working
+from order_store import save_order_from_json, save_orders_from_json  # noqa: F401
+from workbook_shards import (EXCEL_SHARD_DIR, EXCEL_SHARD_MAX_ORDERS, EXCEL_SHARDING, ShardManifest,
+                             create_empty_workbook, current_month, merge_workbooks, rotation_due, shard_entry)
+from xlsx_stream import XlsxReader
+
+DEMO_XLSX = os.getenv("ORDER_XLSX_PATH", "data/Case Study Data_tiny.xlsx")
+
+# Compaction settings: journaled rows are folded into the .xlsx every
+# FLUSH_INTERVAL_SEC seconds, or sooner once FLUSH_EVERY_ROWS rows are pending.
+FLUSH_INTERVAL_SEC = float(os.getenv("EXCEL_FLUSH_INTERVAL_SEC", "5"))
+FLUSH_EVERY_ROWS = int(os.getenv("EXCEL_FLUSH_EVERY_ROWS", "200"))
+
+def _tracked(rows, col, ids=None, max_id=None):
+    # Passes rows through, collecting the IDs in `col` into a set and/or
+    # their maximum into max_id[0]
+    for row in rows:
+        value = row[col]
+        if value is not None:
+            if ids is not None:
+                ids.add(value)
+            if max_id is not None:
+                max_id[0] = max(max_id[0], int(value))
+        yield row
+
+class ExcelOrderStore(OrderStore):
+    # Long-lived store: every order is first made durable in an append-only
+    # journal. A background compactor folds journal segments into the
+    # workbook in batches and swaps the .xlsx in atomically, so a crash never
+    # leaves a half-written workbook behind.
+    #
+    # Safe to use from several worker processes sharing the same files:
+    # journal appends and compactions take inter-process file locks, so one
+    # compaction writes the orders of every worker (group commit) and a
+    # worker reloads the workbook if another one replaced it in between.
+    #
+    # Startup only streams the sheets (xlsx_stream) to fill the indexes and
+    # ID counters; the openpyxl workbook is loaded by the first compaction
+    # that writes to it. With sharding (see workbook_shards) that is only the
+    # active shard; sealed shards are streamed once at startup.
+
+    def __init__(self, path=DEMO_XLSX, journal_dir=JOURNAL_DIR,
+                 flush_interval=FLUSH_INTERVAL_SEC, flush_every_rows=FLUSH_EVERY_ROWS,
+                 sharding=EXCEL_SHARDING, shard_dir=EXCEL_SHARD_DIR, shard_max_orders=EXCEL_SHARD_MAX_ORDERS):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_every_rows = flush_every_rows
+        self.journal = OrderJournal(journal_dir)
+        self.snapshots_written = 0
+
+        self.sharding = sharding
+        self.shard_max_orders = shard_max_orders
+        self.shards = ShardManifest(shard_dir) if sharding != "off" else None
+
+        # _lock guards the dirty counter (held only briefly), _io_lock plus
+        # the compaction file lock serialize workbook mutation + save.
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._compact_lock = FileLock(os.path.join(journal_dir, "compact.lock"))
+        self._dirty_rows = 0
+
+        # Lookup indexes over every order (all shards); kept current by every
+        # append and compaction. _order_ids: IDs already materialized in a
+        # workbook, which makes replay idempotent when a crash lands between
+        # the workbook swap and segment removal.
+        self.index = OrderIndex()
+        self._order_ids = set()
+        # Next IDs after the sealed shards
+        self._sealed_next = {"SalesOrderID": 1, "SalesOrderDetailID": 1}
+        self._sealed_columnar = {}
+
+        with self._compact_lock:
+            if self.shards:
+                self._open_shards()
+            # Arrow copy of both sheets for analytics reads; kept in step with
+            # every snapshot write (optional, needs pyarrow)
+            self.columnar = ColumnarSnapshot(self.path) if columnar_available() else None
+            self._load_workbook()
+
+        # Replay anything a previous process journaled but never compacted
+        replayed = self.flush()
+        if replayed:
+            print("INFO: replayed", replayed, "journaled rows into", path)
+
+        # Seed the shared counters once; after this IDs come from memory
+        self.ids = IdAllocator(os.path.join(journal_dir, "id_counters.json"))
+        # Max, not last row: IDs handed out in blocks are not appended in order
+        self.ids.seed({
+            "SalesOrderID": max(max(self._active_ids, default=0) + 1, self._sealed_next["SalesOrderID"]),
+            "SalesOrderDetailID": max(self._active_max_detail + 1, self._sealed_next["SalesOrderDetailID"])
+        })
+
+        self._wake = threading.Event()
+        self._closed = False
+        self._flusher = threading.Thread(target=self._flush_loop, name="excel-flusher", daemon=True)
+        self._flusher.start()
+
+    def _load_workbook(self):
+        # One streaming pass over both sheets: columns, IDs and the indexes.
+        # The openpyxl workbook (a Python object per cell) is dropped and only
+        # reloaded by a compaction that has rows to write (_open_for_write).
+        self._wb = None
+        active_ids, max_detail = set(), [0]
+        with timed("workbook_scan"), XlsxReader(self.path) as reader:
+            self.header_cols = reader.header("SalesOrderHeader")
+            self.detail_cols = reader.header("SalesOrderDetail")
+            self._snapshot_stamp = self._disk_stamp()
+            # On a reload (another worker compacted) only its orders are new
+            self.index.add_rows(
+                self.header_cols,
+                _tracked(reader.rows("SalesOrderHeader"), self.header_cols.index("SalesOrderID"), ids=active_ids),
+                self.detail_cols,
+                _tracked(reader.rows("SalesOrderDetail"), self.detail_cols.index("SalesOrderDetailID"),
+                         max_id=max_detail)
+            )
+
+        self._active_ids = active_ids
+        self._active_max_detail = max_detail[0]
+        self._order_ids.update(active_ids)
+        set_gauge(WORKBOOK_ORDERS, len(self._order_ids))
+
+        if self.columnar and not self.columnar.is_current(self._snapshot_stamp):
+            self._rebuild_columnar()
+
+    def _open_for_write(self):
+        from openpyxl import load_workbook
+
+        with timed("workbook_load"):
+            self._wb = load_workbook(self.path)
+        self._ws_header = self._wb["SalesOrderHeader"]
+        self._ws_detail = self._wb["SalesOrderDetail"]
+
+    # ---- shards ----
+
+    def _open_shards(self):
+        manifest = self.shards.load()
+        if manifest is None:
+            # First start with sharding on: the existing workbook becomes the
+            # first sealed shard and writes go to a new, empty one
+            manifest = {"mode": self.sharding, "shards": [shard_entry(self.path, None, True)]}
+
+        for shard in manifest["shards"]:
+            if shard["sealed"]:
+                shard.update(self._read_sealed(shard["file"], shard["month"]))
+
+        if manifest["shards"][-1]["sealed"]:
+            month = current_month()
+            path = self.shards.new_shard_path(manifest, month)
+            create_empty_workbook(path, self._shard_header_cols, self._shard_detail_cols)
+            manifest["shards"].append(shard_entry(path, month, False))
+            print("INFO: sharding on; orders now go to", path)
+        self.shards.save(manifest)
+        self.path = manifest["shards"][-1]["file"]
+
+    def _read_sealed(self, path, month):
+        # Streams a sealed shard into the indexes; returns its manifest entry
+        order_ids, max_detail_id = set(), [0]
+        with XlsxReader(path) as reader:
+            header_cols = reader.header("SalesOrderHeader")
+            detail_cols = reader.header("SalesOrderDetail")
+            self.index.add_rows(
+                header_cols,
+                _tracked(reader.rows("SalesOrderHeader"), header_cols.index("SalesOrderID"), ids=order_ids),
+                detail_cols,
+                _tracked(reader.rows("SalesOrderDetail"), detail_cols.index("SalesOrderDetailID"),
+                         max_id=max_detail_id)
+            )
+
+        self._order_ids.update(order_ids)
+        self._shard_header_cols, self._shard_detail_cols = header_cols, detail_cols
+        entry = shard_entry(path, month, True, order_ids, max_detail_id[0] or None)
+        if order_ids:
+            self._sealed_next["SalesOrderID"] = max(self._sealed_next["SalesOrderID"], entry["maxOrderId"] + 1)
+        if entry["maxDetailId"]:
+            self._sealed_next["SalesOrderDetailID"] = max(self._sealed_next["SalesOrderDetailID"],
+                                                          entry["maxDetailId"] + 1)
+        return entry
+
+    def _active_entry(self, sealed=False):
+        month = (self.shards.load()["shards"][-1]).get("month")
+        return shard_entry(self.path, month, sealed, self._active_ids, self._active_max_detail or None)
+
+    def _follow_shards(self):
+        # Another worker rotated: index what it compacted into the shard we
+        # had open before it was sealed, then switch to the new active shard
+        active = self.shards.active_file()
+        if active == self.path:
+            return
+        self._read_sealed(self.path, None)
+        self.path = active
+        self.columnar = ColumnarSnapshot(active) if self.columnar else None
+        self._load_workbook()
+
+    def _rotate_if_due(self):
+        manifest = self.shards.load()
+        active = manifest["shards"][-1]
+        active.update(orders=len(self._active_ids))
+        if not rotation_due(active, self.sharding, self.shard_max_orders):
+            if active.get("month") != current_month() and not self._active_ids:
+                active["month"] = current_month()
+                self.shards.save(manifest)
+            return
+
+        month = current_month()
+        path = self.shards.new_shard_path(manifest, month)
+        create_empty_workbook(path, self.header_cols, self.detail_cols)
+        manifest["shards"][-1] = self._active_entry(sealed=True)
+        manifest["shards"].append(shard_entry(path, month, False))
+        self.shards.save(manifest)
+        print("INFO: sealed workbook shard", self.path, "- orders now go to", path)
+
+        self.path = path
+        self.columnar = ColumnarSnapshot(path) if self.columnar else None
+        self._load_workbook()
+
+    def shard_files(self):
+        return [shard["file"] for shard in self.shards.shards()] if self.shards else [self.path]
+
+    def _rebuild_columnar(self):
+        try:
+            # Streamed from the file on disk, which _snapshot_stamp describes
+            self.columnar.build_from_xlsx()
+        except Exception as e:
+            # Derived data only; the next load sees the stale stamp and retries
+            print("ERROR: columnar snapshot rebuild failed:", e)
+
+    def _disk_stamp(self):
+        st = os.stat(self.path)
+        return (st.st_mtime_ns, st.st_size)
+
+    @property
+    def pending_rows(self):
+        with self._lock:
+            return self._dirty_rows
+
+    def append_orders(self, extracted_list):
+        # Bulk path: one journal write (one fsync) for the whole batch
+        if self._closed:
+            raise Exception("ExcelOrderStore is closed")
+
+        records = []
+        rows = 0
+        for extracted in extracted_list:
+            items = extracted.get("lineItems") or []
+            sales_order_id = self.ids.reserve("SalesOrderID")
+            detail_id = self.ids.reserve("SalesOrderDetailID", max(len(items), 1))
+
+            header_row, detail_rows = build_order_rows(extracted, sales_order_id, detail_id)
+            records.append({
+                "SalesOrderID": sales_order_id,
+                "header": header_row,
+                "details": detail_rows
+            })
+            rows += 1 + len(detail_rows)
+
+        # Durable once this returns (fsync'd); the workbook catches up later
+        with timed("journal_append"):
+            self.journal.append_many(records)
+        for record in records:
+            self.index.add(record["header"], record["details"])
+
+        with self._lock:
+            self._dirty_rows += rows
+            dirty = self._dirty_rows
+        set_gauge(WORKBOOK_PENDING_ROWS, dirty)
+
+        if dirty >= self.flush_every_rows:
+            self._wake.set()
+
+        return [record["SalesOrderID"] for record in records]
+
+    def flush(self):
+        # Compactor: seal the active segment, apply every sealed segment to
+        # the in-memory workbook, write a new snapshot, then drop the segments.
+        with self._io_lock, self._compact_lock:
+            with self._lock:
+                self._dirty_rows = 0
+            set_gauge(WORKBOOK_PENDING_ROWS, 0)
+            self.journal.seal()
+
+            # Another worker compacted since our last load/save; picked up
+            # even when there is nothing of our own to write
+            self._catch_up()
+
+            segments = self.journal.sealed_segments()
+            if not segments:
+                return 0
+
+            if self.shards:
+                self._rotate_if_due()
+
+            applied = 0
+            # Rows written to the active shard since its last save
+            new_headers, new_details, pending = [], [], 0
+            for segment in segments:
+                for record in read_segment(segment):
+                    sales_order_id = record.get("SalesOrderID")
+                    if sales_order_id in self._order_ids:
+                        continue
+                    if self._shard_full():
+                        # A backlog can span several shards: seal this one
+                        # at the cap and go on in a new one
+                        self._save_active(new_headers, new_details, pending)
+                        new_headers, new_details, pending = [], [], 0
+                        self._rotate_if_due()
+                    if self._wb is None:
+                        self._open_for_write()
+                    header_row = record.get("header") or {}
+                    self._ws_header.append([header_row.get(col, None) for col in self.header_cols])
+                    for detail_row in record.get("details") or []:
+                        self._ws_detail.append([detail_row.get(col, None) for col in self.detail_cols])
+                        if detail_row.get("SalesOrderDetailID") is not None:
+                            self._active_max_detail = max(self._active_max_detail,
+                                                          int(detail_row["SalesOrderDetailID"]))
+                    self._order_ids.add(sales_order_id)
+                    self._active_ids.add(sales_order_id)
+                    # Orders journaled by other workers become visible here
+                    self.index.add(header_row, record.get("details") or [])
+                    new_headers.append(header_row)
+                    new_details.extend(record.get("details") or [])
+                    pending += 1 + len(record.get("details") or [])
+                    applied += 1 + len(record.get("details") or [])
+
+            self._save_active(new_headers, new_details, pending)
+            self.journal.remove_segments(segments)
+            return applied
+
+    def _shard_full(self):
+        return bool(self.shards) and self.sharding == "rows" and len(self._active_ids) >= self.shard_max_orders
+
+    def _save_active(self, new_headers, new_details, rows):
+        # Snapshot of the active workbook after `rows` rows were appended
+        if not rows:
+            return
+        prev_stamp = self._snapshot_stamp
+        self._save_snapshot()
+        self._update_columnar(prev_stamp, new_headers, new_details)
+        inc(WORKBOOK_ROWS_WRITTEN, rows)
+        set_gauge(WORKBOOK_ORDERS, len(self._order_ids))
+        if self.shards:
+            # Keeps the active shard's ID range routable
+            manifest = self.shards.load()
+            manifest["shards"][-1] = self._active_entry()
+            self.shards.save(manifest)
+
+    def _update_columnar(self, prev_stamp, new_headers, new_details):
+        if not self.columnar:
+            return
+        try:
+            with timed("columnar_update"):
+                appended = self.columnar.append(prev_stamp, self._snapshot_stamp, {
+                    "SalesOrderHeader": (self.header_cols, new_headers),
+                    "SalesOrderDetail": (self.detail_cols, new_details)
+                })
+        except Exception as e:
+            print("ERROR: columnar snapshot append failed:", e)
+            appended = False
+        if not appended:
+            self._rebuild_columnar()
+
+    def _catch_up(self):
+        # Caller holds _io_lock and the compaction lock
+        if self.shards:
+            self._follow_shards()
+        if self._disk_stamp() != self._snapshot_stamp:
+            self._load_workbook()
+
+    def _refresh(self):
+        # Reads see orders other workers have compacted, without waiting for
+        # our next flush. Costs a stat (plus a manifest read when sharded)
+        # when nothing changed.
+        rotated = self.shards and self.shards.active_file() != self.path
+        if not rotated and self._disk_stamp() == self._snapshot_stamp:
+            return
+        with self._io_lock, self._compact_lock:
+            self._catch_up()
+
+    def get_order(self, sales_order_id):
+        order = self.index.get(int(sales_order_id))
+        if order is None:
+            self._refresh()
+            order = self.index.get(int(sales_order_id))
+        return order
+
+    def query_orders(self, date_from=None, date_to=None, customer=None, po=None, limit=100, offset=0):
+        self._refresh()
+        return self.index.query(date_from, date_to, customer, po, limit, offset)
+
+    def _journaled(self, known):
+        # Records still in the journal (any worker's) whose SalesOrderID is
+        # not in `known`, read without sealing or compacting anything. The
+        # active segment is read before the sealed ones are listed, so an
+        # order sealed in between is still seen (once).
+        def read(path):
+            try:
+                return list(read_segment(path))
+            except FileNotFoundError:
+                # Compacted meanwhile; _consistent sees the new workbook
+                return []
+
+        batches = [read(self.journal.active_path)]
+        batches += [read(path) for path in self.journal.sealed_segments()]
+        seen = set()
+        for records in batches:
+            for record in records:
+                sales_order_id = record.get("SalesOrderID")
+                if sales_order_id in known or sales_order_id in seen:
+                    continue
+                seen.add(sales_order_id)
+                yield record
+
+    def _consistent(self, read):
+        # Runs read() over the workbook(s) plus the journal, again if a
+        # compaction swapped a workbook or rotated a shard meanwhile (its
+        # orders left the journal for a file read() may have missed)
+        for _ in range(3):
+            self._refresh()
+            before = (self.path, self._disk_stamp(), self.shards and self.shards.active_file())
+            result = read()
+            if (self.path, self._disk_stamp(), self.shards and self.shards.active_file()) == before:
+                break
+        return result
+
+    def monthly_totals(self, date_from=None, date_to=None):
+        # Read-only: the workbook snapshot(s) plus the journal, so a report
+        # never triggers a compaction
+        import pandas as pd
+
+        cols = ["OrderDate", "SubTotal", "TaxAmt", "Freight", "TotalDue"]
+
+        def read():
+            if self.columnar:
+                frames = [self.columnar.read_frame("SalesOrderHeader", cols)]
+                for path in self.shard_files()[:-1]:
+                    frames.append(self._sealed_frame(path, cols))
+                known = self._order_ids
+            else:
+                # The index already has this worker's journaled orders
+                headers, _ = self.index.query(limit=len(self.index))
+                frames = [pd.DataFrame([[h.get(c) for c in cols] for h in headers], columns=cols)]
+                known = self.index
+            pending = [[(record.get("header") or {}).get(c) for c in cols] for record in self._journaled(known)]
+            if pending:
+                frames.append(pd.DataFrame(pending, columns=cols))
+            frame = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+            return monthly_totals_from_frame(frame, date_from, date_to)
+
+        return self._consistent(read)
+
+    def _sealed_frame(self, path, cols):
+        # Sealed shards never change, so their snapshot is built only once
+        snapshot = self._sealed_columnar.get(path)
+        if snapshot is None:
+            snapshot = self._sealed_columnar[path] = ColumnarSnapshot(path)
+        if not snapshot.is_current():
+            snapshot.build_from_xlsx()
+        return snapshot.read_frame("SalesOrderHeader", cols)
+
+    def next_ids(self):
+        return {
+            "SalesOrderID": self.ids.peek("SalesOrderID"),
+            "SalesOrderDetailID": self.ids.peek("SalesOrderDetailID")
         }
-        ws_detail.append([detail_row.get(col, None) for col in detail_cols])
-    
-    print("DEBUG: saving SalesOrderID =", sales_order_id)
-    wb.save(DEMO_XLSX)
-    return sales_order_id
+
+    def export_xlsx(self, path):
+        # The workbook(s) on disk plus journaled orders, written to `path`
+        # only; the store's own files are not compacted or rewritten
+        def write():
+            pending = list(self._journaled(self._order_ids))
+            if self.shards or pending:
+                # One combined workbook, streamed from the shard files
+                merge_workbooks(self.shard_files(), path, extra_rows={
+                    "SalesOrderHeader": [record.get("header") or {} for record in pending],
+                    "SalesOrderDetail": [row for record in pending for row in record.get("details") or []]
+                })
+            elif os.path.abspath(path) != os.path.abspath(self.path):
+                shutil.copyfile(self.path, path)
+
+        self._consistent(write)
+        return path
+
+    def _save_snapshot(self):
+        tmp_path = self.path + ".tmp"
+        with timed("workbook_save"):
+            self._wb.save(tmp_path)
+            with open(tmp_path, "rb") as f:
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        self._snapshot_stamp = self._disk_stamp()
+        self.snapshots_written += 1
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self._flusher.join(timeout=self.flush_interval + 1)
+        self.flush()
+
+    def _flush_loop(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                # Segments are kept on failure, so the next compaction retries
+                print("ERROR: background Excel compaction failed:", e)
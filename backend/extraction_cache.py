@@ -0,0 +1,110 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from metrics import CACHE_REQUESTS, inc
+
+CACHE_PATH = os.getenv("EXTRACTION_CACHE_PATH", "data/extraction_cache.sqlite3")
+CACHE_MAX_BYTES = int(os.getenv("EXTRACTION_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Set on results that came from a repaired or continued reply; those are
+# best-effort and never cached, so the next upload gets a fresh attempt
+PARTIAL_KEY = "_partial"
+
+
+def make_cache_key(data: bytes, model: str, system_prompt: str) -> str:
+    # Same image + same model + same prompt => same extraction
+    prompt_hash = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+    image_hash = hashlib.sha256(data).hexdigest()
+    return f"{image_hash}:{model}:{prompt_hash}"
+
+
+class ExtractionCache:
+    # Persistent LRU cache of LLM extraction results (SQLite, one row per key).
+    # Entries are evicted least-recently-used first once the stored JSON
+    # exceeds max_bytes.
+
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS extractions (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_extractions_last_access ON extractions(last_access)")
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM extractions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                inc(CACHE_REQUESTS, result="miss")
+                return None
+            self.hits += 1
+            inc(CACHE_REQUESTS, result="hit")
+            self._conn.execute("UPDATE extractions SET last_access = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key: str, value: dict):
+        if value.get(PARTIAL_KEY):
+            return
+        payload = json.dumps(value, separators=(",", ":"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO extractions (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, payload, len(payload), time.time())
+            )
+            self._evict()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM extractions").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        cursor = self._conn.execute("SELECT key, size FROM extractions ORDER BY last_access")
+        victims = []
+        for key, size in cursor:
+            if total <= self.max_bytes:
+                break
+            victims.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM extractions WHERE key = ?", victims)
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM extractions"
+            ).fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": entries,
+            "bytes": size,
+            "maxBytes": self.max_bytes
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ExtractionCache()
+    return _cache
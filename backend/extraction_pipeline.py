@@ -0,0 +1,328 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from documents import MULTIPAGE_TYPES, Document, merge_pages
+from extraction_cache import PARTIAL_KEY, get_cache, make_cache_key
+from invoice_normalize import HIGH, normalize_extraction
+from invoice_templates import TEMPLATES_ENABLED, apply_template, get_template_registry
+from llm_extractor import PROMPT_ID, extract_invoice_bytes, extract_invoice_text, get_client
+from metrics import ROUTES, inc, timed
+from ocr import ocr_available, ocr_image
+
+# Extraction routing. In text_first mode the upload is OCR'd locally; a known
+# layout is read with its learned template (no LLM call), otherwise the text
+# goes to the (cheaper) text model. The image model is only called when OCR is
+# unusable or the local/text result fails validation. `image` mode (the
+# default) always sends the image, as before.
+EXTRACTION_MODE = os.getenv("EXTRACTION_MODE", "image")  # image | text_first
+MODES = ("text_first", "image")
+
+LLM_TEXT_MODEL = os.getenv("LLM_TEXT_MODEL", "gpt-4o-mini")
+LLM_IMAGE_MODEL = os.getenv("LLM_IMAGE_MODEL", "gpt-4o-mini")
+
+# Pages of one PDF/TIFF extracted at the same time
+PAGE_CONCURRENCY = int(os.getenv("PAGE_CONCURRENCY", "4"))
+
+# OCR output below these is not worth a text call
+OCR_MIN_CHARS = int(os.getenv("OCR_MIN_CHARS", "80"))
+OCR_MIN_CONFIDENCE = float(os.getenv("OCR_MIN_CONFIDENCE", "60"))
+
+# A text extraction is accepted only with these present, line items, and a
+# stated total that reconciles (see invoice_normalize)
+REQUIRED_FIELDS = ("invoiceNumber", "orderDate")
+
+
+def _ms(started):
+    return round((time.perf_counter() - started) * 1000, 1)
+
+
+def text_result_problems(extracted, validation):
+    problems = [f"missing {field}" for field in REQUIRED_FIELDS if not extracted.get(field)]
+    if not extracted.get("lineItems"):
+        problems.append("no line items")
+    if validation["confidence"].get("totalDue") != HIGH:
+        problems.append("totalDue missing or not reconciled")
+    return problems + validation["issues"]
+
+
+class RoutingStats:
+    # In-process counters: requests per route, fallback reasons, and
+    # count / total ms per stage
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.routes = {}
+        self.reasons = {}
+        self.stages = {}
+
+    def record(self, routing):
+        with self._lock:
+            self.routes[routing["route"]] = self.routes.get(routing["route"], 0) + 1
+            if routing["reason"]:
+                self.reasons[routing["reason"]] = self.reasons.get(routing["reason"], 0) + 1
+            for stage, ms in routing["timings"].items():
+                count, total = self.stages.get(stage, (0, 0.0))
+                self.stages[stage] = (count + 1, total + ms)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "mode": EXTRACTION_MODE,
+                "ocrAvailable": ocr_available(),
+                "templates": get_template_registry().stats() if TEMPLATES_ENABLED else None,
+                "routes": dict(self.routes),
+                "fallbackReasons": dict(self.reasons),
+                "stages": {
+                    stage: {"count": count, "avgMs": round(total / count, 1)}
+                    for stage, (count, total) in self.stages.items()
+                }
+            }
+
+
+routing_stats = RoutingStats()
+
+
+def warm_up_extraction():
+    # What the first extraction would otherwise pay for: the OpenAI client
+    # (and SDK import), the OCR probe, templates, and pandas for the
+    # normalizer's fallbacks
+    if os.getenv("OPENAI_API_KEY"):
+        get_client()
+    if EXTRACTION_MODE == "text_first":
+        ocr_available()
+    if TEMPLATES_ENABLED:
+        get_template_registry()
+    import pandas  # noqa: F401
+
+
+def _ocr(data, routing):
+    # OCR text, or None with routing["reason"] saying why it is unusable
+    started = time.perf_counter()
+    try:
+        text, confidence = ocr_image(data)
+    except Exception as e:
+        routing["reason"], routing["detail"] = "ocr_failed", str(e)
+        return None
+    finally:
+        routing["timings"]["ocr_ms"] = _ms(started)
+
+    routing["ocrChars"] = len(text)
+    routing["ocrConfidence"] = round(confidence, 1)
+    if len(text.strip()) < OCR_MIN_CHARS:
+        routing["reason"] = "ocr_too_short"
+        return None
+    if confidence < OCR_MIN_CONFIDENCE:
+        routing["reason"] = "ocr_low_confidence"
+        return None
+    return text
+
+
+def _try_template(text, routing):
+    # Known layout: read it locally. (None, None) when no template matches
+    # or its result fails the same checks as a text extraction.
+    started = time.perf_counter()
+    registry = get_template_registry()
+    with timed("template_match"):
+        template = registry.match(text)
+        extracted = apply_template(template, text) if template else None
+    if not template:
+        routing["timings"]["template_ms"] = _ms(started)
+        return None, None
+
+    extracted, validation = normalize_extraction(extracted)
+    problems = text_result_problems(extracted, validation)
+    registry.record(template["id"], not problems)
+    routing["timings"]["template_ms"] = _ms(started)
+    routing["template"] = template["id"]
+    if problems:
+        routing["templateProblems"] = "; ".join(problems)
+        return None, None
+    return extracted, validation
+
+
+def _learn(text, extracted, routing):
+    started = time.perf_counter()
+    try:
+        with timed("template_learn"):
+            template = get_template_registry().learn(text, extracted)
+    except Exception as e:
+        # Learning is best effort; the extraction itself succeeded
+        print("WARN: template learning failed:", e)
+        template = None
+    routing["timings"]["learn_ms"] = _ms(started)
+    if template:
+        routing["learnedTemplate"] = template["id"]
+
+
+def _try_text(text, routing):
+    # Returns (extracted, validation) from the text model, or (None, None)
+    # with routing["reason"] / routing["detail"] saying why not
+    timings = routing["timings"]
+    started = time.perf_counter()
+    try:
+        extracted = extract_invoice_text(text, model=LLM_TEXT_MODEL)
+    except Exception as e:
+        routing["reason"], routing["detail"] = "text_llm_failed", str(e)
+        return None, None
+    finally:
+        timings["text_llm_ms"] = _ms(started)
+
+    started = time.perf_counter()
+    extracted, validation = normalize_extraction(extracted)
+    problems = text_result_problems(extracted, validation)
+    timings["validate_ms"] = _ms(started)
+    if problems:
+        routing["reason"], routing["detail"] = "validation_failed", "; ".join(problems)
+        return None, None
+
+    return extracted, validation
+
+
+def extract_upload(data, mime, use_cache=True, mode=EXTRACTION_MODE):
+    # Returns (extracted, validation, routing). routing = {"mode", "route":
+    # template | text | image | image_fallback, "reason", "timings": {stage: ms}, ...}
+    started = time.perf_counter()
+    routing = {"mode": mode, "route": "image", "reason": None, "timings": {}}
+    timings = routing["timings"]
+    text = None
+
+    if mode == "text_first" and not ocr_available():
+        routing["reason"] = "ocr_unavailable"
+    elif mode == "text_first":
+        cache_key = make_cache_key(data, "ocr+" + LLM_TEXT_MODEL, PROMPT_ID)
+        cached = get_cache().get(cache_key) if use_cache else None
+        if cached is not None:
+            extracted, validation = normalize_extraction(cached)
+            routing["route"] = "text"
+            return _done(extracted, validation, routing, started)
+
+        text = _ocr(data, routing)
+        if text is not None and TEMPLATES_ENABLED:
+            extracted, validation = _try_template(text, routing)
+            if extracted is not None:
+                routing["route"] = "template"
+                return _done(extracted, validation, routing, started)
+
+        if text is not None:
+            extracted, validation = _try_text(text, routing)
+            if extracted is not None:
+                get_cache().put(cache_key, extracted)
+                routing["route"] = "text"
+                if TEMPLATES_ENABLED:
+                    _learn(text, extracted, routing)
+                return _done(extracted, validation, routing, started)
+        routing["route"] = "image_fallback"
+
+    stage = time.perf_counter()
+    extracted = extract_invoice_bytes(data, mime, model=LLM_IMAGE_MODEL, use_cache=use_cache)
+    timings["image_llm_ms"] = _ms(stage)
+
+    stage = time.perf_counter()
+    extracted, validation = normalize_extraction(extracted)
+    timings["validate_ms"] = round(timings.get("validate_ms", 0) + _ms(stage), 1)
+
+    # OCR was fine but the text model wasn't: a good image result still
+    # teaches the layout for next time
+    if text is not None and TEMPLATES_ENABLED and not text_result_problems(extracted, validation):
+        _learn(text, extracted, routing)
+    return _done(extracted, validation, routing, started)
+
+
+def _done(extracted, validation, routing, started):
+    partial = extracted.pop(PARTIAL_KEY, None)
+    if partial:
+        routing["partial"] = partial
+    routing["timings"]["total_ms"] = _ms(started)
+    routing_stats.record(routing)
+    inc(ROUTES, route=routing["route"], reason=routing["reason"] or "")
+    return extracted, validation, routing
+
+
+def _extract_page(page, mode, use_cache, force_image):
+    # Raw (un-normalized) extraction of one page and how it was obtained:
+    # the PDF text layer, OCR text, or the page image
+    started = time.perf_counter()
+    info = {"page": page.number}
+    extracted = None
+    if not force_image:
+        text = page.text
+        info["route"] = "text_layer"
+        if text is None and mode == "text_first" and ocr_available():
+            info["route"] = "ocr_text"
+            try:
+                text, confidence = ocr_image(page.image())
+            except Exception as e:
+                # Tesseract crash/timeout on one page: that page goes by image
+                info["ocrError"] = str(e)
+            else:
+                if len(text.strip()) < OCR_MIN_CHARS or confidence < OCR_MIN_CONFIDENCE:
+                    text = None
+        if text is not None:
+            try:
+                extracted = extract_invoice_text(text, model=LLM_TEXT_MODEL)
+            except Exception as e:
+                info["textError"] = str(e)
+
+    if extracted is None:
+        info["route"] = "image"
+        extracted = extract_invoice_bytes(page.image(), "image/png", model=LLM_IMAGE_MODEL, use_cache=use_cache)
+    partial = extracted.pop(PARTIAL_KEY, None)
+    if partial:
+        info["partial"] = partial
+    info["ms"] = _ms(started)
+    return extracted, info
+
+
+def _extract_pages(pool, pages, mode, use_cache, force_image=False):
+    futures = [pool.submit(_extract_page, page, mode, use_cache, force_image) for page in pages]
+    return [future.result() for future in futures]
+
+
+def extract_document(data, mime, use_cache=True, mode=EXTRACTION_MODE):
+    # extract_upload for any upload: multi-page PDF/TIFF pages are extracted
+    # in parallel (so a long invoice takes about as long as its slowest page),
+    # merged into one invoice, then validated once. If pages read as text give
+    # an invoice that fails validation, those pages are redone from images.
+    if mime not in MULTIPAGE_TYPES:
+        return extract_upload(data, mime, use_cache=use_cache, mode=mode)
+
+    started = time.perf_counter()
+    routing = {"mode": mode, "route": "pages", "reason": None, "timings": {}}
+    timings = routing["timings"]
+    cache_key = make_cache_key(data, f"pages+{mode}+{LLM_TEXT_MODEL}+{LLM_IMAGE_MODEL}", PROMPT_ID)
+    cached = get_cache().get(cache_key) if use_cache else None
+    if cached is not None:
+        extracted, validation = normalize_extraction(cached)
+        return _done(extracted, validation, routing, started)
+
+    with Document(data, mime) as document:
+        pages = document.pages
+        timings["open_ms"] = _ms(started)
+        with ThreadPoolExecutor(max_workers=max(1, min(PAGE_CONCURRENCY, len(pages))),
+                                thread_name_prefix="page") as pool:
+            stage = time.perf_counter()
+            results = _extract_pages(pool, pages, mode, use_cache)
+            timings["pages_ms"] = _ms(stage)
+
+            merged, conflicts = merge_pages([extracted for extracted, _ in results])
+            extracted, validation = normalize_extraction(merged)
+            problems = text_result_problems(extracted, validation)
+            text_pages = [i for i, (_, info) in enumerate(results) if info["route"] != "image"]
+            if problems and text_pages:
+                routing["reason"], routing["detail"] = "validation_failed", "; ".join(problems)
+                stage = time.perf_counter()
+                redone = _extract_pages(pool, [pages[i] for i in text_pages], mode, use_cache, force_image=True)
+                timings["image_fallback_ms"] = _ms(stage)
+                for i, result in zip(text_pages, redone):
+                    results[i] = result
+                merged, conflicts = merge_pages([extracted for extracted, _ in results])
+                extracted, validation = normalize_extraction(merged)
+
+    routing["pages"] = [info for _, info in results]
+    if conflicts:
+        routing["conflictingFields"] = conflicts
+    if not any(info.get("partial") for _, info in results):
+        get_cache().put(cache_key, extracted)
+    return _done(extracted, validation, routing, started)
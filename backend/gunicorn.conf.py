@@ -0,0 +1,10 @@
+# Picked up automatically by `gunicorn app:app` run from backend/.
+#
+# Each worker warms up (store, caches, OpenAI client) right after loading the
+# app, so a --preload master never starts threads that a fork would lose.
+
+
+def post_worker_init(worker):
+    from app import start_warm_up
+
+    start_warm_up()
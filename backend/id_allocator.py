@@ -0,0 +1,71 @@
+import json
+import os
+import threading
+
+from file_lock import FileLock
+
+ID_BLOCK_SIZE = int(os.getenv("ID_BLOCK_SIZE", "64"))
+
+
+class IdAllocator:
+    # Hands out SalesOrderID / SalesOrderDetailID values from memory.
+    # Each process reserves blocks of IDs from a small shared counter file
+    # (guarded by a file lock), so workers never collide and the file is
+    # only touched once per block instead of once per order.
+
+    def __init__(self, counter_path, block_size=ID_BLOCK_SIZE):
+        self.counter_path = counter_path
+        self.block_size = block_size
+        self._file_lock = FileLock(counter_path + ".lock")
+        self._lock = threading.Lock()
+        self._blocks = {}  # name -> (next_id, end_exclusive)
+
+    def seed(self, floors: dict):
+        # Raise the shared counters to at least the given next-ID values
+        with self._file_lock:
+            counters = self._read_counters()
+            for name, floor in floors.items():
+                counters[name] = max(int(counters.get(name, 1)), int(floor))
+            self._write_counters(counters)
+
+    def reserve(self, name, count=1):
+        # Returns the first of `count` consecutive IDs
+        with self._lock:
+            next_id, end = self._blocks.get(name, (0, 0))
+            if next_id + count > end:
+                # Leftover IDs in a short block are skipped; gaps are fine
+                next_id, end = self._reserve_block(name, max(count, self.block_size))
+            self._blocks[name] = (next_id + count, end)
+            return next_id
+
+    def peek(self, name):
+        # Next ID this process would hand out, without consuming it
+        with self._lock:
+            next_id, end = self._blocks.get(name, (0, 0))
+            if next_id < end:
+                return next_id
+        with self._file_lock:
+            return int(self._read_counters().get(name, 1))
+
+    def _reserve_block(self, name, size):
+        with self._file_lock:
+            counters = self._read_counters()
+            start = int(counters.get(name, 1))
+            counters[name] = start + size
+            self._write_counters(counters)
+        return start, start + size
+
+    def _read_counters(self):
+        try:
+            with open(self.counter_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _write_counters(self, counters):
+        tmp_path = self.counter_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(counters, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.counter_path)
@@ -0,0 +1,98 @@
+import io
+import os
+
+from PIL import Image, ImageChops, ImageOps
+
+IMAGE_PREPROCESS = os.getenv("IMAGE_PREPROCESS", "1") != "0"
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "2000"))
+IMAGE_MAX_DPI = int(os.getenv("IMAGE_MAX_DPI", "200"))
+IMAGE_GRAYSCALE = os.getenv("IMAGE_GRAYSCALE", "1") != "0"
+IMAGE_CROP_MARGINS = os.getenv("IMAGE_CROP_MARGINS", "1") != "0"
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "80"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "auto")  # auto | jpeg | png
+
+# Pixels lighter than (255 - threshold) count as background when cropping
+CROP_THRESHOLD = 24
+CROP_PADDING = 12
+
+
+def _flatten(img):
+    # Drop alpha onto white so transparent PNGs don't turn black
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        img = img.convert("RGBA")
+        background = Image.new("RGBA", img.size, (255, 255, 255, 255))
+        img = Image.alpha_composite(background, img)
+    return img.convert("RGB") if img.mode not in ("RGB", "L") else img
+
+
+def _crop_margins(img):
+    gray = img if img.mode == "L" else img.convert("L")
+    ink = ImageChops.invert(gray).point(lambda p: 255 if p > CROP_THRESHOLD else 0)
+    bbox = ink.getbbox()
+    if not bbox:
+        return img
+
+    left, top, right, bottom = bbox
+    left = max(0, left - CROP_PADDING)
+    top = max(0, top - CROP_PADDING)
+    right = min(img.width, right + CROP_PADDING)
+    bottom = min(img.height, bottom + CROP_PADDING)
+    return img.crop((left, top, right, bottom))
+
+
+def _target_scale(img, max_side, max_dpi):
+    scale = 1.0
+    if max_side and max(img.size) > max_side:
+        scale = max_side / max(img.size)
+
+    dpi = img.info.get("dpi")
+    if max_dpi and dpi and dpi[0] and float(dpi[0]) > max_dpi:
+        scale = min(scale, max_dpi / float(dpi[0]))
+    return scale
+
+
+def preprocess_image(data: bytes, mime: str = "image/jpeg",
+                     max_side=IMAGE_MAX_SIDE, max_dpi=IMAGE_MAX_DPI,
+                     grayscale=IMAGE_GRAYSCALE, crop_margins=IMAGE_CROP_MARGINS,
+                     jpeg_quality=IMAGE_JPEG_QUALITY, output_format=IMAGE_FORMAT):
+    # Returns (data, mime, stats). Falls back to the original bytes when the
+    # re-encoded image would not be smaller.
+    img = Image.open(io.BytesIO(data))
+    size_before = img.size
+
+    img = ImageOps.exif_transpose(img)
+    img = _flatten(img)
+    if grayscale:
+        img = img.convert("L")
+    if crop_margins:
+        img = _crop_margins(img)
+
+    scale = _target_scale(img, max_side, max_dpi)
+    if scale < 1.0:
+        img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.LANCZOS)
+
+    fmt = output_format
+    if fmt == "auto":
+        fmt = "png" if mime == "image/png" else "jpeg"
+
+    out = io.BytesIO()
+    if fmt == "png":
+        img.save(out, format="PNG", optimize=True)
+        out_mime = "image/png"
+    else:
+        img.save(out, format="JPEG", quality=jpeg_quality, optimize=True)
+        out_mime = "image/jpeg"
+    processed = out.getvalue()
+
+    stats = {
+        "bytesBefore": len(data),
+        "bytesAfter": len(processed),
+        "sizeBefore": list(size_before),
+        "sizeAfter": list(img.size)
+    }
+    if len(processed) >= len(data):
+        stats["bytesAfter"] = len(data)
+        stats["sizeAfter"] = list(size_before)
+        return data, mime, stats
+
+    return processed, out_mime, stats
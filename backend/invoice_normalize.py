@@ -0,0 +1,262 @@
+import datetime
+import numbers
+import os
+
+import numpy as np
+
+from metrics import timed
+
+# Validation / normalization of extracted invoices, done column-wise over a
+# whole batch: every line item of every invoice is flattened into NumPy
+# arrays, reconciled, then written back into the dicts.
+#
+# One rule for "missing" everywhere: None, "" or an unparseable value. A
+# totalDue of 0 while the parts add up to more is treated as missing too.
+
+AMOUNT_ABS_TOLERANCE = float(os.getenv("NORMALIZE_ABS_TOLERANCE", "0.02"))
+AMOUNT_REL_TOLERANCE = float(os.getenv("NORMALIZE_REL_TOLERANCE", "0.001"))
+MAX_TAX_RATE = float(os.getenv("NORMALIZE_MAX_TAX_RATE", "0.2"))
+
+AMOUNT_FIELDS = ("subtotal", "tax", "taxRate", "freight", "totalDue")
+DATE_FIELDS = ("orderDate", "dueDate", "shipDate")
+
+# Per-field confidence
+HIGH = "high"        # extracted and consistent with the other fields
+MEDIUM = "medium"    # computed or inferred from other fields
+LOW = "low"          # inconsistent, unparseable or defaulted
+MISSING = "missing"  # absent and nothing to infer it from (optional fields only)
+
+
+def _blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def _numbers(values):
+    # (float64 array with NaN for missing, unparseable mask)
+    try:
+        # Fast path: numbers, numeric strings and None (-> NaN). Always 1-D:
+        # a list/dict value fails here instead of adding a dimension.
+        out = np.fromiter((np.nan if v is None else v for v in values), dtype=float, count=len(values))
+        return out, np.zeros(len(out), dtype=bool)
+    except (TypeError, ValueError):
+        pass
+
+    import pandas as pd
+
+    # Strings like "$1,234.50" are cleaned first; lists, dicts etc. stay NaN
+    # (and are flagged unparseable below)
+    s = pd.Series(values, dtype=object)
+    scalar = s.map(lambda v: isinstance(v, (str, numbers.Number)))
+    out = pd.to_numeric(s.where(scalar, None), errors="coerce")
+    retry = out.isna() & s.notna() & scalar
+    if retry.any():
+        cleaned = s[retry].astype(str).str.replace(r"[^0-9.\-]", "", regex=True)
+        out[retry] = pd.to_numeric(cleaned, errors="coerce")
+    out = out.to_numpy(dtype=float)
+    unparseable = np.zeros(len(out), dtype=bool)
+    for i in np.flatnonzero(np.isnan(out)).tolist():
+        unparseable[i] = not _blank(values[i])
+    return out, unparseable
+
+
+def _dates(values):
+    # ("YYYY-MM-DD" or None list, parse-failed list). ISO dates (the prompt
+    # asks for them) parse directly; the rest go through pandas in one call.
+    text, bad, retry = [], [False] * len(values), []
+    for i, value in enumerate(values):
+        if isinstance(value, (datetime.datetime, datetime.date)):
+            text.append(value.isoformat()[:10])
+        elif _blank(value):
+            text.append(None)
+        else:
+            try:
+                text.append(datetime.date.fromisoformat(str(value).strip()[:10]).isoformat())
+            except ValueError:
+                text.append(None)
+                retry.append(i)
+
+    if retry:
+        import pandas as pd
+
+        parsed = pd.to_datetime(pd.Series([str(values[i]) for i in retry]), errors="coerce", format="mixed")
+        for i, ts in zip(retry, parsed):
+            if pd.isna(ts):
+                bad[i] = True
+            else:
+                text[i] = ts.strftime("%Y-%m-%d")
+    return text, bad
+
+
+def _close(a, b):
+    return np.abs(a - b) <= np.maximum(AMOUNT_ABS_TOLERANCE, AMOUNT_REL_TOLERANCE * np.abs(b))
+
+
+def _confidence(present, consistent, derived):
+    # HIGH where extracted + consistent, MEDIUM where derived, else LOW
+    return np.where(present & consistent, HIGH, np.where(derived, MEDIUM, LOW))
+
+
+def normalize_extractions(extracted_list):
+    # Returns (extractions, reports). Like the old per-request normalizer the
+    # dicts are updated in place. A report is {"valid": bool, "issues": [...],
+    # "confidence": {field: level, "lineItems": [level per item]}}; valid
+    # means no inconsistencies were found.
+    with timed("normalize"):
+        return _normalize(extracted_list)
+
+
+def _normalize(extracted_list):
+    n = len(extracted_list)
+    if n == 0:
+        return [], []
+
+    docs = [e if isinstance(e, dict) else {} for e in extracted_list]
+    items = [[it for it in (d.get("lineItems") or []) if isinstance(it, dict)] for d in docs]
+    counts = np.array([len(i) for i in items], dtype=np.int64)
+    flat = [it for order_items in items for it in order_items]
+    owner = np.repeat(np.arange(n), counts)
+
+    # --- line items: lineTotal = qty * unitPrice * (1 - discount) ---
+    qty, bad_qty = _numbers([it.get("qty") for it in flat])
+    unit, bad_unit = _numbers([it.get("unitPrice") for it in flat])
+    discount, bad_discount = _numbers([it.get("unitPriceDiscount") for it in flat])
+    stated_line, bad_line = _numbers([it.get("lineTotal") for it in flat])
+
+    bad_discount |= ~np.isnan(discount) & ((discount < 0) | (discount >= 1))
+    discount = np.where(np.isnan(discount) | bad_discount, 0.0, discount)
+    computed_line = qty * unit * (1 - discount)
+
+    line_present = ~np.isnan(stated_line)
+    line_computable = ~np.isnan(computed_line)
+    line_ok = ~line_computable | _close(stated_line, computed_line)
+    line_total = np.where(line_present, stated_line, np.where(line_computable, computed_line, 0.0))
+    line_unreadable = bad_qty | bad_unit | bad_line | bad_discount
+    line_conf = _confidence(line_present, line_ok, ~line_present & line_computable)
+    line_conf = np.where(line_unreadable, LOW, line_conf)
+
+    lines_sum = np.bincount(owner, weights=line_total, minlength=n)
+    has_lines = counts > 0
+
+    # --- header amounts ---
+    raw = {field: [d.get(field) for d in docs] for field in AMOUNT_FIELDS}
+    parsed = {field: _numbers(values) for field, values in raw.items()}
+    stated_subtotal = parsed["subtotal"][0]
+    stated_tax = parsed["tax"][0]
+    stated_rate = parsed["taxRate"][0]
+    stated_freight = parsed["freight"][0]
+    stated_total = parsed["totalDue"][0]
+
+    subtotal_present = ~np.isnan(stated_subtotal)
+    subtotal = np.where(subtotal_present, stated_subtotal, lines_sum)
+    subtotal_ok = ~has_lines | _close(subtotal, lines_sum)
+    subtotal_conf = _confidence(subtotal_present, subtotal_ok, ~subtotal_present & has_lines)
+
+    freight_present = ~np.isnan(stated_freight)
+    freight = np.where(freight_present, stated_freight, 0.0)
+
+    # Percent-style rates (8.25 for 8.25%) become fractions
+    rate = np.where(stated_rate > 1, stated_rate / 100, stated_rate)
+    rate_present = ~np.isnan(rate)
+
+    tax_present = ~np.isnan(stated_tax)
+    tax_from_rate = ~tax_present & rate_present
+    total_present = ~np.isnan(stated_total) & ~((stated_total == 0) & (subtotal > 0))
+    # No tax or rate: whatever the total has on top of subtotal + freight
+    tax_from_total = ~tax_present & ~rate_present & total_present
+    tax_rest = np.maximum(np.nan_to_num(stated_total) - subtotal - freight, 0.0)
+    tax = np.where(tax_present, stated_tax,
+                   np.where(tax_from_rate, subtotal * np.nan_to_num(rate),
+                            np.where(tax_from_total, tax_rest, 0.0)))
+
+    # Tax rate implied by tax / subtotal, kept when plausible
+    with np.errstate(divide="ignore", invalid="ignore"):
+        implied_rate = np.where(subtotal > 0, tax / subtotal, np.nan)
+    implied_ok = ~np.isnan(implied_rate) & (implied_rate >= 0) & (implied_rate <= MAX_TAX_RATE)
+    rate_matches = rate_present & (np.abs(rate - implied_rate) <= 0.0005)
+    final_rate = np.where(implied_ok, np.round(implied_rate, 4), np.where(rate_present, rate, 0.0))
+    rate_conf = np.where(rate_matches, HIGH, np.where(implied_ok, MEDIUM, np.where(rate_present, LOW, MISSING)))
+    tax_implausible = tax_present & (subtotal > 0) & ~implied_ok
+    tax_conf = np.where(tax_present, np.where(tax_implausible, LOW, HIGH),
+                        np.where(tax_from_rate | tax_from_total, MEDIUM, LOW))
+
+    computed_total = subtotal + tax + freight
+    total = np.where(total_present, stated_total, computed_total)
+    total_ok = _close(total, computed_total)
+    total_conf = _confidence(total_present, total_ok, ~total_present)
+    freight_conf = np.where(freight_present, HIGH, np.where(total_present & total_ok, MEDIUM, LOW))
+    no_amounts = ~has_lines & ~subtotal_present & (np.isnan(stated_total) | (stated_total == 0))
+
+    # --- dates ---
+    dates = {field: _dates([d.get(field) for d in docs]) for field in DATE_FIELDS}
+
+    # --- write back (plain lists; NumPy scalar access is slow per element) ---
+    line_values = zip(
+        flat, np.where(np.isnan(qty), None, qty).tolist(), np.where(np.isnan(unit), None, unit).tolist(),
+        discount.tolist(), np.round(line_total, 2).tolist()
+    )
+    for it, q, u, d, total_value in line_values:
+        it["qty"] = q
+        it["unitPrice"] = u
+        it["unitPriceDiscount"] = d
+        it["lineTotal"] = total_value
+
+    line_levels = line_conf.tolist()
+    offsets = np.concatenate(([0], np.cumsum(counts))).tolist()
+
+    # Issue messages only for the (few) rows that have one
+    issues = [[] for _ in range(n)]
+    for pos in np.flatnonzero(line_conf == LOW).tolist():
+        i = int(owner[pos])
+        j = pos - offsets[i]
+        if line_unreadable[pos]:
+            issues[i].append(f"lineItems[{j}]: unreadable qty, unitPrice, discount or lineTotal")
+        else:
+            issues[i].append(f"lineItems[{j}]: lineTotal {line_total[pos]:.2f} != qty x unitPrice {computed_line[pos]:.2f}")
+    for i in np.flatnonzero(~subtotal_ok).tolist():
+        issues[i].append(f"subtotal {subtotal[i]:.2f} != sum of line totals {lines_sum[i]:.2f}")
+    for i in np.flatnonzero(~total_ok).tolist():
+        issues[i].append(f"totalDue {total[i]:.2f} != subtotal + tax + freight {computed_total[i]:.2f}")
+    for i in np.flatnonzero(tax_implausible).tolist():
+        issues[i].append(f"tax {tax[i]:.2f} is an implausible {implied_rate[i]:.1%} of subtotal")
+    for i in np.flatnonzero(no_amounts).tolist():
+        issues[i].append("no line items or amounts")
+
+    columns = zip(
+        np.round(subtotal, 2).tolist(), np.round(tax, 2).tolist(), final_rate.tolist(),
+        np.round(freight, 2).tolist(), np.round(total, 2).tolist(),
+        subtotal_conf.tolist(), tax_conf.tolist(), rate_conf.tolist(), freight_conf.tolist(), total_conf.tolist()
+    )
+    reports = []
+    for i, (doc, values) in enumerate(zip(docs, columns)):
+        doc["subtotal"], doc["tax"], doc["taxRate"], doc["freight"], doc["totalDue"] = values[:5]
+        if items[i] or "lineItems" in doc:
+            doc["lineItems"] = items[i]
+
+        confidence = dict(zip(AMOUNT_FIELDS, values[5:]))
+        confidence["lineItems"] = line_levels[offsets[i]:offsets[i + 1]]
+        for field in AMOUNT_FIELDS:
+            if parsed[field][1][i]:
+                issues[i].append(f"{field} {raw[field][i]!r} is not a number")
+                confidence[field] = LOW
+
+        for field in DATE_FIELDS:
+            text, bad = dates[field]
+            if bad[i]:
+                issues[i].append(f"{field} {doc.get(field)!r} is not a date")
+                confidence[field] = LOW
+            else:
+                confidence[field] = HIGH if text[i] else MISSING
+            doc[field] = text[i]
+        # ISO strings compare in date order
+        if doc["dueDate"] and doc["orderDate"] and doc["dueDate"] < doc["orderDate"]:
+            issues[i].append("dueDate is before orderDate")
+            confidence["dueDate"] = LOW
+
+        reports.append({"valid": not issues[i], "issues": issues[i], "confidence": confidence})
+
+    return docs, reports
+
+
+def normalize_extraction(extracted: dict):
+    normalized, reports = normalize_extractions([extracted])
+    return normalized[0], reports[0]
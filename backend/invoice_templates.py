@@ -0,0 +1,469 @@
+import datetime
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+
+
+# Template registry for repeat invoice layouts. A template is learned from
+# the OCR text of an invoice plus a validated LLM extraction of it:
+#   - anchors: the static words of the layout (labels, vendor name), used as
+#     the fingerprint; a document matches when it contains most of them
+#   - rules: for each header field, the label text before the value on the
+#     same line (or the line above it) and the kind of value to capture
+#   - items: the line-item row layout (which number columns, in what order)
+# Applying a template is a handful of regexes over the OCR text.
+
+TEMPLATES_ENABLED = os.getenv("TEMPLATES_ENABLED", "1") != "0"
+TEMPLATES_PATH = os.getenv("TEMPLATES_PATH", "data/invoice_templates.json")
+TEMPLATE_MATCH_THRESHOLD = float(os.getenv("TEMPLATE_MATCH_THRESHOLD", "0.85"))
+TEMPLATE_MIN_ANCHORS = int(os.getenv("TEMPLATE_MIN_ANCHORS", "6"))
+TEMPLATE_MAX_COUNT = int(os.getenv("TEMPLATE_MAX_COUNT", "500"))
+# A template that keeps failing validation is dropped (and relearned)
+TEMPLATE_MAX_FAILURES = 3
+
+# field -> kind of value
+FIELDS = {
+    "invoiceNumber": "token",
+    "purchaseOrderNumber": "token",
+    "orderDate": "date",
+    "dueDate": "date",
+    "shipDate": "date",
+    "customer.name": "text",
+    "terms": "text",
+    "shipVia": "text",
+    "subtotal": "amount",
+    "tax": "amount",
+    "freight": "amount",
+    "totalDue": "amount"
+}
+REQUIRED_RULES = ("invoiceNumber", "orderDate", "totalDue")
+
+VALUE_PATTERNS = {
+    "token": r"[A-Za-z0-9][\w\-/.#]*",
+    "date": r"\d{4}-\d{2}-\d{2}|\d{1,2}[/.\-]\d{1,2}[/.\-]\d{2,4}|[A-Za-z]{3,9}\.? \d{1,2},? \d{4}"
+            r"|\d{1,2} [A-Za-z]{3,9}\.? \d{4}",
+    "amount": r"-?\$?\s?\d[\d,]*(?:\.\d+)?",
+    "text": r".+?"
+}
+NUMBER = r"-?\$?\d[\d,]*(?:\.\d+)?%?"
+NUMBER_RE = re.compile(NUMBER)
+WORD_RE = re.compile(r"[a-z]{3,}")
+
+# Columns matched from the right end of a row, most likely first
+ITEM_COLUMNS = ("lineTotal", "unitPrice", "qty", "unitPriceDiscount")
+
+
+def _lines(text):
+    return [" ".join(line.split()) for line in text.splitlines() if line.strip()]
+
+
+def _words(text):
+    return set(WORD_RE.findall(text.lower()))
+
+
+def _amount(s):
+    try:
+        return float(re.sub(r"[^\d.\-]", "", s))
+    except ValueError:
+        return None
+
+
+def _date(s):
+    import pandas as pd
+
+    ts = pd.to_datetime(s, errors="coerce")
+    return None if pd.isna(ts) else ts.strftime("%Y-%m-%d")
+
+
+def _same(kind, found, value):
+    if found is None or value is None:
+        return False
+    if kind == "amount":
+        parsed = _amount(found)
+        return parsed is not None and abs(parsed - float(value)) < 0.005
+    if kind == "date":
+        return _date(found) == str(value)[:10]
+    return found.strip().lower() == str(value).strip().lower()
+
+
+def _get(extracted, field):
+    value = extracted
+    for part in field.split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def _locate(line, kind, value):
+    # (start, end) spans in `line` holding `value`
+    if kind in ("token", "text"):
+        pattern = r"(?<!\w)" + re.escape(str(value).strip()) + r"(?!\w)"
+        return [m.span() for m in re.finditer(pattern, line, re.IGNORECASE)]
+    return [m.span() for m in re.finditer(VALUE_PATTERNS[kind], line) if _same(kind, m.group(), value)]
+
+
+def _label(words, variable, limit):
+    # Up to `limit` words next to the value, stopping at anything that looks
+    # like another field's value (digits, or words from the extracted values)
+    label = []
+    for word in words[:limit]:
+        if any(ch.isdigit() for ch in word) or _words(word) & variable:
+            break
+        label.append(word)
+    return label
+
+
+def _rule_regex(rule):
+    value = f"(?P<v>{VALUE_PATTERNS[rule['kind']]})"
+    prefix = r"(?<!\w)" + re.escape(rule["prefix"]) + r"\s*" if rule["prefix"] else "^"
+    if rule["kind"] == "text":
+        suffix = r"\s+" + re.escape(rule["suffix"]) if rule["suffix"] else r"\s*$"
+    else:
+        suffix = ""
+    return re.compile(prefix + value + suffix, re.IGNORECASE)
+
+
+def _apply_rule(rule, lines):
+    regex = _rule_regex(rule)
+    if rule["after"]:
+        for i, line in enumerate(lines[:-1]):
+            if line.lower() == rule["after"]:
+                m = regex.search(lines[i + 1])
+                return m.group("v").strip() if m else None
+        return None
+    for line in lines:
+        m = regex.search(line)
+        if m:
+            return m.group("v").strip()
+    return None
+
+
+def _learn_rule(lines, kind, value, variable):
+    # First rule that reads `value` back from these lines, or None
+    if value is None or (kind == "amount" and not float(value)):
+        return None
+    for i, line in enumerate(lines):
+        for start, end in _locate(line, kind, value):
+            before = list(reversed(_label(list(reversed(line[:start].split())), variable, 3)))
+            after_words = line[end:].split()
+            suffix = _label(after_words, variable, 2)
+            if kind == "text" and after_words and not suffix:
+                continue
+            rule = {
+                "kind": kind,
+                "prefix": " ".join(before),
+                "suffix": " ".join(suffix) if kind == "text" else "",
+                "after": lines[i - 1].lower() if not before and i > 0 else None
+            }
+            if not rule["prefix"] and not rule["after"]:
+                continue
+            if _same(kind, _apply_rule(rule, lines), value):
+                return rule
+    return None
+
+
+def _item_row_regex(layout):
+    parts = ["^"]
+    if layout["itemNumber"]:
+        parts.append(r"(?P<itemNumber>\S+)\s+")
+    parts.append(r"(?P<description>.+?)")
+    for column in layout["columns"]:
+        parts.append(rf"\s+(?P<{column}>{NUMBER})" if column else rf"\s+{NUMBER}")
+    parts.append("$")
+    return re.compile("".join(parts))
+
+
+def _learn_items(lines, items):
+    # Row layout from the first line item: its number columns, right to left
+    first = items[0]
+    for i, line in enumerate(lines):
+        tokens = line.split()
+        columns, free, popped = [], list(ITEM_COLUMNS), []
+        while tokens and NUMBER_RE.fullmatch(tokens[-1]) and len(columns) < 6:
+            token = tokens.pop()
+            field = next((f for f in free if _same("amount", token, first.get(f))), None)
+            if field:
+                free.remove(field)
+            columns.insert(0, field)
+            popped.append(token)
+        # Unmatched numbers left of the first column belong to the description
+        while columns and columns[0] is None:
+            columns.pop(0)
+            tokens.append(popped.pop())
+        if "lineTotal" in free or "qty" in free or not tokens:
+            continue
+
+        item_number = bool(first.get("itemNumber")) and tokens[0].lower() == str(first["itemNumber"]).lower()
+        header = lines[i - 1].lower() if i > 0 else None
+        layout = {
+            "itemNumber": item_number,
+            "columns": columns,
+            "header": header if header and not any(ch.isdigit() for ch in header) else None
+        }
+        return layout, i
+    return None, None
+
+
+def _read_items(layout, lines, stop_rules):
+    regex = _item_row_regex(layout)
+    start = 0
+    if layout["header"]:
+        start = next((i + 1 for i, line in enumerate(lines) if line.lower() == layout["header"]), None)
+        if start is None:
+            return []
+
+    stops = [_rule_regex(rule) for rule in stop_rules]
+    items = []
+    for line in lines[start:]:
+        if any(stop.search(line) for stop in stops):
+            break
+        m = regex.match(line)
+        if not m:
+            continue
+        row = m.groupdict()
+        items.append({
+            "itemNumber": row.get("itemNumber"),
+            "description": row["description"],
+            "qty": _amount(row["qty"]),
+            "unitPrice": _amount(row["unitPrice"]) if row.get("unitPrice") else None,
+            "unitPriceDiscount": _amount(row["unitPriceDiscount"]) if row.get("unitPriceDiscount") else 0.0,
+            "lineTotal": _amount(row["lineTotal"])
+        })
+    return items
+
+
+def apply_template(template, text):
+    # Same shape as the LLM output (llm_extractor.INVOICE_SCHEMA)
+    lines = _lines(text)
+    extracted = {
+        "invoiceNumber": None, "orderDate": None, "dueDate": None, "shipDate": None,
+        "purchaseOrderNumber": None,
+        "customer": {"customerId": 0, "accountNumber": None, "name": None},
+        "terms": None, "shipVia": None,
+        "subtotal": None, "taxRate": None, "tax": None, "freight": None, "totalDue": None,
+        "lineItems": []
+    }
+    for field, rule in template["rules"].items():
+        value = _apply_rule(rule, lines)
+        if value is not None and rule["kind"] == "amount":
+            value = _amount(value)
+        if field == "customer.name":
+            extracted["customer"]["name"] = value
+        else:
+            extracted[field] = value
+
+    stop_rules = [template["rules"][f] for f in ("subtotal", "totalDue") if f in template["rules"]]
+    extracted["lineItems"] = _read_items(template["items"], lines, stop_rules)
+    return extracted
+
+
+def learn_template(text, extracted):
+    # Returns a new template, or None when this layout can't be captured
+    # well enough to read the same invoice back
+    lines = _lines(text)
+    items = [it for it in (extracted.get("lineItems") or []) if isinstance(it, dict)]
+    if not items:
+        return None
+
+    variable = _words(" ".join(str(_get(extracted, f) or "") for f in FIELDS))
+    rules = {}
+    for field, kind in FIELDS.items():
+        rule = _learn_rule(lines, kind, _get(extracted, field), variable)
+        if rule:
+            rules[field] = rule
+    if any(field not in rules for field in REQUIRED_RULES):
+        return None
+
+    layout, first_row = _learn_items(lines, items)
+    if not layout:
+        return None
+
+    template = {"rules": rules, "items": layout}
+    check = apply_template(template, text)
+    if len(check["lineItems"]) != len(items):
+        return None
+    if abs(sum(it["lineTotal"] or 0 for it in check["lineItems"]) -
+           sum(float(it.get("lineTotal") or 0) for it in items)) > 0.01:
+        return None
+
+    # Anchors: words outside the item rows and outside any field value
+    item_lines = set(range(first_row, first_row + len(items)))
+    anchors = set()
+    for i, line in enumerate(lines):
+        if i not in item_lines:
+            anchors |= _words(line)
+    anchors -= variable
+    if len(anchors) < TEMPLATE_MIN_ANCHORS:
+        return None
+
+    anchors = sorted(anchors)
+    template.update({
+        "id": hashlib.sha1(" ".join(anchors).encode("utf-8")).hexdigest()[:12],
+        "anchors": anchors,
+        "learnedFrom": 1,
+        "updated": datetime.datetime.now().isoformat(timespec="seconds")
+    })
+    return template
+
+
+def _containment(anchors, words):
+    return len(words.intersection(anchors)) / len(anchors) if anchors else 0.0
+
+
+class TemplateRegistry:
+    # Learned templates in one JSON file, reloaded when another process
+    # rewrites it. Hit/failure counts are kept next to it in SQLite
+    # (<name>_stats.sqlite3), so every worker's increments add up, survive
+    # restarts, and don't rewrite the JSON on each hit.
+
+    def __init__(self, path=TEMPLATES_PATH, stats_path=None):
+        self.path = path
+        self.stats_path = stats_path or os.path.splitext(path)[0] + "_stats.sqlite3"
+        self._lock = threading.Lock()
+        self._templates = {}
+        self._stamp = None
+
+        os.makedirs(os.path.dirname(self.stats_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(self.stats_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS counters (
+                template_id TEXT PRIMARY KEY,
+                hits INTEGER NOT NULL DEFAULT 0,
+                failures INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        with self._lock:
+            self._reload()
+
+    def _reload(self):
+        try:
+            stamp = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if stamp == self._stamp:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._templates = {t["id"]: t for t in json.load(f)}
+        except (OSError, ValueError, KeyError) as e:
+            print("WARN: could not read invoice templates:", e)
+        self._stamp = stamp
+        # Files written before the counters moved to SQLite carry them inline
+        for template in self._templates.values():
+            hits, failures = template.pop("hits", 0), template.pop("failures", 0)
+            if hits or failures:
+                self._conn.execute("INSERT OR IGNORE INTO counters VALUES (?, ?, ?)",
+                                   (template["id"], hits, failures))
+
+    def _counts(self):
+        # {template_id: (hits, failures)}
+        return {row[0]: (row[1], row[2])
+                for row in self._conn.execute("SELECT template_id, hits, failures FROM counters")}
+
+    def _add(self, template_id, hits=0, failures=0):
+        # Atomic across workers; returns the new (hits, failures)
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.execute(
+                "INSERT INTO counters VALUES (?, ?, ?) ON CONFLICT(template_id) DO UPDATE SET "
+                "hits = hits + excluded.hits, failures = failures + excluded.failures",
+                (template_id, hits, failures)
+            )
+            row = self._conn.execute("SELECT hits, failures FROM counters WHERE template_id = ?",
+                                     (template_id,)).fetchone()
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        return row
+
+    def _forget(self, template_id):
+        self._conn.execute("DELETE FROM counters WHERE template_id = ?", (template_id,))
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(list(self._templates.values()), f, indent=1)
+        os.replace(tmp_path, self.path)
+        self._stamp = os.stat(self.path).st_mtime_ns
+
+    def __len__(self):
+        return len(self._templates)
+
+    def match(self, text):
+        # Best template whose anchors are (nearly) all present in the text
+        words = _words(text)
+        with self._lock:
+            self._reload()
+            best, best_score = None, TEMPLATE_MATCH_THRESHOLD
+            for template in self._templates.values():
+                score = _containment(template["anchors"], words)
+                if score > best_score or (score == best_score and best is None):
+                    best, best_score = template, score
+            return best
+
+    def learn(self, text, extracted):
+        template = learn_template(text, extracted)
+        if not template:
+            return None
+
+        anchors = set(template["anchors"])
+        with self._lock:
+            self._reload()
+            # Same layout seen before: refresh its rules (hits carry over,
+            # failures start again with the new rules)
+            counts = self._counts()
+            for existing in list(self._templates.values()):
+                if (_containment(existing["anchors"], anchors) >= TEMPLATE_MATCH_THRESHOLD
+                        and _containment(template["anchors"], set(existing["anchors"])) >= TEMPLATE_MATCH_THRESHOLD):
+                    template["learnedFrom"] = existing["learnedFrom"] + 1
+                    hits = counts.get(existing["id"], (0, 0))[0]
+                    del self._templates[existing["id"]]
+                    self._forget(existing["id"])
+                    self._conn.execute("INSERT OR REPLACE INTO counters VALUES (?, ?, 0)", (template["id"], hits))
+                    break
+
+            if len(self._templates) >= TEMPLATE_MAX_COUNT:
+                least_used = min(self._templates, key=lambda t: counts.get(t, (0, 0))[0])
+                del self._templates[least_used]
+                self._forget(least_used)
+            self._templates[template["id"]] = template
+            self._save()
+        return template
+
+    def record(self, template_id, ok):
+        with self._lock:
+            if template_id not in self._templates:
+                return
+            hits, failures = self._add(template_id, hits=1) if ok else self._add(template_id, failures=1)
+            if not ok and failures >= TEMPLATE_MAX_FAILURES and failures > hits:
+                print("INFO: dropping invoice template", template_id, "after", failures, "failures")
+                del self._templates[template_id]
+                self._forget(template_id)
+                self._save()
+
+    def stats(self):
+        with self._lock:
+            counts = self._counts()
+            live = [counts.get(template_id, (0, 0)) for template_id in self._templates]
+            return {
+                "templates": len(self._templates),
+                "hits": sum(hits for hits, _ in live),
+                "failures": sum(failures for _, failures in live)
+            }
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_template_registry():
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = TemplateRegistry()
+    return _registry
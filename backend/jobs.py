@@ -0,0 +1,81 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_DEPTH = int(os.getenv("JOB_QUEUE_DEPTH", "32"))
+JOB_TTL_SEC = int(os.getenv("JOB_TTL_SEC", "3600"))
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobManager:
+    # Bounded background pool for extraction jobs. At most `workers` jobs run
+    # at once and at most `queue_depth` more wait; beyond that submit() raises
+    # QueueFull so the API can answer 429 instead of piling up work.
+    # Finished jobs are kept for `ttl` seconds so clients can poll them.
+
+    def __init__(self, workers=JOB_WORKERS, queue_depth=JOB_QUEUE_DEPTH, ttl=JOB_TTL_SEC):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._slots = threading.BoundedSemaphore(workers + queue_depth)
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            raise QueueFull(f"Job queue is full ({self.workers} running, {self.queue_depth} queued)")
+
+        job_id = uuid.uuid4().hex
+        job = {
+            "id": job_id,
+            "status": "queued",
+            "createdAt": time.time(),
+            "finishedAt": None,
+            "result": None,
+            "error": None
+        }
+        with self._lock:
+            self._prune()
+            self._jobs[job_id] = job
+
+        try:
+            self._executor.submit(self._run, job, fn, args, kwargs)
+        except Exception:
+            self._slots.release()
+            with self._lock:
+                self._jobs.pop(job_id, None)
+            raise
+        return job_id
+
+    def _run(self, job, fn, args, kwargs):
+        job["status"] = "running"
+        try:
+            job["result"] = fn(*args, **kwargs)
+            job["status"] = "done"
+        except Exception as e:
+            job["error"] = str(e)
+            job["status"] = "failed"
+        finally:
+            job["finishedAt"] = time.time()
+            self._slots.release()
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _prune(self):
+        cutoff = time.time() - self.ttl
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job["finishedAt"] is not None and job["finishedAt"] < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
@@ -1,114 +1,454 @@
 import os
 import json
+import time
 import base64
+import random
 import mimetypes
+import threading
 from typing import Dict, Any
 
 from dotenv import load_dotenv
-from openai import OpenAI
+
+from extraction_cache import PARTIAL_KEY, get_cache, make_cache_key
+from image_preprocess import IMAGE_PREPROCESS, preprocess_image
+from metrics import LLM_CALL_TOKENS, LLM_CALLS, LLM_PAYLOAD_BYTES, LLM_TOKENS, inc, observe, timed
+from rate_limit import EST_TOKENS_PER_INVOICE, llm_limiter
 
 load_dotenv()
 
-api_key = os.getenv("OPENAI_API_KEY")
-if not api_key:
-    raise ValueError("OPENAI_API_KEY is missing. Check your .env file.")
+# The openai package takes most of a second to import, so it is loaded and
+# the client built on first use (or by the server's warm-up thread). A missing
+# key fails that call instead of the import.
+_client = None
+_client_lock = threading.Lock()
 
-client = OpenAI(api_key=api_key)
 
-SYSTEM = """
-You are an invoice extraction engine.
-
-Return ONLY valid JSON with this structure:
-{
-  "invoiceNumber": string,
-  "orderDate": "YYYY-MM-DD",
-  "dueDate": "YYYY-MM-DD",
-  "shipDate": "YYYY-MM-DD or null",
-  "purchaseOrderNumber": "string or null",
-  "customer": { "customerId": 0, "accountNumber": null, "name": string },
-  "terms": "string or null",
-  "shipVia": "string or null",
-  "subtotal": number,
-  "taxRate": number,
-  "tax": number,
-  "freight": number,
-  "totalDue": number,
-  "lineItems": [
-    {
-      "itemNumber": "string or null",
-      "description": string,
-      "qty": number,
-      "unitPrice": number,
-      "unitPriceDiscount": number,
-      "lineTotal": number
+def _api_key():
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY is missing. Check your .env file.")
+    return api_key
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from openai import OpenAI
+
+                # One client, so its pooled HTTP connections are reused.
+                # Retries are handled in _create (with Retry-After +
+                # deadline), not by the SDK.
+                _client = OpenAI(api_key=_api_key(), max_retries=0, timeout=LLM_DEADLINE_SEC)
+    return _client
+
+
+# Retry / deadline / concurrency settings for every LLM request
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "8"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+LLM_DEADLINE_SEC = float(os.getenv("LLM_DEADLINE_SEC", "90"))
+LLM_BACKOFF_BASE_SEC = 0.5
+LLM_BACKOFF_MAX_SEC = 20.0
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+# Caps requests in flight across all request/batch/page threads
+_in_flight = threading.BoundedSemaphore(LLM_MAX_IN_FLIGHT)
+
+# Output budget: an invoice with ~100 line items fits in 4k tokens. A reply
+# cut off at the cap is continued up to LLM_MAX_CONTINUATIONS times, then
+# repaired (closed after the last complete value).
+LLM_MAX_OUTPUT_TOKENS = int(os.getenv("LLM_MAX_OUTPUT_TOKENS", "4096"))
+LLM_MAX_CONTINUATIONS = int(os.getenv("LLM_MAX_CONTINUATIONS", "1"))
+# Strict JSON-schema output; 0 falls back to json_object mode with the schema
+# in the prompt (for OpenAI-compatible servers without structured outputs)
+LLM_STRUCTURED_OUTPUT = os.getenv("LLM_STRUCTURED_OUTPUT", "1") != "0"
+# Routes requests with the same static prefix (prompt + schema) to the same
+# provider cache. Opt-in (e.g. "invoice-extraction-v1"): not every
+# OpenAI-compatible server accepts the parameter.
+LLM_PROMPT_CACHE_KEY = os.getenv("LLM_PROMPT_CACHE_KEY", "")
+
+
+def _nullable(kind, **extra):
+    return {"type": [kind, "null"], **extra}
+
+
+def _object(properties):
+    # Strict mode: every property required, nothing else allowed
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False
+    }
+
+
+DATE = {"description": "YYYY-MM-DD"}
+
+INVOICE_SCHEMA = _object({
+    "invoiceNumber": _nullable("string"),
+    "orderDate": _nullable("string", **DATE),
+    "dueDate": _nullable("string", **DATE),
+    "shipDate": _nullable("string", **DATE),
+    "purchaseOrderNumber": _nullable("string"),
+    "customer": _object({
+        "customerId": {"type": "integer"},
+        "accountNumber": _nullable("string"),
+        "name": _nullable("string")
+    }),
+    "terms": _nullable("string"),
+    "shipVia": _nullable("string"),
+    "subtotal": _nullable("number"),
+    "taxRate": _nullable("number"),
+    "tax": _nullable("number"),
+    "freight": _nullable("number"),
+    "totalDue": _nullable("number"),
+    "lineItems": {
+        "type": "array",
+        "items": _object({
+            "itemNumber": _nullable("string"),
+            "description": {"type": "string"},
+            "qty": _nullable("number"),
+            "unitPrice": _nullable("number"),
+            "unitPriceDiscount": _nullable("number"),
+            "lineTotal": _nullable("number")
+        })
     }
-  ]
-}
-
-Rules:
-- If unknown, use null (where allowed) and customerId=0.
-- Dates must be YYYY-MM-DD when you can infer them.
-- Ensure lineTotal is consistent with qty and unitPrice where possible.
-- If taxRate is not shown, estimate it as tax/subtotal when possible, else 0.
-- If totals are missing, infer them from line items and tax/freight.
+})
+
+# Kept short: the schema carries the structure. Totals, tax rate and line
+# totals missing from the page are computed by invoice_normalize.
+SYSTEM = """
+Extract the invoice into JSON.
+- Copy values as printed; null when not on the invoice. customerId 0 unless printed.
+- Dates YYYY-MM-DD. Amounts as plain numbers. taxRate as a fraction (0.0825).
+- One lineItems entry per printed line, in order.
 """
+if not LLM_STRUCTURED_OUTPUT:
+    SYSTEM += "Schema: " + json.dumps(INVOICE_SCHEMA["properties"], separators=(",", ":")) + "\n"
 
-def _parse_json(content: str, context: str):
+# Cache keys change whenever the prompt or schema does
+PROMPT_ID = SYSTEM + json.dumps(INVOICE_SCHEMA, sort_keys=True)
+
+CONTINUE_PROMPT = "Your JSON was cut off. Continue exactly where it stopped; output only the rest."
+
+
+class LLMStats:
+    # Per call kind (text / image): calls, tokens (prompt, cached prefix,
+    # completion), latency, and how often replies were cut off, continued,
+    # repaired or failed
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.kinds = {}
+
+    def record(self, kind, model, usages, ms, outcome):
+        prompt = sum(getattr(u, "prompt_tokens", 0) or 0 for u in usages)
+        completion = sum(getattr(u, "completion_tokens", 0) or 0 for u in usages)
+        cached = sum(getattr(getattr(u, "prompt_tokens_details", None), "cached_tokens", 0) or 0 for u in usages)
+        inc(LLM_CALLS, kind=kind, outcome=outcome)
+        inc(LLM_TOKENS, prompt, kind=kind, type="prompt")
+        inc(LLM_TOKENS, cached, kind=kind, type="cached")
+        inc(LLM_TOKENS, completion, kind=kind, type="completion")
+        observe(LLM_CALL_TOKENS, prompt + completion, kind=kind)
+
+        with self._lock:
+            stats = self.kinds.setdefault(kind, {
+                "calls": 0, "requests": 0, "promptTokens": 0, "cachedTokens": 0, "completionTokens": 0,
+                "totalMs": 0.0, "ok": 0, "continued": 0, "repaired": 0, "failed": 0
+            })
+            stats["calls"] += 1
+            stats["requests"] += len(usages)
+            stats["promptTokens"] += prompt
+            stats["cachedTokens"] += cached
+            stats["completionTokens"] += completion
+            stats["totalMs"] += ms
+            stats[outcome] += 1
+
+    def stats(self):
+        with self._lock:
+            out = {}
+            for kind, stats in self.kinds.items():
+                calls = max(stats["calls"], 1)
+                out[kind] = {
+                    **{k: v for k, v in stats.items() if k != "totalMs"},
+                    "avgMs": round(stats["totalMs"] / calls, 1),
+                    "avgTokens": round((stats["promptTokens"] + stats["completionTokens"]) / calls)
+                }
+            return out
+
+
+llm_stats = LLMStats()
+
+
+def repair_json(content: str):
+    # Closes a truncated JSON object after its last complete top-level field
+    # or array element (an unfinished line item is dropped, not half-kept).
+    # Returns the object or None.
+    start = content.find("{")
+    if start < 0:
+        return None
+
+    stack, cuts = [], []
+    in_string = escaped = False
+    for i in range(start, len(content)):
+        ch = content[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            if not stack:
+                break
+            stack.pop()
+            if not stack:
+                # Complete object followed by junk
+                return json.loads(content[start:i + 1])
+            if len(stack) <= 2:
+                cuts.append((i + 1, "".join(reversed(stack))))
+        elif ch == "," and 0 < len(stack) <= 2:
+            cuts.append((i, "".join(reversed(stack))))
+
+    for end, closing in reversed(cuts[-20:]):
+        try:
+            return json.loads(content[start:end] + closing)
+        except json.JSONDecodeError:
+            continue
+    return None
+
+
+def _load_json(content: str, context: str):
+    # Returns (object, repaired)
     content = (content or "").strip()
+    if content.startswith("```"):
+        content = content.strip("`").removeprefix("json").strip()
     if not content:
         raise ValueError(f"Model returned empty content for {context}")
 
     try:
-        return json.loads(content)
+        return json.loads(content), False
     except json.JSONDecodeError as e:
+        repaired = repair_json(content)
+        if isinstance(repaired, dict):
+            print(f"WARN: repaired malformed JSON for {context}")
+            return repaired, True
         preview = content[:200].replace("\n", " ")
         raise ValueError(f"Invalid JSON for {context}. Preview: {preview}") from e
 
 
-def extract_invoice_text(text: str, model: str = "gpt-4o-mini") -> Dict[str, Any]:
-    if not text or not text.strip():
-        raise ValueError("Empty invoice text")
+def _request(messages, model: str):
+    kwargs = {
+        "model": model,
+        "temperature": 0,
+        "messages": messages,
+        "max_tokens": LLM_MAX_OUTPUT_TOKENS
+    }
+    if LLM_STRUCTURED_OUTPUT:
+        kwargs["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {"name": "invoice", "strict": True, "schema": INVOICE_SCHEMA}
+        }
+    else:
+        kwargs["response_format"] = {"type": "json_object"}
+    if LLM_PROMPT_CACHE_KEY:
+        kwargs["prompt_cache_key"] = LLM_PROMPT_CACHE_KEY
+    return kwargs
 
-    resp = client.chat.completions.create(
-        model=model,
-        temperature=0,
-        messages=[
-            {"role": "system", "content": SYSTEM.strip()},
-            {"role": "user", "content": text}
-        ],
-        response_format={"type": "json_object"}
-    )
 
-    return _parse_json(resp.choices[0].message.content, "text extraction")
+def _continuation(request, content: str):
+    # Free-form follow-up: a schema-constrained reply would restart the object
+    kwargs = {k: v for k, v in request.items() if k != "response_format"}
+    kwargs["messages"] = request["messages"] + [
+        {"role": "assistant", "content": content},
+        {"role": "user", "content": CONTINUE_PROMPT}
+    ]
+    return kwargs
 
 
-def extract_invoice_image(file_path: str, model: str = "gpt-4o-mini") -> Dict[str, Any]:
+def _finish(kind, model, content, usages, started):
+    try:
+        extracted, repaired = _load_json(content, f"{kind} extraction")
+    except ValueError:
+        llm_stats.record(kind, model, usages, (time.perf_counter() - started) * 1000, "failed")
+        raise
+    outcome = "repaired" if repaired else "continued" if len(usages) > 1 else "ok"
+    llm_stats.record(kind, model, usages, (time.perf_counter() - started) * 1000, outcome)
+    if outcome != "ok":
+        extracted[PARTIAL_KEY] = outcome
+    return extracted
+
+
+def _retry_after_seconds(error):
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+
+    headers = response.headers
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    if headers.get("retry-after"):
+        try:
+            return float(headers["retry-after"])
+        except ValueError:
+            pass
+    return None
+
+
+def _is_retryable(error):
+    from openai import APIConnectionError, APIStatusError, APITimeoutError
+
+    if isinstance(error, (APIConnectionError, APITimeoutError)):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code in RETRYABLE_STATUS
+
+
+def _create(client, request, deadline_at: float, deadline: float):
+    # Every request to the provider goes through the RPM/TPM buckets and the
+    # in-flight cap (cache and template hits never get here). 408/409/429/5xx
+    # and connection errors are retried until the call's deadline.
+    attempt = 0
+    while True:
+        remaining = deadline_at - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"LLM call exceeded {deadline:.0f}s deadline")
+
+        llm_limiter.acquire(EST_TOKENS_PER_INVOICE)
+        if not _in_flight.acquire(timeout=remaining):
+            raise TimeoutError(f"LLM call exceeded {deadline:.0f}s deadline")
+        try:
+            return client.chat.completions.create(**request, timeout=remaining)
+        except Exception as e:
+            if not _is_retryable(e) or attempt >= LLM_MAX_RETRIES:
+                raise
+            error = e
+        finally:
+            _in_flight.release()
+        if time.monotonic() >= deadline_at:
+            raise TimeoutError(f"LLM call exceeded {deadline:.0f}s deadline") from error
+
+        # Full-jitter exponential backoff, but never sooner than Retry-After
+        delay = random.uniform(0, min(LLM_BACKOFF_MAX_SEC, LLM_BACKOFF_BASE_SEC * (2 ** attempt)))
+        retry_after = _retry_after_seconds(error)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+
+        if delay >= deadline_at - time.monotonic():
+            raise error
+        attempt += 1
+        time.sleep(delay)
+
+
+def _chat_json(messages, model: str, kind: str, deadline: float = LLM_DEADLINE_SEC):
+    # Continuations share the call's deadline
+    started = time.perf_counter()
+    deadline_at = time.monotonic() + deadline
+    request = _request(messages, model)
+    client = get_client()
+    with timed(f"llm_{kind}"):
+        resp = _create(client, request, deadline_at, deadline)
+        content = resp.choices[0].message.content or ""
+        usages = [resp.usage]
+
+        for _ in range(LLM_MAX_CONTINUATIONS):
+            if resp.choices[0].finish_reason != "length":
+                break
+            resp = _create(client, _continuation(request, content), deadline_at, deadline)
+            content += resp.choices[0].message.content or ""
+            usages.append(resp.usage)
+
+    return _finish(kind, model, content, usages, started)
+
+
+def _text_messages(text: str):
+    return [
+        {"role": "system", "content": SYSTEM.strip()},
+        {"role": "user", "content": text}
+    ]
+
+
+def _image_messages(data: bytes, mime: str):
+    observe(LLM_PAYLOAD_BYTES, len(data))
+    with timed("base64_encode"):
+        b64 = base64.b64encode(data).decode("utf-8")
+    data_url = f"data:{mime};base64,{b64}"
+
+    # Static prefix first so the provider can cache it across calls
+    return [
+        {"role": "system", "content": SYSTEM.strip()},
+        {
+            "role": "user",
+            "content": [
+                {"type": "image_url", "image_url": {"url": data_url}}
+            ]
+        }
+    ]
+
+
+def _read_image(file_path: str):
     mime, _ = mimetypes.guess_type(file_path)
     if not mime:
         mime = "image/jpeg"
 
     with open(file_path, "rb") as f:
-        b64 = base64.b64encode(f.read()).decode("utf-8")
+        return f.read(), mime
+
+
+def _prepare_image(data: bytes, mime: str, preprocess: bool):
+    if not (preprocess and IMAGE_PREPROCESS):
+        return data, mime
+    try:
+        with timed("image_preprocess"):
+            data, mime, _ = preprocess_image(data, mime)
+    except Exception as e:
+        # Unreadable by Pillow; let the model try the original bytes
+        print("WARN: image preprocessing skipped:", e)
+    return data, mime
+
+
+def extract_invoice_text(text: str, model: str = "gpt-4o-mini",
+                         deadline: float = LLM_DEADLINE_SEC) -> Dict[str, Any]:
+    if not text or not text.strip():
+        raise ValueError("Empty invoice text")
+
+    return _chat_json(_text_messages(text), model, "text", deadline)
+
+
+def extract_invoice_bytes(data, mime: str = "image/jpeg", model: str = "gpt-4o-mini", use_cache: bool = True,
+                          preprocess: bool = True, deadline: float = LLM_DEADLINE_SEC) -> Dict[str, Any]:
+    # Identical re-uploads (retries, double-clicks) skip the LLM call
+    cache_key = make_cache_key(data, model, PROMPT_ID)
+    if use_cache:
+        cached = get_cache().get(cache_key)
+        if cached is not None:
+            return cached
+
+    data, mime = _prepare_image(data, mime, preprocess)
+
+    extracted = _chat_json(_image_messages(data, mime), model, "image", deadline)
+    get_cache().put(cache_key, extracted)
+    return extracted
+
+
+def extract_invoice_image(file_path: str, model: str = "gpt-4o-mini", use_cache: bool = True,
+                          preprocess: bool = True, deadline: float = LLM_DEADLINE_SEC) -> Dict[str, Any]:
+    data, mime = _read_image(file_path)
+    return extract_invoice_bytes(data, mime, model=model, use_cache=use_cache, preprocess=preprocess,
+                                 deadline=deadline)
 
-    data_url = f"data:{mime};base64,{b64}"
 
-    resp = client.chat.completions.create(
-        model=model,
-        temperature=0,
-        messages=[
-            {"role": "system", "content": SYSTEM.strip()},
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": "Extract invoice fields from this image."},
-                    {"type": "image_url", "image_url": {"url": data_url}}
-                ]
-            }
-        ],
-        response_format={"type": "json_object"}
-    )
-
-    return _parse_json(resp.choices[0].message.content, "image extraction")
-
-
-__all__ = ["extract_invoice_text", "extract_invoice_image"]
+__all__ = [
+    "extract_invoice_text",
+    "extract_invoice_image",
+    "extract_invoice_bytes",
+]
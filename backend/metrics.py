@@ -0,0 +1,211 @@
+import contextvars
+import os
+import threading
+import time
+
+# Counters, gauges and histograms in the Prometheus text format, plus
+# per-stage timing spans. With METRICS_ENABLED=0 (and no Server-Timing) every
+# call returns straight away.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+# Adds a Server-Timing header (one entry per stage) to API responses
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = tuple(1024 * 4 ** i for i in range(9))  # 1 KB .. 64 MB
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, _label_text(self.labels, k), v) for k, v in sorted(self._values.items())]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        out = []
+        with self._lock:
+            for key, series in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, series):
+                    out.append((self.name + "_bucket", _label_text(self.labels + ("le",), key + (bound,)), count))
+                out.append((self.name + "_bucket", _label_text(self.labels + ("le",), key + ("+Inf",)), series[-1]))
+                out.append((self.name + "_sum", _label_text(self.labels, key), round(series[-2], 6)))
+                out.append((self.name + "_count", _label_text(self.labels, key), series[-1]))
+        return out
+
+
+REGISTRY = {}
+
+def _register(metric):
+    REGISTRY[metric.name] = metric
+    return metric
+
+
+STAGE_SECONDS = _register(Histogram(
+    "invoice_stage_seconds", "Time spent in each processing stage", ("stage",)))
+HTTP_SECONDS = _register(Histogram(
+    "invoice_http_request_seconds", "API request latency", ("endpoint", "status")))
+UPLOAD_BYTES = _register(Histogram(
+    "invoice_upload_bytes", "Size of accepted uploads", ("mime",), BYTES_BUCKETS))
+LLM_PAYLOAD_BYTES = _register(Histogram(
+    "invoice_llm_payload_bytes", "Image bytes sent to the model after preprocessing", (), BYTES_BUCKETS))
+LLM_CALL_TOKENS = _register(Histogram(
+    "invoice_llm_call_tokens", "Prompt + completion tokens per extraction call", ("kind",), TOKEN_BUCKETS))
+LLM_TOKENS = _register(Counter(
+    "invoice_llm_tokens_total", "LLM tokens by kind and type", ("kind", "type")))
+LLM_CALLS = _register(Counter(
+    "invoice_llm_calls_total", "Extraction calls by kind and outcome", ("kind", "outcome")))
+CACHE_REQUESTS = _register(Counter(
+    "invoice_extraction_cache_requests_total", "Extraction cache lookups", ("result",)))
+ROUTES = _register(Counter(
+    "invoice_extraction_routes_total", "Extractions by route and fallback reason", ("route", "reason")))
+ORDERS_SAVED = _register(Counter(
+    "invoice_orders_saved_total", "Orders saved (new) or matched to an existing one (duplicate)", ("result",)))
+WORKBOOK_ROWS_WRITTEN = _register(Counter(
+    "invoice_workbook_rows_written_total", "Journaled rows compacted into the workbook"))
+WORKBOOK_ORDERS = _register(Gauge(
+    "invoice_workbook_orders", "SalesOrderHeader rows in the workbook snapshot"))
+WORKBOOK_PENDING_ROWS = _register(Gauge(
+    "invoice_workbook_pending_rows", "Journaled rows not yet compacted"))
+
+
+def render():
+    lines = []
+    for metric in REGISTRY.values():
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{labels} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# ---- stage spans ----
+# Server-Timing entries of the current request (None outside one)
+_request_spans = contextvars.ContextVar("request_spans", default=None)
+
+
+class _Span:
+    __slots__ = ("stage", "started")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        if METRICS_ENABLED:
+            STAGE_SECONDS.observe(elapsed, stage=self.stage)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((self.stage, elapsed))
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def timed(stage):
+    # with timed("workbook_save"): ...
+    if METRICS_ENABLED or SERVER_TIMING:
+        return _Span(stage)
+    return _NO_SPAN
+
+
+def inc(counter, amount=1, **labels):
+    if METRICS_ENABLED:
+        counter.inc(amount, **labels)
+
+
+def observe(histogram, value, **labels):
+    if METRICS_ENABLED:
+        histogram.observe(value, **labels)
+
+
+def set_gauge(gauge, value, **labels):
+    if METRICS_ENABLED:
+        gauge.set(value, **labels)
+
+
+def start_request():
+    # Returns a token for end_request; collects spans only with SERVER_TIMING
+    return _request_spans.set([]) if SERVER_TIMING else None
+
+
+def end_request(token):
+    # Server-Timing header value ("stage;dur=ms, ..."), stages summed by name
+    if token is None:
+        return None
+    spans = _request_spans.get() or []
+    _request_spans.reset(token)
+    totals = {}
+    for stage, elapsed in spans:
+        totals[stage] = totals.get(stage, 0.0) + elapsed
+    return ", ".join(f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in totals.items())
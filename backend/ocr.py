@@ -0,0 +1,60 @@
+import io
+import os
+
+from PIL import Image, ImageOps
+
+from metrics import timed
+
+# Local OCR for the text-first extraction route. Optional: needs the
+# pytesseract package plus the tesseract binary on PATH.
+try:
+    import pytesseract
+except ImportError:
+    pytesseract = None
+
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+OCR_TIMEOUT_SEC = float(os.getenv("OCR_TIMEOUT_SEC", "20"))
+
+_available = None
+
+
+def ocr_available():
+    # Checked once; pytesseract imports fine without the binary
+    global _available
+    if _available is None:
+        if pytesseract is None:
+            _available = False
+        else:
+            try:
+                pytesseract.get_tesseract_version()
+                _available = True
+            except Exception as e:
+                print("WARN: tesseract not usable, OCR disabled:", e)
+                _available = False
+    return _available
+
+
+def ocr_image(data, lang=OCR_LANG, timeout=OCR_TIMEOUT_SEC):
+    # Returns (text, mean word confidence 0-100). Text keeps Tesseract's line
+    # breaks so tables stay one row per line for the model.
+    if not ocr_available():
+        raise Exception("OCR is not available (install pytesseract and tesseract)")
+
+    with timed("ocr"):
+        img = Image.open(io.BytesIO(data))
+        img = ImageOps.exif_transpose(img).convert("L")
+        words = pytesseract.image_to_data(img, lang=lang, timeout=timeout, output_type=pytesseract.Output.DICT)
+
+    lines, confidences = {}, []
+    for i, word in enumerate(words["text"]):
+        word = (word or "").strip()
+        conf = float(words["conf"][i])
+        if not word or conf < 0:
+            continue
+        line = (words["block_num"][i], words["par_num"][i], words["line_num"][i])
+        lines.setdefault(line, []).append(word)
+        confidences.append(conf)
+
+    text = "\n".join(" ".join(line_words) for line_words in lines.values())
+    mean_conf = sum(confidences) / len(confidences) if confidences else 0.0
+    return text, mean_conf
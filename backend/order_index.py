@@ -0,0 +1,123 @@
+import bisect
+import datetime
+import threading
+
+
+def date_key(value):
+    # "YYYY-MM-DD" for datetimes, dates and ISO-ish strings; None otherwise
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()[:10]
+    if isinstance(value, str) and len(value) >= 10 and value[4] == "-" and value[7] == "-":
+        return value[:10]
+    return None
+
+
+def _norm(value):
+    if value is None:
+        return None
+    text = str(value).strip().upper()
+    return text or None
+
+
+class OrderIndex:
+    # In-memory indexes over SalesOrderHeader / SalesOrderDetail:
+    # hash maps for ID, customer and PO number, plus a sorted (OrderDate, ID)
+    # list for range queries. Built once from the sheets, then updated on
+    # every save, so lookups never re-read the workbook.
+
+    def __init__(self):
+        self._headers = {}
+        self._details = {}
+        self._by_date = []
+        self._by_customer = {}
+        self._by_po = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._headers)
+
+    def __contains__(self, sales_order_id):
+        return sales_order_id in self._headers
+
+    def add(self, header: dict, details=None):
+        sales_order_id = header.get("SalesOrderID")
+        if sales_order_id is None:
+            return
+
+        with self._lock:
+            if sales_order_id in self._headers:
+                return
+            self._headers[sales_order_id] = header
+            self._details.setdefault(sales_order_id, []).extend(details or [])
+
+            key = date_key(header.get("OrderDate"))
+            if key:
+                bisect.insort(self._by_date, (key, sales_order_id))
+
+            for value in (header.get("CustomerID"), header.get("AccountNumber")):
+                customer = _norm(value)
+                if customer and customer != "0":
+                    self._by_customer.setdefault(customer, set()).add(sales_order_id)
+
+            po = _norm(header.get("PurchaseOrderNumber"))
+            if po:
+                self._by_po.setdefault(po, set()).add(sales_order_id)
+
+    def add_detail(self, detail: dict):
+        with self._lock:
+            self._details.setdefault(detail.get("SalesOrderID"), []).append(detail)
+
+    def get(self, sales_order_id):
+        with self._lock:
+            header = self._headers.get(sales_order_id)
+            if header is None:
+                return None
+            return {"header": header, "details": list(self._details.get(sales_order_id, []))}
+
+    def query(self, date_from=None, date_to=None, customer=None, po=None, limit=100, offset=0):
+        # Returns (matching headers page, total matches), ordered by OrderDate
+        # when a date range is given, else by SalesOrderID.
+        with self._lock:
+            candidates = None
+            if po:
+                candidates = set(self._by_po.get(_norm(po), ()))
+            if customer:
+                ids = self._by_customer.get(_norm(customer), set())
+                candidates = set(ids) if candidates is None else candidates & ids
+
+            if date_from or date_to:
+                lo = bisect.bisect_left(self._by_date, (date_key(date_from) or "", -1)) if date_from else 0
+                hi = bisect.bisect_right(self._by_date, (date_key(date_to) or "", float("inf"))) if date_to else len(self._by_date)
+                ordered = [
+                    sales_order_id for _, sales_order_id in self._by_date[lo:hi]
+                    if candidates is None or sales_order_id in candidates
+                ]
+            elif candidates is not None:
+                ordered = sorted(candidates)
+            else:
+                ordered = sorted(self._headers)
+
+            page = ordered[offset:offset + limit]
+            return [self._headers[i] for i in page], len(ordered)
+
+    def add_rows(self, header_cols, header_rows, detail_cols, detail_rows):
+        # Adds the orders not indexed yet (with their details); returns their IDs
+        order_col = header_cols.index("SalesOrderID")
+        added = set()
+        for row in header_rows:
+            sales_order_id = row[order_col]
+            if sales_order_id is not None and sales_order_id not in self._headers:
+                self.add(dict(zip(header_cols, row)))
+                added.add(sales_order_id)
+
+        detail_order_col = detail_cols.index("SalesOrderID")
+        for row in detail_rows:
+            if row[detail_order_col] in added:
+                self.add_detail(dict(zip(detail_cols, row)))
+        return added
+
+    @classmethod
+    def from_rows(cls, header_cols, header_rows, detail_cols, detail_rows):
+        index = cls()
+        index.add_rows(header_cols, header_rows, detail_cols, detail_rows)
+        return index
@@ -0,0 +1,68 @@
+# Mapping from an extracted invoice (LLM JSON) to SalesOrderHeader /
+# SalesOrderDetail rows. Shared by every storage backend and the scripts.
+
+# Column layout of the case-study workbook
+HEADER_COLUMNS = [
+    "SalesOrderID", "RevisionNumber", "OrderDate", "DueDate", "ShipDate", "Status",
+    "OnlineOrderFlag", "SalesOrderNumber", "PurchaseOrderNumber", "AccountNumber",
+    "CustomerID", "SalesPersonID", "TerritoryID", "BillToAddressID", "ShipToAddressID",
+    "ShipMethodID", "CreditCardID", "CreditCardApprovalCode", "CurrencyRateID",
+    "SubTotal", "TaxAmt", "Freight", "TotalDue"
+]
+DETAIL_COLUMNS = [
+    "SalesOrderID", "SalesOrderDetailID", "CarrierTrackingNumber", "OrderQty",
+    "ProductID", "SpecialOfferID", "UnitPrice", "UnitPriceDiscount", "LineTotal"
+]
+
+def to_float(val, default=0.0):
+    try:
+        return float(val)
+    except Exception:
+        return default
+
+def build_order_rows(extracted: dict, sales_order_id: int, detail_id: int, comment_prefix: str = "Fast insert"):
+    # Pure mapping: expects a dict from invoice_normalize.normalize_extractions,
+    # where line totals, tax and totalDue are already filled in and reconciled.
+    items = extracted.get("lineItems") or []
+    subtotal = to_float(extracted.get("subtotal"), 0)
+    tax = to_float(extracted.get("tax"), 0)
+    freight = to_float(extracted.get("freight"), 0)
+    total_due = to_float(extracted.get("totalDue"), 0)
+
+    # 1) Header row dict
+    header_row = {
+        "SalesOrderID": sales_order_id,
+        "RevisionNumber": 1,
+        "OrderDate": extracted.get("orderDate"),
+        "DueDate": extracted.get("dueDate"),
+        "ShipDate": extracted.get("shipDate"),
+        "Status": 1,
+        "OnlineOrderFlag": False,
+        "SalesOrderNumber": f"SO-{sales_order_id}",
+        "PurchaseOrderNumber": extracted.get("purchaseOrderNumber") or extracted.get("invoiceNumber"),
+        "AccountNumber": (extracted.get("customer") or {}).get("accountNumber"),
+        "CustomerID": (extracted.get("customer") or {}).get("customerId") or 0,
+        "SubTotal": subtotal,
+        "TaxAmt": tax,
+        "Freight": freight,
+        "TotalDue": total_due,
+        "Comment": f"{comment_prefix}: {extracted.get('invoiceNumber', 'N/A')}"
+    }
+
+    # 2) Detail row dicts
+    detail_rows = []
+    for it in items:
+        detail_rows.append({
+            "SalesOrderID": sales_order_id,
+            "SalesOrderDetailID": detail_id,
+            "OrderQty": to_float(it.get("qty"), 0),
+            "UnitPrice": to_float(it.get("unitPrice"), 0),
+            "UnitPriceDiscount": to_float(it.get("unitPriceDiscount"), 0),
+            "LineTotal": to_float(it.get("lineTotal"), 0),
+            "ProductID": it.get("productNumber"),
+            "CarrierTrackingNumber": None,
+            "SpecialOfferID": None
+        })
+        detail_id += 1
+
+    return header_row, detail_rows
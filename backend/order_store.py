@@ -0,0 +1,121 @@
+import atexit
+import os
+import threading
+
+from dedupe_index import DEDUPE_ENABLED, DEDUPE_FUZZY, SaveInProgress, get_dedupe_index
+from invoice_normalize import normalize_extraction, normalize_extractions
+from metrics import ORDERS_SAVED, inc, timed
+
+ORDER_STORE_BACKEND = os.getenv("ORDER_STORE_BACKEND", "excel")  # excel | sqlite
+
+
+class OrderStore:
+    # Interface every persistence backend implements. Orders go in as
+    # extracted invoice dicts and come out as
+    # {"header": {...}, "details": [{...}, ...]} keyed by sheet column names.
+
+    def append_order(self, extracted: dict):
+        return self.append_orders([extracted])[0]
+
+    def append_orders(self, extracted_list):
+        # Returns the new SalesOrderIDs, in input order
+        raise NotImplementedError
+
+    def get_order(self, sales_order_id):
+        raise NotImplementedError
+
+    def query_orders(self, date_from=None, date_to=None, customer=None, po=None, limit=100, offset=0):
+        # Returns (list of header dicts, total match count). Dates are
+        # "YYYY-MM-DD" (inclusive); customer matches CustomerID or AccountNumber.
+        raise NotImplementedError
+
+    def monthly_totals(self, date_from=None, date_to=None):
+        # [{"month": "YYYY-MM", "orders", "subTotal", "taxAmt", "freight", "totalDue"}]
+        raise NotImplementedError
+
+    def next_ids(self):
+        # {"SalesOrderID": n, "SalesOrderDetailID": m} that would be used next
+        raise NotImplementedError
+
+    def export_xlsx(self, path):
+        raise NotImplementedError
+
+    def flush(self):
+        return 0
+
+    def close(self):
+        pass
+
+
+def create_store(backend=ORDER_STORE_BACKEND, **kwargs):
+    # Backends are imported lazily so e.g. the SQLite store never loads openpyxl
+    if backend == "excel":
+        from excel_store_fast import ExcelOrderStore
+        return ExcelOrderStore(**kwargs)
+    if backend == "sqlite":
+        from sqlite_store import SqliteOrderStore
+        return SqliteOrderStore(**kwargs)
+    raise ValueError(f"Unknown ORDER_STORE_BACKEND: {backend}. Use excel or sqlite")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = create_store()
+                atexit.register(_store.close)
+    return _store
+
+def flush_store():
+    if _store is not None:
+        return _store.flush()
+    return 0
+
+def save_orders_unique(extracted_list, image_hashes=None, fuzzy=DEDUPE_FUZZY):
+    # Returns [(sales_order_id, is_duplicate)]; duplicates keep their old ID.
+    # Raises dedupe_index.SaveInProgress (with the partial results) when
+    # another request is still saving one of the invoices.
+    image_hashes = image_hashes or [None] * len(extracted_list)
+    with timed("order_save"):
+        if not DEDUPE_ENABLED:
+            results = [(i, False) for i in get_store().append_orders(extracted_list)]
+        else:
+            try:
+                results = get_dedupe_index().save_unique(extracted_list, image_hashes, get_store().append_orders,
+                                                         fuzzy=fuzzy)
+            except SaveInProgress as e:
+                _count_saved(e.results)
+                raise
+    _count_saved(results)
+    return results
+
+def _count_saved(results):
+    results = [result for result in results if result is not None]
+    duplicates = sum(1 for _, duplicate in results if duplicate)
+    inc(ORDERS_SAVED, len(results) - duplicates, result="new")
+    inc(ORDERS_SAVED, duplicates, result="duplicate")
+
+def save_order_unique(extracted: dict, image_hash=None, fuzzy=DEDUPE_FUZZY):
+    return save_orders_unique([extracted], [image_hash], fuzzy)[0]
+
+def find_duplicate_image(image_hash):
+    # Checked before extraction so a re-uploaded image costs no LLM call
+    if not DEDUPE_ENABLED:
+        return None
+    return get_dedupe_index().find_image(image_hash)
+
+# The *_from_json helpers take raw extractions and normalize them first;
+# the API normalizes itself (to return the report) and calls *_unique.
+def save_order_from_json(extracted: dict, image_hash=None):
+    extracted, _ = normalize_extraction(extracted)
+    sales_order_id, _ = save_order_unique(extracted, image_hash)
+    return sales_order_id
+
+def save_orders_from_json(extracted_list, image_hashes=None):
+    extracted_list, _ = normalize_extractions(extracted_list)
+    results = save_orders_unique(extracted_list, image_hashes)
+    return [sales_order_id for sales_order_id, _ in results]
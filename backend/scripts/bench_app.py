@@ -0,0 +1,504 @@
+import argparse
+import datetime
+import http.server
+import json
+import math
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# End-to-end benchmark of the API without the real LLM. Starts a local
+# OpenAI-compatible stub (fixed latency + jitter, optional error rate) that
+# replays sample_extracted.json, then, for every workbook size x concurrency,
+# starts the app against a fresh copy of a generated workbook and posts
+# invoice uploads to /api/extract-and-save-file.
+#
+#   python scripts/bench_app.py
+#   python scripts/bench_app.py --sizes 200,20000 --concurrency 1,8,32 --requests 200
+#   python scripts/bench_app.py --error-rate 0.05 --baseline /tmp/invoice-bench/<earlier run>.json
+#
+# Reports throughput, p50/p95/p99 latency, peak RSS of the app process, the
+# per-stage averages from /api/metrics, and startup: import time, time until
+# /api/health answers and until the first upload is answered (while the store
+# may still be warming up). Results are written as JSON (default
+# $TMPDIR/invoice-bench, or BENCH_RESULTS_DIR) so two versions can be
+# compared with --baseline. Nothing is written under data/.
+
+SAMPLE_JSON = os.path.join(BACKEND_DIR, "scripts", "sample_extracted.json")
+SAMPLE_IMAGE = os.path.join(BACKEND_DIR, "..", "test-data", "invoice.jpg")
+SOURCE_XLSX = os.path.join(BACKEND_DIR, "data", "Case Study Data_tiny.xlsx")
+RESULTS_DIR = os.getenv("BENCH_RESULTS_DIR", os.path.join(tempfile.gettempdir(), "invoice-bench"))
+
+# Also writes how long `import app` took to the file named by argv[2]
+APP_RUNNER = (
+    "import sys, time; started = time.perf_counter(); from app import app, start_warm_up; "
+    "open(sys.argv[2], 'w').write(str(time.perf_counter() - started)); "
+    "start_warm_up(); app.run(host='127.0.0.1', port=int(sys.argv[1]), threaded=True)"
+)
+APP_START_TIMEOUT_SEC = 120
+REQUEST_TIMEOUT_SEC = 300
+
+
+class FakeLLM:
+    # Answers /v1/chat/completions with the canned extraction. Each reply
+    # gets its own invoice number so saves are not collapsed by the dedupe
+    # index. Failed calls return 503, which llm_extractor retries with backoff.
+
+    def __init__(self, canned, latency_ms, jitter_ms, error_rate, seed):
+        self.canned = canned
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self._server = None
+
+    def _next(self):
+        with self._lock:
+            self.calls += 1
+            delay = max(0.0, self.latency_ms + self._rng.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+            failed = self._rng.random() < self.error_rate
+            if failed:
+                self.errors += 1
+            return self.calls, delay, failed
+
+    def _reply(self, n, request):
+        content = json.dumps(dict(self.canned, invoiceNumber=f"{self.canned.get('invoiceNumber')}-{n}"))
+        prompt_tokens = len(json.dumps(request.get("messages", ""))) // 4
+        completion_tokens = len(content) // 4
+        return {
+            "id": f"chatcmpl-bench-{n}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "bench"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        }
+
+    def start(self):
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if not self.path.endswith("/chat/completions"):
+                    return self._send(404, {"error": {"message": "not found"}})
+
+                n, delay, failed = stub._next()
+                time.sleep(delay)
+                if failed:
+                    return self._send(503, {"error": {"message": "injected failure", "type": "server_error"}})
+                self._send(200, stub._reply(n, json.loads(body or b"{}")))
+
+            def _send(self, status, payload):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self._server.server_port}/v1"
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+def make_workbook(orders, dest):
+    # Grows (or shrinks) the sample workbook to `orders` headers by tiling its
+    # orders with shifted IDs; details stay consistent with their headers, as
+    # in shrink_excel_consistent.py. Read with pandas directly so no columnar
+    # snapshot is left behind for the source.
+    header = pd.read_excel(SOURCE_XLSX, sheet_name="SalesOrderHeader")
+    detail = pd.read_excel(SOURCE_XLSX, sheet_name="SalesOrderDetail")
+    order_span = int(header["SalesOrderID"].max() - header["SalesOrderID"].min()) + 1
+    detail_span = int(detail["SalesOrderDetailID"].max() - detail["SalesOrderDetailID"].min()) + 1
+
+    headers, details = [], []
+    for copy in range(math.ceil(orders / len(header))):
+        h = header.copy()
+        h["SalesOrderID"] += copy * order_span
+        h["SalesOrderNumber"] = "SO" + h["SalesOrderID"].astype(str)
+        d = detail.copy()
+        d["SalesOrderID"] += copy * order_span
+        d["SalesOrderDetailID"] += copy * detail_span
+        headers.append(h)
+        details.append(d)
+
+    header = pd.concat(headers, ignore_index=True).head(orders)
+    detail = pd.concat(details, ignore_index=True)
+    detail = detail[detail["SalesOrderID"].isin(set(header["SalesOrderID"].tolist()))]
+
+    with pd.ExcelWriter(dest, engine="openpyxl") as writer:
+        header.to_excel(writer, sheet_name="SalesOrderHeader", index=False)
+        detail.to_excel(writer, sheet_name="SalesOrderDetail", index=False)
+    return len(header), len(detail)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def peak_rss_mb(pid):
+    # High-water mark of the process' resident set (Linux); None elsewhere
+    try:
+        with open(f"/proc/{pid}/status", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def children_peak_rss_mb():
+    # Fallback: largest child so far (ru_maxrss is KB on Linux, bytes on macOS)
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def http_get(url, timeout=5):
+    with urllib.request.urlopen(url, timeout=timeout) as resp:
+        return resp.read().decode("utf-8")
+
+
+class AppProcess:
+    # The Flask app (threaded dev server, as app.py runs it) with all of its
+    # state files under `work_dir`
+
+    def __init__(self, work_dir, xlsx_path, llm_url, args):
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        env = dict(
+            os.environ,
+            PYTHONUNBUFFERED="1",
+            OPENAI_API_KEY="bench",
+            OPENAI_BASE_URL=llm_url,
+            EXTRACTION_MODE=args.mode,
+            ORDER_STORE_BACKEND=args.backend,
+            ORDER_XLSX_PATH=xlsx_path,
+            ORDER_SQLITE_PATH=os.path.join(work_dir, "orders.sqlite3"),
+            ORDER_JOURNAL_DIR=os.path.join(work_dir, "journal"),
+            COLUMNAR_DIR=os.path.join(work_dir, "columnar"),
+            EXCEL_SHARD_DIR=os.path.join(work_dir, "shards"),
+            DEDUPE_PATH=os.path.join(work_dir, "dedupe.sqlite3"),
+            EXTRACTION_CACHE_PATH=os.path.join(work_dir, "extraction_cache.sqlite3"),
+            TEMPLATES_PATH=os.path.join(work_dir, "invoice_templates.json"),
+        )
+        self.log_path = os.path.join(work_dir, "app.log")
+        self._import_path = os.path.join(work_dir, "import_sec.txt")
+        self._log = open(self.log_path, "w", encoding="utf-8")
+        self.started = time.perf_counter()
+        self.proc = subprocess.Popen([sys.executable, "-c", APP_RUNNER, str(self.port), self._import_path],
+                                     cwd=BACKEND_DIR, env=env, stdout=self._log, stderr=subprocess.STDOUT)
+        self._wait_ready()
+        self.startup_sec = round(time.perf_counter() - self.started, 3)
+
+    def import_sec(self):
+        try:
+            with open(self._import_path, "r", encoding="utf-8") as f:
+                return round(float(f.read()), 3)
+        except (OSError, ValueError):
+            return None
+
+    def warm_up_sec(self):
+        try:
+            return json.loads(http_get(self.url + "/api/health")).get("warmUpSec")
+        except (OSError, urllib.error.URLError, ValueError):
+            return None
+
+    def _wait_ready(self):
+        deadline = time.monotonic() + APP_START_TIMEOUT_SEC
+        while time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                raise Exception(f"App exited during startup, see {self.log_path}")
+            try:
+                http_get(self.url + "/api/health", timeout=1)
+                return
+            except (OSError, urllib.error.URLError):
+                time.sleep(0.05)
+        raise Exception(f"App did not answer /api/health within {APP_START_TIMEOUT_SEC}s")
+
+    def stage_averages(self):
+        # {stage: {"count", "avgMs"}} from the invoice_stage_seconds histogram
+        try:
+            text = http_get(self.url + "/api/metrics")
+        except (OSError, urllib.error.URLError):
+            return {}
+        sums, counts = {}, {}
+        for line in text.splitlines():
+            for suffix, target in (("_sum", sums), ("_count", counts)):
+                prefix = f'invoice_stage_seconds{suffix}{{stage="'
+                if line.startswith(prefix):
+                    stage, value = line[len(prefix):].split('"} ')
+                    target[stage] = float(value)
+        return {
+            stage: {"count": int(counts[stage]), "avgMs": round(sums[stage] / counts[stage] * 1000, 2)}
+            for stage in sorted(counts) if counts[stage]
+        }
+
+    def stop(self):
+        # SIGINT lets the server exit normally, so the store's final flush runs
+        # (and is timed); killed if it takes too long
+        started = time.perf_counter()
+        self.proc.send_signal(signal.SIGINT)
+        try:
+            self.proc.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+        self._log.close()
+        return round(time.perf_counter() - started, 3)
+
+
+def multipart(filename, data, mime):
+    boundary = uuid.uuid4().hex
+    head = (f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            f"Content-Type: {mime}\r\n\r\n").encode("utf-8")
+    return head + data + f"\r\n--{boundary}--\r\n".encode("utf-8"), f"multipart/form-data; boundary={boundary}"
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)]
+
+
+def post_upload(url, image, n):
+    # (seconds, status). Bytes after the JPEG end marker make every upload
+    # unique (no image dedupe or cache shortcut) without changing the picture.
+    body, content_type = multipart(f"invoice-{n}.jpg", image + f"bench-{n}-{uuid.uuid4().hex}".encode(), "image/jpeg")
+    req = urllib.request.Request(url, data=body, headers={"Content-Type": content_type}, method="POST")
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=REQUEST_TIMEOUT_SEC) as resp:
+            resp.read()
+            status = resp.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except (OSError, urllib.error.URLError):
+        status = "connection_error"
+    return time.perf_counter() - started, status
+
+
+def upload_url(app_url, mode):
+    return f"{app_url}/api/extract-and-save-file?mode={mode}"
+
+
+def run_load(app_url, image, requests, concurrency, mode):
+    url = upload_url(app_url, mode)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda n: post_upload(url, image, n), range(requests)))
+    wall = time.perf_counter() - started
+
+    latencies = sorted(elapsed * 1000 for elapsed, _ in results)
+    statuses = {}
+    for _, status in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        "wallSec": round(wall, 3),
+        "throughputRps": round(requests / wall, 2),
+        "latencyMs": {
+            "mean": round(sum(latencies) / len(latencies), 1),
+            "p50": round(percentile(latencies, 50), 1),
+            "p95": round(percentile(latencies, 95), 1),
+            "p99": round(percentile(latencies, 99), 1),
+            "max": round(latencies[-1], 1)
+        },
+        "statuses": statuses
+    }
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                             capture_output=True, text=True, timeout=10)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(runs, baseline_path):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {(r["workbookOrders"], r["concurrency"]): r for r in json.load(f)["runs"]}
+    print(f"\nAgainst {baseline_path} (positive = slower / more memory):")
+    for run in runs:
+        old = baseline.get((run["workbookOrders"], run["concurrency"]))
+        if old is None:
+            continue
+
+        def change(new_value, old_value):
+            if not new_value or not old_value:
+                return "    n/a"
+            return f"{(new_value / old_value - 1) * 100:+6.1f}%"
+
+        print(f"  {run['workbookOrders']:>7} orders  c={run['concurrency']:<3}"
+              f"  throughput {change(old['throughputRps'], run['throughputRps'])}"
+              f"  p50 {change(run['latencyMs']['p50'], old['latencyMs']['p50'])}"
+              f"  p95 {change(run['latencyMs']['p95'], old['latencyMs']['p95'])}"
+              f"  p99 {change(run['latencyMs']['p99'], old['latencyMs']['p99'])}"
+              f"  rss {change(run['peakRssMb'], old['peakRssMb'])}"
+              f"  first response {change(run.get('firstResponseSec'), old.get('firstResponseSec'))}")
+
+
+def int_list(value):
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the API against a local fake LLM")
+    parser.add_argument("--sizes", type=int_list, default=[200, 5000], help="workbook sizes in orders (comma separated)")
+    parser.add_argument("--concurrency", type=int_list, default=[1, 4, 16], help="concurrent clients (comma separated)")
+    parser.add_argument("--requests", type=int, default=100, help="uploads per run")
+    parser.add_argument("--latency-ms", type=float, default=300, help="fake LLM latency")
+    parser.add_argument("--jitter-ms", type=float, default=100, help="+/- random latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of LLM calls answered with 503")
+    parser.add_argument("--mode", default="image", choices=("image", "text_first"), help="EXTRACTION_MODE of the app")
+    parser.add_argument("--backend", default="excel", choices=("excel", "sqlite"), help="ORDER_STORE_BACKEND of the app")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--out", help="results file (default <BENCH_RESULTS_DIR>/bench_app_<time>.json)")
+    parser.add_argument("--baseline", help="earlier results file to compare with")
+    parser.add_argument("--keep", action="store_true", help="keep the work directory (workbooks, logs)")
+    args = parser.parse_args()
+
+    with open(SAMPLE_JSON, "r", encoding="utf-8") as f:
+        canned = json.load(f)
+    with open(SAMPLE_IMAGE, "rb") as f:
+        image = f.read()
+
+    started_at = datetime.datetime.now()
+    work_dir = tempfile.mkdtemp(prefix="bench_app_")
+    llm = FakeLLM(canned, args.latency_ms, args.jitter_ms, args.error_rate, args.seed)
+    llm_url = llm.start()
+    runs = []
+    try:
+        for size in args.sizes:
+            source = os.path.join(work_dir, f"orders_{size}.xlsx")
+            t0 = time.perf_counter()
+            headers, details = make_workbook(size, source)
+            print(f"Workbook: {headers} orders, {details} detail rows ({time.perf_counter() - t0:.1f} s to generate)")
+
+            for concurrency in args.concurrency:
+                run_dir = os.path.join(work_dir, f"run_{size}_c{concurrency}")
+                os.makedirs(run_dir)
+                xlsx_path = os.path.join(run_dir, "orders.xlsx")
+                shutil.copyfile(source, xlsx_path)
+
+                calls_before, errors_before = llm.calls, llm.errors
+                app = AppProcess(run_dir, xlsx_path, llm_url, args)
+                try:
+                    # Sent as soon as /api/health answers: time to first request
+                    first_sec, first_status = post_upload(upload_url(app.url, args.mode), image, "first")
+                    first_response_sec = round(time.perf_counter() - app.started, 3)
+                    result = run_load(app.url, image, args.requests, concurrency, args.mode)
+                    stages = app.stage_averages()
+                    warm_up_sec = app.warm_up_sec()
+                    rss = peak_rss_mb(app.proc.pid)
+                finally:
+                    shutdown_sec = app.stop()
+                if rss is None:
+                    rss = children_peak_rss_mb()
+
+                run = {
+                    "workbookOrders": headers,
+                    "workbookDetailRows": details,
+                    "concurrency": concurrency,
+                    "requests": args.requests,
+                    "importSec": app.import_sec(),
+                    "startupSec": app.startup_sec,
+                    "warmUpSec": warm_up_sec,
+                    "firstRequestMs": round(first_sec * 1000, 1),
+                    "firstRequestStatus": first_status,
+                    "firstResponseSec": first_response_sec,
+                    **result,
+                    "shutdownSec": shutdown_sec,
+                    "peakRssMb": rss,
+                    "llmCalls": llm.calls - calls_before,
+                    "llmErrors": llm.errors - errors_before,
+                    "stages": stages
+                }
+                runs.append(run)
+                lat = run["latencyMs"]
+                print(f"  c={concurrency:<3} import {run['importSec']} s, health {run['startupSec']} s, "
+                      f"first response {first_response_sec} s")
+                print(f"        {run['throughputRps']:7.2f} req/s  p50 {lat['p50']:8.1f} ms"
+                      f"  p95 {lat['p95']:8.1f} ms  p99 {lat['p99']:8.1f} ms  rss {rss} MB"
+                      f"  statuses {run['statuses']}")
+    finally:
+        llm.stop()
+        if args.keep:
+            print("Work directory kept:", work_dir)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    results = {
+        "startedAt": started_at.isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "platform": sys.platform,
+        "config": {
+            "requests": args.requests,
+            "latencyMs": args.latency_ms,
+            "jitterMs": args.jitter_ms,
+            "errorRate": args.error_rate,
+            "mode": args.mode,
+            "backend": args.backend,
+            "seed": args.seed
+        },
+        "runs": runs
+    }
+    out = args.out or os.path.join(RESULTS_DIR, f"bench_app_{started_at:%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print("Results written to", out)
+
+    if args.baseline:
+        compare(runs, args.baseline)
+
+if __name__ == "__main__":
+    main()
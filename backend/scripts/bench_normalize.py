@@ -0,0 +1,103 @@
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from invoice_normalize import normalize_extractions
+from order_mapping import to_float
+
+# Usage: python scripts/bench_normalize.py [line_items]   (default 100000)
+LINE_ITEMS = 100_000
+ITEMS_PER_INVOICE = 10
+SEED = 7
+
+
+def make_invoices(line_items):
+    # Synthetic extractions with the usual LLM noise: numbers as strings,
+    # missing line totals / totals, percent tax rates, odd date formats
+    rng = random.Random(SEED)
+    invoices = []
+    for n in range(line_items // ITEMS_PER_INVOICE):
+        items = []
+        for _ in range(ITEMS_PER_INVOICE):
+            qty = rng.randint(1, 20)
+            unit = round(rng.uniform(1, 500), 2)
+            item = {"description": "Widget", "qty": qty, "unitPrice": unit, "lineTotal": round(qty * unit, 2)}
+            roll = rng.random()
+            if roll < 0.1:
+                item["unitPrice"] = f"${unit:,.2f}"
+            elif roll < 0.3:
+                item["lineTotal"] = None
+            items.append(item)
+
+        subtotal = round(sum(it["qty"] * float(str(it["unitPrice"]).strip("$").replace(",", "")) for it in items), 2)
+        invoice = {
+            "invoiceNumber": f"INV-{n}",
+            "orderDate": "2024-03-15" if n % 5 else "03/15/2024",
+            "dueDate": "2024-04-14",
+            "subtotal": subtotal,
+            "taxRate": 8.25 if n % 7 == 0 else 0.0825,
+            "tax": round(subtotal * 0.0825, 2),
+            "freight": 10,
+            "totalDue": round(subtotal * 1.0825 + 10, 2) if n % 4 else None,
+            "lineItems": items
+        }
+        invoices.append(invoice)
+    return invoices
+
+
+def legacy_normalize(extracted):
+    # Per-dict logic previously split between app.normalize_extracted and
+    # order_mapping.build_order_rows, kept here as the baseline
+    subtotal = float(extracted.get("subtotal", 0) or 0)
+    tax = float(extracted.get("tax", 0) or 0)
+    freight = float(extracted.get("freight", 0) or 0)
+    if subtotal > 0:
+        inferred_rate = tax / subtotal
+        if 0 <= inferred_rate <= 0.2:
+            extracted["taxRate"] = round(inferred_rate, 4)
+    if not extracted.get("totalDue"):
+        extracted["totalDue"] = round(subtotal + tax + freight, 2)
+
+    for it in extracted.get("lineItems") or []:
+        qty = to_float(it.get("qty"), 0)
+        unit = to_float(it.get("unitPrice"), 0)
+        if it.get("lineTotal") is None:
+            it["lineTotal"] = qty * unit
+    return extracted
+
+
+def timed(label, fn, line_items):
+    t0 = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - t0
+    print(f"{label:<28} {elapsed * 1000:8.1f} ms  {line_items / elapsed:12,.0f} line items/s")
+    return elapsed
+
+
+def main():
+    line_items = int(sys.argv[1]) if len(sys.argv) > 1 else LINE_ITEMS
+    invoices = make_invoices(line_items)
+    line_items = sum(len(i["lineItems"]) for i in invoices)
+    print(f"{len(invoices)} invoices, {line_items} line items")
+
+    # The legacy baseline only fills gaps; it does no validation, string
+    # cleaning or date parsing. The legacy path mutates its input, so it
+    # gets its own copy.
+    legacy_input = [dict(i, lineItems=[dict(it) for it in i["lineItems"]]) for i in invoices]
+    timed("legacy (per dict)", lambda: [legacy_normalize(i) for i in legacy_input], line_items)
+
+    normalized = []
+    timed("vectorized (one batch)", lambda: normalized.extend(normalize_extractions(invoices)[1]), line_items)
+
+    # Single-request path: one invoice per call
+    timed("vectorized (1 per call)", lambda: [normalize_extractions([i]) for i in invoices[:1000]],
+          sum(len(i["lineItems"]) for i in invoices[:1000]))
+
+    flagged = sum(1 for report in normalized if not report["valid"])
+    print(f"Invoices with validation issues: {flagged} of {len(invoices)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import glob
+import json
+import mimetypes
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_preprocess import preprocess_image
+
+TEST_DATA_DIR = "../test-data"
+IMAGE_PATTERNS = ("*.jpg", "*.jpeg", "*.png")
+
+def compare_extraction(path):
+    # Needs OPENAI_API_KEY; imported lazily so the size report runs offline
+    from llm_extractor import extract_invoice_image
+
+    raw = extract_invoice_image(path, use_cache=False, preprocess=False)
+    processed = extract_invoice_image(path, use_cache=False, preprocess=True)
+    if raw == processed:
+        return True, []
+
+    changed = sorted(k for k in set(raw) | set(processed) if raw.get(k) != processed.get(k))
+    return False, changed
+
+def main():
+    check_extraction = "--check-extraction" in sys.argv
+
+    paths = sorted(p for pattern in IMAGE_PATTERNS for p in glob.glob(os.path.join(TEST_DATA_DIR, pattern)))
+    if not paths:
+        print("No images found in", TEST_DATA_DIR)
+        return
+
+    total_before = total_after = 0
+    mismatches = 0
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        mime = mimetypes.guess_type(path)[0] or "image/jpeg"
+
+        t0 = time.perf_counter()
+        _, out_mime, stats = preprocess_image(data, mime)
+        elapsed_ms = (time.perf_counter() - t0) * 1000
+
+        total_before += stats["bytesBefore"]
+        total_after += stats["bytesAfter"]
+        saved_pct = 100 * (1 - stats["bytesAfter"] / stats["bytesBefore"])
+        print(f"{os.path.basename(path)}: {stats['bytesBefore']:,} -> {stats['bytesAfter']:,} bytes "
+              f"({saved_pct:.1f}% smaller), {stats['sizeBefore']} -> {stats['sizeAfter']}, "
+              f"{out_mime}, {elapsed_ms:.1f} ms")
+
+        if check_extraction:
+            same, changed = compare_extraction(path)
+            print("  extraction:", "unchanged" if same else f"CHANGED fields {json.dumps(changed)}")
+            mismatches += 0 if same else 1
+
+    print(f"Total: {total_before:,} -> {total_after:,} bytes "
+          f"({100 * (1 - total_after / total_before):.1f}% smaller) over {len(paths)} images")
+
+    if mismatches:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+import argparse
+import glob
+import json
+import os
+import signal
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dedupe_index import DEDUPE_ENABLED, SaveInProgress, get_dedupe_index
+from invoice_normalize import normalize_extractions
+from order_mapping import build_order_rows
+from order_store import ORDER_STORE_BACKEND, create_store
+from xlsx_stream import XlsxReader
+
+# Bulk import / backfill of previously extracted invoices (LLM JSON).
+#
+#   python scripts/bulk_import.py extractions/           # every *.json below the dir
+#   python scripts/bulk_import.py extractions.jsonl      # one extraction per line
+#   python scripts/bulk_import.py extractions/ --fresh "data/Case Study Data_new.xlsx"
+#
+# Every batch is validated and normalized in one vectorized pass
+# (invoice_normalize), the same logic the API uses.
+# Default mode goes through the order store (journal + one compaction at the
+# end), so it is safe next to a running API server. Progress is checkpointed
+# after every batch; rerunning the same command resumes where it stopped.
+# Invoices already in the dedupe index (saved by the API or an earlier,
+# interrupted run) are skipped.
+# --fresh instead streams the current workbook plus all imported orders into
+# a new .xlsx with openpyxl write-only mode (constant memory, no store).
+
+BATCH_SIZE = 500
+COMMENT_PREFIX = "Bulk import"
+
+
+def iter_inputs(source):
+    # Yields (key, extracted or None, error) in a stable order
+    if os.path.isdir(source):
+        paths = sorted(glob.glob(os.path.join(source, "**", "*.json"), recursive=True))
+        for path in paths:
+            key = os.path.relpath(path, source)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    yield key, json.load(f), None
+            except (OSError, json.JSONDecodeError) as e:
+                yield key, None, str(e)
+    elif source.endswith(".jsonl"):
+        with open(source, "r", encoding="utf-8") as f:
+            for lineno, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield f"line {lineno}", json.loads(line), None
+                except json.JSONDecodeError as e:
+                    yield f"line {lineno}", None, str(e)
+    else:
+        with open(source, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        for i, extracted in enumerate(data if isinstance(data, list) else [data]):
+            yield f"item {i}", extracted, None
+
+
+def validate(extracted):
+    if not isinstance(extracted, dict):
+        return "not a JSON object"
+    if not isinstance(extracted.get("lineItems") or [], list):
+        return "lineItems must be a list"
+    return None
+
+
+def prepare_batch(batch, skip_invalid):
+    # Structural checks, then one vectorized normalization pass for the batch.
+    # Returns (normalized extractions, failed count, flagged count).
+    keys, good, failed = [], [], 0
+    for key, extracted, error in batch:
+        error = error or validate(extracted)
+        if error:
+            failed += 1
+            print(f"WARN: skipping {key}: {error}")
+        else:
+            keys.append(key)
+            good.append(extracted)
+
+    normalized, reports = normalize_extractions(good)
+    kept, flagged = [], 0
+    for key, extracted, report in zip(keys, normalized, reports):
+        if not report["valid"]:
+            flagged += 1
+            if skip_invalid:
+                failed += 1
+                print(f"WARN: skipping {key}: {'; '.join(report['issues'])}")
+                continue
+        kept.append(extracted)
+    return kept, failed, flagged
+
+
+class ImportState:
+    # Resume checkpoint: how many inputs were consumed and the key of the
+    # last one, written atomically after each committed batch.
+
+    def __init__(self, path, source):
+        self.path = path
+        self.source = os.path.abspath(source)
+        self.position = 0
+        self.last_key = None
+        self.imported = 0
+        self.duplicates = 0
+        self.flagged = 0
+        self.failed = 0
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return False
+        if state.get("source") != self.source:
+            raise Exception(f"{self.path} belongs to another import ({state.get('source')}); use --restart")
+        self.position = state["position"]
+        self.last_key = state["last_key"]
+        self.imported = state["imported"]
+        self.duplicates = state.get("duplicates", 0)
+        self.flagged = state.get("flagged", 0)
+        self.failed = state["failed"]
+        return True
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "source": self.source,
+                "position": self.position,
+                "last_key": self.last_key,
+                "imported": self.imported,
+                "duplicates": self.duplicates,
+                "flagged": self.flagged,
+                "failed": self.failed
+            }, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+def skip_done(inputs, state):
+    # Drop inputs a previous run already committed
+    for position, item in enumerate(inputs, start=1):
+        if position < state.position:
+            continue
+        if position == state.position:
+            if item[0] != state.last_key:
+                raise Exception(
+                    f"Input changed since the last run (expected {state.last_key!r} at position "
+                    f"{state.position}, found {item[0]!r}); use --restart"
+                )
+            continue
+        yield item
+
+
+def batches(inputs, size):
+    batch = []
+    for item in inputs:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Progress:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.orders = 0
+        self.rows = 0
+
+    def add(self, orders, rows):
+        self.orders += orders
+        self.rows += rows
+
+    def report(self, prefix="  "):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        print(f"{prefix}{self.orders} orders, {self.rows} rows in {elapsed:.1f}s "
+              f"({self.orders / elapsed:.0f} orders/s, {self.rows / elapsed:.0f} rows/s)")
+
+
+def stop_after_batch():
+    # First Ctrl-C finishes the current batch and checkpoints; a batch cut in
+    # half could be journaled without its checkpoint and be imported twice.
+    stop = []
+
+    def handler(signum, frame):
+        if stop:
+            raise KeyboardInterrupt
+        stop.append(True)
+        print("Stopping after the current batch (Ctrl-C again to abort)")
+
+    signal.signal(signal.SIGINT, handler)
+    return stop
+
+
+def save_waiting(dedupe, extracted_list, save_fn):
+    # dedupe.save_unique, waiting out invoices another process (e.g. the API)
+    # is saving right now, so the checkpoint never moves past an unsaved one
+    results = [None] * len(extracted_list)
+    todo = list(range(len(extracted_list)))
+    while todo:
+        try:
+            done = dedupe.save_unique([extracted_list[i] for i in todo], [None] * len(todo), save_fn)
+        except SaveInProgress as e:
+            print("WARN:", e)
+            done = e.results
+        for i, result in zip(todo, done):
+            results[i] = result
+        todo = [i for i in todo if results[i] is None]
+    return results
+
+
+def import_into_store(args):
+    state = ImportState(args.state or args.source.rstrip("/\\") + ".import-state.json", args.source)
+    if args.restart and os.path.exists(state.path):
+        os.remove(state.path)
+    if state.load():
+        print(f"Resuming after {state.position} inputs ({state.imported} imported, "
+              f"{state.duplicates} duplicates, {state.failed} failed)")
+
+    # No background compaction: one snapshot write at the end (or per --flush-every batches)
+    if args.backend == "excel":
+        kwargs = {"path": args.workbook, "flush_interval": 3600, "flush_every_rows": float("inf")}
+    else:
+        kwargs = {}
+    store = create_store(args.backend, **kwargs)
+    dedupe = get_dedupe_index() if DEDUPE_ENABLED and not args.no_dedupe else None
+
+    stop = stop_after_batch()
+    progress = Progress()
+    try:
+        for number, batch in enumerate(batches(skip_done(iter_inputs(args.source), state), args.batch_size), start=1):
+            good, failed, flagged = prepare_batch(batch, args.skip_invalid)
+            state.failed += failed
+            state.flagged += flagged
+
+            if good and dedupe:
+                results = save_waiting(dedupe, good, store.append_orders)
+                duplicates = sum(1 for _, duplicate in results if duplicate)
+                good = [e for e, (_, duplicate) in zip(good, results) if not duplicate]
+                state.duplicates += duplicates
+            elif good:
+                store.append_orders(good)
+
+            if good:
+                progress.add(len(good), sum(1 + len(e.get("lineItems") or []) for e in good))
+                state.imported += len(good)
+
+            # Orders are durable (journal / transaction) before the checkpoint moves
+            state.position += len(batch)
+            state.last_key = batch[-1][0]
+            state.save()
+            progress.report()
+
+            if args.flush_every and number % args.flush_every == 0:
+                store.flush()
+            if stop:
+                print("Interrupted; rerun the same command to resume")
+                break
+    finally:
+        store.close()
+
+    progress.report("Done: ")
+    print(f"Total imported: {state.imported}, duplicates: {state.duplicates}, failed: {state.failed}, "
+          f"with validation issues: {state.flagged}. Checkpoint: {state.path}")
+
+
+def import_fresh(args):
+    from openpyxl import Workbook
+
+    dest = Workbook(write_only=True)
+    progress = Progress()
+
+    # Copy existing rows, tracking the max IDs so new ones continue from there
+    columns, next_ids = {}, {}
+    with XlsxReader(args.workbook) as src:
+        for sheet, id_col in (("SalesOrderHeader", "SalesOrderID"), ("SalesOrderDetail", "SalesOrderDetailID")):
+            columns[sheet] = src.header(sheet)
+            id_idx = columns[sheet].index(id_col)
+            ws = dest.create_sheet(sheet)
+            ws.append(columns[sheet])
+            max_id = 0
+            for row in src.rows(sheet):
+                ws.append(row)
+                if row[id_idx] is not None:
+                    max_id = max(max_id, int(row[id_idx]))
+            next_ids[sheet] = max_id + 1
+
+    header_ws, detail_ws = dest["SalesOrderHeader"], dest["SalesOrderDetail"]
+    failed = flagged = 0
+    for batch in batches(iter_inputs(args.source), args.batch_size):
+        good, batch_failed, batch_flagged = prepare_batch(batch, args.skip_invalid)
+        failed += batch_failed
+        flagged += batch_flagged
+
+        for extracted in good:
+            header_row, detail_rows = build_order_rows(
+                extracted, next_ids["SalesOrderHeader"], next_ids["SalesOrderDetail"], COMMENT_PREFIX
+            )
+            next_ids["SalesOrderHeader"] += 1
+            next_ids["SalesOrderDetail"] += max(len(detail_rows), 1)
+
+            header_ws.append([header_row.get(col) for col in columns["SalesOrderHeader"]])
+            for detail_row in detail_rows:
+                detail_ws.append([detail_row.get(col) for col in columns["SalesOrderDetail"]])
+            progress.add(1, 1 + len(detail_rows))
+        progress.report()
+
+    tmp_path = args.fresh + ".tmp"
+    dest.save(tmp_path)
+    os.replace(tmp_path, args.fresh)
+
+    progress.report("Done: ")
+    print(f"Wrote {args.fresh} (failed: {failed}, with validation issues: {flagged}). "
+          f"Next SalesOrderID: {next_ids['SalesOrderHeader']}")
+
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import extracted invoice JSON into the order store")
+    parser.add_argument("source", help="directory of *.json files, a .jsonl file, or a .json file (object or list)")
+    parser.add_argument("--backend", default=ORDER_STORE_BACKEND, help="excel | sqlite (store mode)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--flush-every", type=int, default=0,
+                        help="compact into the workbook every N batches (default: once at the end)")
+    parser.add_argument("--state", help="checkpoint file (default: <source>.import-state.json)")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start over")
+    parser.add_argument("--skip-invalid", action="store_true",
+                        help="skip extractions whose totals/dates fail validation (default: import and count them)")
+    parser.add_argument("--no-dedupe", action="store_true", help="import invoices even if already saved")
+    parser.add_argument("--fresh", metavar="DEST_XLSX", help="write a new workbook in write-only mode instead")
+    parser.add_argument("--workbook", default="data/Case Study Data_tiny.xlsx",
+                        help="workbook to import into (excel backend) or copy from (--fresh)")
+    args = parser.parse_args()
+
+    if args.fresh:
+        import_fresh(args)
+    else:
+        import_into_store(args)
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,25 @@
-import pandas as pd
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xlsx_stream import XlsxReader
 
 DEMO_XLSX = "data/Case Study Data_demo.xlsx"
 
-# Load workbook and list sheets
-xls = pd.ExcelFile(DEMO_XLSX)
-print("Sheets found:", xls.sheet_names)
+# Streams only the ID columns, so this runs in constant memory on any size
+with XlsxReader(DEMO_XLSX) as reader:
+    print("Sheets found:", reader.sheetnames)
 
-# Read 2 main tables
-header = pd.read_excel(DEMO_XLSX, sheet_name="SalesOrderHeader")
-detail = pd.read_excel(DEMO_XLSX, sheet_name="SalesOrderDetail")
+    header_rows = sum(1 for _ in reader.rows("SalesOrderHeader", ["SalesOrderID"]))
+    detail_rows = sum(1 for _ in reader.rows("SalesOrderDetail", ["SalesOrderID"]))
+    max_id = reader.max_value("SalesOrderHeader", "SalesOrderID")
 
-print("Header rows:", len(header))
-print("Detail rows:", len(detail))
+print("Header rows:", header_rows)
+print("Detail rows:", detail_rows)
 
 # Find next SalesOrderID
-max_id = header["SalesOrderID"].max()
-next_id = int(max_id) + 1 if pd.notna(max_id) else 1
+next_id = int(max_id) + 1 if max_id is not None else 1
 
 print("Current max SalesOrderID:", max_id)
 print("Next SalesOrderID should be:", next_id)
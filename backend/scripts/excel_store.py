@@ -1,11 +1,27 @@
-import pandas as pd
+import os
+import sys
+
 from openpyxl import load_workbook
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import xlsx_stream
+from invoice_normalize import normalize_extraction
+from order_mapping import build_order_rows
+
 DEMO_XLSX = "data/Case Study Data_demo.xlsx"
 
-def next_id(sheet_name, id_col):
-    df = pd.read_excel(DEMO_XLSX, sheet_name=sheet_name, usecols=[id_col])
-    return int(df[id_col].max()) + 1 if not df.empty else 1
+# Next free ID per (sheet, column); read from Excel once, then kept in memory
+_next_ids = {}
+
+def next_id(sheet_name, id_col, count=1):
+    key = (sheet_name, id_col)
+    if key not in _next_ids:
+        _next_ids[key] = xlsx_stream.next_id(DEMO_XLSX, sheet_name, id_col)
+
+    value = _next_ids[key]
+    _next_ids[key] += count
+    return value
 
 def append_row(sheet_name, row_dict):
     wb = load_workbook(DEMO_XLSX)
@@ -17,74 +33,17 @@ def append_row(sheet_name, row_dict):
     ws.append(row)
     wb.save(DEMO_XLSX)
 
-def to_float(val, default=0.0):
-    try:
-        return float(val)
-    except Exception:
-        return default
-
 def save_order_from_json(extracted: dict):
-    sales_order_id = next_id("SalesOrderHeader", "SalesOrderID")
+    extracted, _ = normalize_extraction(extracted)
 
+    sales_order_id = next_id("SalesOrderHeader", "SalesOrderID")
     items = extracted.get("lineItems") or []
-    for it in items:
-        qty = to_float(it.get("qty"), 0)
-        unit = to_float(it.get("unitPrice"), 0)
-        if it.get("lineTotal") is None:
-            it["lineTotal"] = qty * unit
-
-    computed_subtotal = sum(to_float(i.get("lineTotal"), 0) for i in items)
-    subtotal = to_float(extracted.get("subtotal"), computed_subtotal)
-
-    tax = extracted.get("tax")
-    tax_rate = extracted.get("taxRate")
-    if tax is None and tax_rate is not None:
-        tax = subtotal * to_float(tax_rate, 0)
-    tax = to_float(tax, 0)
-
-    freight = to_float(extracted.get("freight"), 0)
+    detail_id = next_id("SalesOrderDetail", "SalesOrderDetailID", len(items))
 
-    total_due = extracted.get("totalDue")
-    if total_due is None:
-        total_due = subtotal + tax + freight
-    total_due = to_float(total_due, 0)
-
-    header_row = {
-        "SalesOrderID": sales_order_id,
-        "RevisionNumber": 1,
-        "OrderDate": extracted.get("orderDate"),
-        "DueDate": extracted.get("dueDate"),
-        "ShipDate": extracted.get("shipDate"),
-        "Status": 1,
-        "OnlineOrderFlag": False,
-        "SalesOrderNumber": f"SO-{sales_order_id}",
-        "PurchaseOrderNumber": extracted.get("purchaseOrderNumber") or extracted.get("invoiceNumber"),
-        "AccountNumber": extracted.get("customer", {}).get("accountNumber"),
-        "CustomerID": extracted.get("customer", {}).get("customerId") or 0,
-        "SubTotal": subtotal,
-        "TaxAmt": tax,
-        "Freight": freight,
-        "TotalDue": total_due,
-        "Comment": f"Inserted via API: {extracted.get('invoiceNumber', 'N/A')}"
-    }
+    header_row, detail_rows = build_order_rows(extracted, sales_order_id, detail_id, "Inserted via API")
 
     append_row("SalesOrderHeader", header_row)
-
-    detail_id = next_id("SalesOrderDetail", "SalesOrderDetailID")
-
-    for it in items:
-        detail_row = {
-            "SalesOrderID": sales_order_id,
-            "SalesOrderDetailID": detail_id,
-            "OrderQty": to_float(it.get("qty"), 0),
-            "UnitPrice": to_float(it.get("unitPrice"), 0),
-            "UnitPriceDiscount": to_float(it.get("unitPriceDiscount"), 0),
-            "LineTotal": to_float(it.get("lineTotal"), 0),
-            "ProductID": it.get("productNumber"),
-            "CarrierTrackingNumber": None,
-            "SpecialOfferID": None
-        }
+    for detail_row in detail_rows:
         append_row("SalesOrderDetail", detail_row)
-        detail_id += 1
 
     return sales_order_id
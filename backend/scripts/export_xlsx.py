@@ -0,0 +1,23 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from order_store import ORDER_STORE_BACKEND, create_store
+
+DEST = "data/Case Study Data_export.xlsx"
+
+def main():
+    dest = sys.argv[1] if len(sys.argv) > 1 else DEST
+    backend = sys.argv[2] if len(sys.argv) > 2 else ORDER_STORE_BACKEND
+
+    store = create_store(backend)
+    try:
+        store.export_xlsx(dest)
+    finally:
+        store.close()
+
+    print(f"✅ Exported {backend} order store to:", dest)
+
+if __name__ == "__main__":
+    main()
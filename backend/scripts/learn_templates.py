@@ -0,0 +1,71 @@
+import glob
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extraction_cache import get_cache, make_cache_key
+from extraction_pipeline import LLM_IMAGE_MODEL, LLM_TEXT_MODEL, text_result_problems
+from invoice_normalize import normalize_extraction
+from invoice_templates import get_template_registry
+from llm_extractor import PROMPT_ID
+from ocr import ocr_available, ocr_image
+
+# Learns invoice templates from past extractions without calling the LLM:
+# each image is OCR'd locally and paired with its cached extraction (image or
+# text route). Images never extracted before are skipped.
+#
+#   python scripts/learn_templates.py ../test-data
+
+IMAGE_PATTERNS = ("*.jpg", "*.jpeg", "*.png")
+
+
+def cached_extraction(data):
+    cache = get_cache()
+    for model in ("ocr+" + LLM_TEXT_MODEL, LLM_IMAGE_MODEL):
+        extracted = cache.get(make_cache_key(data, model, PROMPT_ID))
+        if extracted is not None:
+            return extracted
+    return None
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python scripts/learn_templates.py <image dir>")
+        sys.exit(1)
+    if not ocr_available():
+        print("Tesseract OCR is not available; install pytesseract and tesseract")
+        sys.exit(1)
+
+    paths = sorted(p for pattern in IMAGE_PATTERNS for p in glob.glob(os.path.join(sys.argv[1], pattern)))
+    registry = get_template_registry()
+    learned = skipped = 0
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+
+        extracted = cached_extraction(data)
+        if extracted is None:
+            print(f"{os.path.basename(path)}: no cached extraction, skipped")
+            skipped += 1
+            continue
+
+        extracted, validation = normalize_extraction(extracted)
+        problems = text_result_problems(extracted, validation)
+        if problems:
+            print(f"{os.path.basename(path)}: extraction fails validation ({'; '.join(problems)}), skipped")
+            skipped += 1
+            continue
+
+        text, _ = ocr_image(data)
+        template = registry.learn(text, extracted)
+        if template:
+            learned += 1
+            print(f"{os.path.basename(path)}: template {template['id']} ({len(template['rules'])} fields)")
+        else:
+            print(f"{os.path.basename(path)}: layout could not be captured")
+
+    print(f"Learned {learned}, skipped {skipped}; {len(registry)} templates in {registry.path}")
+
+if __name__ == "__main__":
+    main()
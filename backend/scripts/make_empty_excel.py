@@ -1,13 +1,19 @@
-import pandas as pd
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from workbook_shards import create_empty_workbook
+from xlsx_stream import XlsxReader
 
 SRC = "data/Case Study Data_demo.xlsx"
 DEST = "data/Case Study Data_empty.xlsx"
 
-header_cols = pd.read_excel(SRC, sheet_name="SalesOrderHeader", nrows=0)
-detail_cols = pd.read_excel(SRC, sheet_name="SalesOrderDetail", nrows=0)
+# Only the header rows are read
+with XlsxReader(SRC) as reader:
+    header_cols = reader.header("SalesOrderHeader")
+    detail_cols = reader.header("SalesOrderDetail")
 
-with pd.ExcelWriter(DEST, engine="openpyxl") as writer:
-    header_cols.to_excel(writer, sheet_name="SalesOrderHeader", index=False)
-    detail_cols.to_excel(writer, sheet_name="SalesOrderDetail", index=False)
+create_empty_workbook(DEST, header_cols, detail_cols)
 
 print("✅ Created empty structured Excel:", DEST)
@@ -1,11 +1,18 @@
+import os
+import sys
+
 import pandas as pd
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from columnar_snapshot import read_sheet
+
 SRC = "data/Case Study Data_demo.xlsx"
 DEST = "data/Case Study Data_small.xlsx"
 
-# Read only the 2 necessary sheets
-header = pd.read_excel(SRC, sheet_name="SalesOrderHeader")
-detail = pd.read_excel(SRC, sheet_name="SalesOrderDetail")
+# Read only the 2 necessary sheets (from the columnar snapshot)
+header = read_sheet(SRC, "SalesOrderHeader")
+detail = read_sheet(SRC, "SalesOrderDetail")
 
 # Write only these 2 sheets into a new workbook
 with pd.ExcelWriter(DEST, engine="openpyxl") as writer:
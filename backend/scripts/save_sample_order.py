@@ -1,11 +1,17 @@
-import pandas as pd
+import os
+import sys
+
 from openpyxl import load_workbook
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import xlsx_stream
+
 DEMO_XLSX = "data/Case Study Data_demo.xlsx"
 
 def next_id(sheet_name, id_col):
-    df = pd.read_excel(DEMO_XLSX, sheet_name=sheet_name, usecols=[id_col])
-    return int(df[id_col].max()) + 1 if not df.empty else 1
+    # Streams just the ID column
+    return xlsx_stream.next_id(DEMO_XLSX, sheet_name, id_col)
 
 def append_row(sheet_name, row_dict):
     wb = load_workbook(DEMO_XLSX)
@@ -0,0 +1,58 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from workbook_shards import ShardManifest, merge_workbooks
+
+# Inspect or combine the workbook shards of the Excel store (EXCEL_SHARDING).
+# Works on the files alone, next to a running server.
+#
+#   python scripts/shards.py list
+#   python scripts/shards.py find 75140
+#   python scripts/shards.py merge "data/Case Study Data_combined.xlsx"
+
+USAGE = "Usage: python scripts/shards.py list | find <SalesOrderID> | merge <dest.xlsx>"
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ("list", "find", "merge"):
+        print(USAGE)
+        sys.exit(1)
+
+    manifest = ShardManifest()
+    shards = manifest.shards()
+    if not shards:
+        print("No shard manifest in", manifest.directory, "(is EXCEL_SHARDING on?)")
+        sys.exit(1)
+
+    command = sys.argv[1]
+    if command == "list":
+        for shard in shards:
+            state = "sealed" if shard["sealed"] else "active"
+            print(f"{shard['file']}: {state}, {shard['orders']} orders, "
+                  f"SalesOrderID {shard['minOrderId']}..{shard['maxOrderId']}")
+
+    elif command == "find":
+        if len(sys.argv) < 3:
+            print(USAGE)
+            sys.exit(1)
+        order = manifest.find_order(int(sys.argv[2]))
+        if order is None:
+            print("Not found in any shard (orders still in the journal are not listed)")
+            sys.exit(2)
+        print(f"In {order['file']}:")
+        print(order["header"])
+        for detail in order["details"]:
+            print("  ", detail)
+
+    else:
+        if len(sys.argv) < 3:
+            print(USAGE)
+            sys.exit(1)
+        counts = merge_workbooks([shard["file"] for shard in shards], sys.argv[2])
+        print(f"✅ Merged {len(shards)} shards into {sys.argv[2]}: "
+              f"{counts['SalesOrderHeader']} headers, {counts['SalesOrderDetail']} detail rows")
+
+if __name__ == "__main__":
+    main()
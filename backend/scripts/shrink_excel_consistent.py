@@ -1,16 +1,23 @@
+import os
+import sys
+
 import pandas as pd
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from columnar_snapshot import read_sheet
+
 SRC = "data/Case Study Data_demo.xlsx"
 DEST = "data/Case Study Data_tiny.xlsx"
 
 KEEP_HEADER_ROWS = 200  # adjust smaller if you want
 
-header_full = pd.read_excel(SRC, sheet_name="SalesOrderHeader")
+header_full = read_sheet(SRC, "SalesOrderHeader")
 header = header_full.tail(KEEP_HEADER_ROWS)
 
 keep_ids = set(header["SalesOrderID"].tolist())
 
-detail_full = pd.read_excel(SRC, sheet_name="SalesOrderDetail")
+detail_full = read_sheet(SRC, "SalesOrderDetail")
 detail = detail_full[detail_full["SalesOrderID"].isin(keep_ids)]
 
 with pd.ExcelWriter(DEST, engine="openpyxl") as writer:
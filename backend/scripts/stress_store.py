@@ -0,0 +1,97 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openpyxl import load_workbook
+
+from excel_store_fast import DEMO_XLSX, ExcelOrderStore
+from workbook_shards import ShardManifest
+from xlsx_stream import XlsxReader
+
+JSON_PATH = "scripts/sample_extracted.json"
+
+WORKERS = 4            # processes, like gunicorn -w 4
+THREADS_PER_WORKER = 8
+SAVES_PER_WORKER = 50
+
+def run_worker(args):
+    xlsx_path, journal_dir, shard_dir = args
+    with open(JSON_PATH, "r", encoding="utf-8") as f:
+        sample = json.load(f)
+
+    store = ExcelOrderStore(xlsx_path, journal_dir=journal_dir, flush_interval=0.2, shard_dir=shard_dir)
+
+    def save_one(_):
+        t0 = time.perf_counter()
+        store.append_order(json.loads(json.dumps(sample)))
+        return time.perf_counter() - t0
+
+    with ThreadPoolExecutor(THREADS_PER_WORKER) as pool:
+        latencies = list(pool.map(save_one, range(SAVES_PER_WORKER)))
+
+    store.close()
+    return latencies, store.snapshots_written
+
+def count_headers(xlsx_path):
+    with XlsxReader(xlsx_path) as reader:
+        return sum(1 for (order_id,) in reader.rows("SalesOrderHeader", ["SalesOrderID"]) if order_id is not None)
+
+def shard_counts(xlsx_path, shard_dir):
+    # {file: headers} over every shard in the manifest (the original workbook
+    # is the first one), or just the workbook when sharding is off
+    shards = ShardManifest(shard_dir).shards()
+    return {path: count_headers(path) for path in ([s["file"] for s in shards] or [xlsx_path])}
+
+def main():
+    work_dir = tempfile.mkdtemp(prefix="stress_store_")
+    xlsx_path = os.path.join(work_dir, "orders.xlsx")
+    journal_dir = os.path.join(work_dir, "journal")
+    # Everything the stores write stays in work_dir (the columnar snapshot
+    # goes to COLUMNAR_DIR, which is outside the repo by default)
+    shard_dir = os.path.join(work_dir, "shards")
+    shutil.copyfile(DEMO_XLSX, xlsx_path)
+
+    try:
+        before = count_headers(xlsx_path)
+
+        # Baseline: cost of one full load + save, which the old code paid per order
+        t0 = time.perf_counter()
+        wb = load_workbook(xlsx_path)
+        wb.save(os.path.join(work_dir, "baseline.xlsx"))
+        rewrite_sec = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        with Pool(WORKERS) as pool:
+            results = pool.map(run_worker, [(xlsx_path, journal_dir, shard_dir)] * WORKERS)
+        wall_sec = time.perf_counter() - t0
+
+        latencies = sorted(l for lat, _ in results for l in lat)
+        snapshots = sum(s for _, s in results)
+        expected = WORKERS * SAVES_PER_WORKER
+        counts = shard_counts(xlsx_path, shard_dir)
+        added = sum(counts.values()) - before
+
+        print(f"Saves: {expected} ({WORKERS} processes x {THREADS_PER_WORKER} threads)")
+        print(f"Headers added: {added} -> {'OK' if added == expected else 'MISMATCH'}")
+        if len(counts) > 1:
+            print("Shards:", ", ".join(f"{os.path.basename(path)}={n}" for path, n in counts.items()))
+        print(f"Workbook snapshots written: {snapshots} (naive: {expected})")
+        print(f"Full load+save of workbook: {rewrite_sec * 1000:.1f} ms")
+        print(f"Wall time: {wall_sec:.2f} s (naive lower bound: {rewrite_sec * expected:.2f} s)")
+        print(f"Save latency p50: {latencies[len(latencies) // 2] * 1000:.2f} ms, "
+              f"p99: {latencies[int(len(latencies) * 0.99) - 1] * 1000:.2f} ms")
+
+        if added != expected:
+            sys.exit(1)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,9 @@
+import os
 import sys
-import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xlsx_stream import XlsxReader
 
 DEMO_XLSX = "data/Case Study Data_demo.xlsx"
 
@@ -10,17 +14,27 @@ def main():
 
     new_id = int(sys.argv[1])
 
-    header = pd.read_excel(DEMO_XLSX, sheet_name="SalesOrderHeader")
-    detail = pd.read_excel(DEMO_XLSX, sheet_name="SalesOrderDetail")
+    # Rows are streamed and filtered one at a time; only matches are kept
+    with XlsxReader(DEMO_XLSX) as reader:
+        header_cols = reader.header("SalesOrderHeader")
+        order_col = header_cols.index("SalesOrderID")
+        new_header = [row for row in reader.rows("SalesOrderHeader") if row[order_col] == new_id]
 
-    new_header = header[header["SalesOrderID"] == new_id]
-    new_detail = detail[detail["SalesOrderID"] == new_id]
+        detail_cols = reader.header("SalesOrderDetail")
+        order_col = detail_cols.index("SalesOrderID")
+        new_detail = [row for row in reader.rows("SalesOrderDetail") if row[order_col] == new_id]
 
     print("=== New Header Row ===")
-    print(new_header if not new_header.empty else "No header found.")
+    for row in new_header:
+        print(dict(zip(header_cols, row)))
+    if not new_header:
+        print("No header found.")
 
     print("\n=== New Detail Rows ===")
-    print(new_detail if not new_detail.empty else "No details found.")
+    for row in new_detail:
+        print(dict(zip(detail_cols, row)))
+    if not new_detail:
+        print("No details found.")
 
 if __name__ == "__main__":
     main()
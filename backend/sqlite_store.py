@@ -0,0 +1,237 @@
+import datetime
+import os
+import sqlite3
+import threading
+
+from order_index import date_key
+from order_mapping import DETAIL_COLUMNS, HEADER_COLUMNS, build_order_rows
+from order_store import OrderStore
+from xlsx_stream import XlsxReader
+
+SQLITE_PATH = os.getenv("ORDER_SQLITE_PATH", "data/orders.sqlite3")
+# Imported once into an empty DB; the same workbook the Excel store uses
+SEED_XLSX = os.getenv("ORDER_XLSX_PATH", "data/Case Study Data_tiny.xlsx")
+
+
+def _to_sql(value):
+    # sqlite3 has no datetime/bool types; store ISO strings and 0/1
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(sep=" ")
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, bool):
+        return int(value)
+    return value
+
+
+def _log_duplicates(rows, col, table, id_col):
+    # Passes rows through, warning about each repeated ID
+    seen = set()
+    for row in rows:
+        value = row[col]
+        if value is not None and value in seen:
+            kept = "kept" if table == "SalesOrderDetail" else "skipped"
+            print(f"WARN: duplicate {id_col} {value} in {table} ({kept})")
+        seen.add(value)
+        yield row
+
+
+class SqliteOrderStore(OrderStore):
+    # SalesOrderHeader / SalesOrderDetail as SQLite tables. Each append is one
+    # transaction (BEGIN IMMEDIATE, so IDs are safe across worker processes),
+    # and lookups go through indexes on SalesOrderID, PurchaseOrderNumber,
+    # OrderDate and customer.
+
+    def __init__(self, path=SQLITE_PATH, seed_xlsx=SEED_XLSX):
+        self.path = path
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+
+        if seed_xlsx and os.path.exists(seed_xlsx) and self._is_empty():
+            self._import_xlsx(seed_xlsx)
+
+    def _create_schema(self):
+        header_cols = ", ".join(
+            "SalesOrderID INTEGER PRIMARY KEY" if c == "SalesOrderID" else f'"{c}"'
+            for c in HEADER_COLUMNS
+        )
+        # Details are keyed by the implicit rowid, not SalesOrderDetailID: the
+        # case-study workbook has duplicate detail IDs and every line is kept,
+        # as in the Excel backend
+        detail_cols = ", ".join(f'"{c}"' for c in DETAIL_COLUMNS)
+        self._conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS SalesOrderHeader ({header_cols});
+            CREATE TABLE IF NOT EXISTS SalesOrderDetail ({detail_cols});
+            CREATE INDEX IF NOT EXISTS idx_header_po ON SalesOrderHeader(PurchaseOrderNumber COLLATE NOCASE);
+            CREATE INDEX IF NOT EXISTS idx_header_date ON SalesOrderHeader(OrderDate);
+            CREATE INDEX IF NOT EXISTS idx_header_customer ON SalesOrderHeader(CustomerID);
+            CREATE INDEX IF NOT EXISTS idx_header_account ON SalesOrderHeader(AccountNumber COLLATE NOCASE);
+            CREATE INDEX IF NOT EXISTS idx_detail_order ON SalesOrderDetail(SalesOrderID);
+            CREATE INDEX IF NOT EXISTS idx_detail_id ON SalesOrderDetail(SalesOrderDetailID);
+        """)
+
+    def _is_empty(self):
+        return self._conn.execute("SELECT 1 FROM SalesOrderHeader LIMIT 1").fetchone() is None
+
+    def _import_xlsx(self, xlsx_path):
+        with XlsxReader(xlsx_path) as reader, self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for table, columns, id_col in (("SalesOrderHeader", HEADER_COLUMNS, "SalesOrderID"),
+                                               ("SalesOrderDetail", DETAIL_COLUMNS, "SalesOrderDetailID")):
+                    # Only the schema's columns are read; others stay unparsed
+                    sheet_cols = reader.header(table)
+                    present = [c for c in columns if c in sheet_cols]
+                    # INSERT OR IGNORE only ever skips a duplicate SalesOrderID
+                    self._conn.executemany(
+                        self._insert_sql(table, present, "INSERT OR IGNORE"),
+                        ([_to_sql(v) for v in row]
+                         for row in _log_duplicates(reader.rows(table, present), present.index(id_col), table, id_col))
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    @staticmethod
+    def _insert_sql(table, columns, verb="INSERT"):
+        names = ", ".join(f'"{c}"' for c in columns)
+        marks = ", ".join("?" for _ in columns)
+        return f"{verb} INTO {table} ({names}) VALUES ({marks})"
+
+    def _next_id(self, table, column):
+        # MAX over an indexed column is a single index lookup
+        return self._conn.execute(f"SELECT COALESCE(MAX({column}), 0) + 1 FROM {table}").fetchone()[0]
+
+    def append_orders(self, extracted_list):
+        header_sql = self._insert_sql("SalesOrderHeader", HEADER_COLUMNS)
+        detail_sql = self._insert_sql("SalesOrderDetail", DETAIL_COLUMNS)
+
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                sales_order_id = self._next_id("SalesOrderHeader", "SalesOrderID")
+                detail_id = self._next_id("SalesOrderDetail", "SalesOrderDetailID")
+
+                new_ids = []
+                for extracted in extracted_list:
+                    header_row, detail_rows = build_order_rows(extracted, sales_order_id, detail_id)
+                    self._conn.execute(header_sql, [_to_sql(header_row.get(c)) for c in HEADER_COLUMNS])
+                    self._conn.executemany(
+                        detail_sql,
+                        [[_to_sql(row.get(c)) for c in DETAIL_COLUMNS] for row in detail_rows]
+                    )
+                    new_ids.append(sales_order_id)
+                    sales_order_id += 1
+                    detail_id += len(detail_rows)
+
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return new_ids
+
+    def get_order(self, sales_order_id):
+        with self._lock:
+            cur = self._conn.execute("SELECT * FROM SalesOrderHeader WHERE SalesOrderID = ?", (int(sales_order_id),))
+            header = cur.fetchone()
+            if header is None:
+                return None
+            header = dict(zip([d[0] for d in cur.description], header))
+
+            cur = self._conn.execute(
+                "SELECT * FROM SalesOrderDetail WHERE SalesOrderID = ? ORDER BY SalesOrderDetailID, rowid",
+                (int(sales_order_id),)
+            )
+            names = [d[0] for d in cur.description]
+            details = [dict(zip(names, row)) for row in cur.fetchall()]
+        return {"header": header, "details": details}
+
+    def query_orders(self, date_from=None, date_to=None, customer=None, po=None, limit=100, offset=0):
+        where, params = [], []
+        if date_from:
+            where.append("OrderDate >= ?")
+            params.append(date_key(date_from))
+        if date_to:
+            # Dates are stored as "YYYY-MM-DD[ HH:MM:SS]"; compare against the next day
+            next_day = datetime.date.fromisoformat(date_key(date_to)) + datetime.timedelta(days=1)
+            where.append("OrderDate < ?")
+            params.append(next_day.isoformat())
+        if customer:
+            where.append("(CAST(CustomerID AS TEXT) = ? OR AccountNumber = ? COLLATE NOCASE)")
+            params += [str(customer).strip(), str(customer).strip()]
+        if po:
+            where.append("PurchaseOrderNumber = ? COLLATE NOCASE")
+            params.append(str(po).strip())
+
+        clause = ("WHERE " + " AND ".join(where)) if where else ""
+        order = "OrderDate, SalesOrderID" if (date_from or date_to) else "SalesOrderID"
+
+        with self._lock:
+            total = self._conn.execute(f"SELECT COUNT(*) FROM SalesOrderHeader {clause}", params).fetchone()[0]
+            cur = self._conn.execute(
+                f"SELECT * FROM SalesOrderHeader {clause} ORDER BY {order} LIMIT ? OFFSET ?",
+                params + [int(limit), int(offset)]
+            )
+            names = [d[0] for d in cur.description]
+            headers = [dict(zip(names, row)) for row in cur.fetchall()]
+        return headers, total
+
+    def monthly_totals(self, date_from=None, date_to=None):
+        where, params = ["OrderDate IS NOT NULL"], []
+        if date_from:
+            where.append("OrderDate >= ?")
+            params.append(date_key(date_from))
+        if date_to:
+            next_day = datetime.date.fromisoformat(date_key(date_to)) + datetime.timedelta(days=1)
+            where.append("OrderDate < ?")
+            params.append(next_day.isoformat())
+
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT substr(OrderDate, 1, 7) AS month, COUNT(*), SUM(SubTotal), SUM(TaxAmt), SUM(Freight), SUM(TotalDue) "
+                f"FROM SalesOrderHeader WHERE {' AND '.join(where)} GROUP BY month ORDER BY month",
+                params
+            ).fetchall()
+        return [
+            {
+                "month": month,
+                "orders": count,
+                "subTotal": round(sub_total or 0, 2),
+                "taxAmt": round(tax or 0, 2),
+                "freight": round(freight or 0, 2),
+                "totalDue": round(total or 0, 2)
+            }
+            for month, count, sub_total, tax, freight, total in rows
+        ]
+
+    def next_ids(self):
+        with self._lock:
+            return {
+                "SalesOrderID": self._next_id("SalesOrderHeader", "SalesOrderID"),
+                "SalesOrderDetailID": self._next_id("SalesOrderDetail", "SalesOrderDetailID")
+            }
+
+    def export_xlsx(self, path):
+        from openpyxl import Workbook
+
+        # Write-only mode streams rows instead of building every cell in memory
+        wb = Workbook(write_only=True)
+        with self._lock:
+            for table, columns in (("SalesOrderHeader", HEADER_COLUMNS), ("SalesOrderDetail", DETAIL_COLUMNS)):
+                ws = wb.create_sheet(table)
+                ws.append(columns)
+                names = ", ".join(f'"{c}"' for c in columns)
+                for row in self._conn.execute(f"SELECT {names} FROM {table} ORDER BY rowid"):
+                    ws.append(list(row))
+        wb.save(path)
+        return path
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
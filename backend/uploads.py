@@ -0,0 +1,106 @@
+import hashlib
+import os
+import uuid
+
+UPLOAD_DIR = "uploads"
+ALLOWED_EXT = {".png", ".jpg", ".jpeg", ".pdf", ".tif", ".tiff"}
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+KEEP_UPLOADS = os.getenv("KEEP_UPLOADS", "0") == "1"  # persist originals by content hash
+CHUNK_SIZE = 64 * 1024
+
+# (magic prefix, mime, canonical extension)
+MAGIC_TYPES = [
+    (b"\x89PNG\r\n\x1a\n", "image/png", ".png"),
+    (b"\xff\xd8\xff", "image/jpeg", ".jpg"),
+    (b"%PDF-", "application/pdf", ".pdf"),
+    (b"II*\x00", "image/tiff", ".tif"),
+    (b"MM\x00*", "image/tiff", ".tif"),
+]
+
+
+class UploadError(ValueError):
+    pass
+
+
+class Upload:
+    # An uploaded file held in memory. `data` is a memoryview over the
+    # received bytes, so hashing/encoding never copies it again.
+
+    def __init__(self, filename, data, mime, ext):
+        self.filename = filename
+        self.data = data
+        self.mime = mime
+        self.ext = ext
+        self._sha256 = None
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    @property
+    def sha256(self):
+        if self._sha256 is None:
+            self._sha256 = hashlib.sha256(self.data).hexdigest()
+        return self._sha256
+
+
+def sniff_type(head: bytes):
+    for magic, mime, ext in MAGIC_TYPES:
+        if head.startswith(magic):
+            return mime, ext
+    return None, None
+
+
+def read_stream(stream, max_bytes=MAX_UPLOAD_BYTES):
+    # Werkzeug already spools large request bodies to a temp file; read it
+    # in chunks so an oversized upload is rejected before it is all in memory.
+    buf = bytearray()
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        if len(buf) + len(chunk) > max_bytes:
+            raise UploadError(f"File too large (max {max_bytes // (1024 * 1024)} MB)")
+        buf += chunk
+    return memoryview(buf)
+
+
+def make_upload(filename, stream_or_bytes, max_bytes=MAX_UPLOAD_BYTES):
+    ext = os.path.splitext(filename.lower())[1]
+    if ext not in ALLOWED_EXT:
+        raise UploadError(f"Unsupported file type: {ext}. Use png/jpg/jpeg/pdf/tif")
+
+    if isinstance(stream_or_bytes, (bytes, bytearray, memoryview)):
+        if len(stream_or_bytes) > max_bytes:
+            raise UploadError(f"File too large (max {max_bytes // (1024 * 1024)} MB)")
+        data = memoryview(stream_or_bytes)
+    else:
+        data = read_stream(stream_or_bytes, max_bytes)
+
+    if not data:
+        raise UploadError("Empty file")
+
+    # Trust the bytes, not the extension
+    mime, sniffed_ext = sniff_type(bytes(data[:16]))
+    if not mime:
+        raise UploadError(f"File content is not a png/jpg/pdf/tif file: {filename}")
+
+    upload = Upload(filename, data, mime, sniffed_ext)
+    if KEEP_UPLOADS:
+        persist_upload(upload)
+    return upload
+
+
+def persist_upload(upload, upload_dir=UPLOAD_DIR):
+    # Content-addressed: identical files share one copy, names never collide
+    path = os.path.join(upload_dir, upload.sha256 + upload.ext)
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(upload_dir, exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(upload.data)
+    os.replace(tmp_path, path)
+    return path
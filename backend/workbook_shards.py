@@ -0,0 +1,153 @@
+import datetime
+import json
+import os
+
+from xlsx_stream import XlsxReader
+
+# Optional sharding for the Excel order store. Instead of one ever-growing
+# workbook, orders are compacted into an active shard, which is sealed and
+# replaced by an empty one when the month changes (EXCEL_SHARDING=month) or
+# once it holds EXCEL_SHARD_MAX_ORDERS orders (EXCEL_SHARDING=rows). Sealed
+# shards are never written again, so a save only ever rewrites a small file.
+# manifest.json maps SalesOrderID ranges to shard files.
+EXCEL_SHARDING = os.getenv("EXCEL_SHARDING", "off")  # off | month | rows
+SHARDING_MODES = ("off", "month", "rows")
+EXCEL_SHARD_DIR = os.getenv("EXCEL_SHARD_DIR", "data/shards")
+EXCEL_SHARD_MAX_ORDERS = int(os.getenv("EXCEL_SHARD_MAX_ORDERS", "20000"))
+
+SHEETS = ("SalesOrderHeader", "SalesOrderDetail")
+
+
+def current_month():
+    return datetime.date.today().strftime("%Y-%m")
+
+
+def shard_entry(path, month, sealed, order_ids=(), max_detail_id=None):
+    # One manifest record; the ID range is None for an empty shard
+    return {
+        "file": path,
+        "month": month,
+        "sealed": sealed,
+        "orders": len(order_ids),
+        "minOrderId": min(order_ids) if order_ids else None,
+        "maxOrderId": max(order_ids) if order_ids else None,
+        "maxDetailId": max_detail_id
+    }
+
+
+def rotation_due(shard, mode=EXCEL_SHARDING, max_orders=EXCEL_SHARD_MAX_ORDERS):
+    # An empty shard is never rotated, only relabeled with the new month
+    if not shard.get("orders"):
+        return False
+    if mode == "month":
+        return shard.get("month") != current_month()
+    if mode == "rows":
+        return shard["orders"] >= max_orders
+    return False
+
+
+def create_empty_workbook(path, header_cols, detail_cols):
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    for name, cols in zip(SHEETS, (header_cols, detail_cols)):
+        ws = wb.create_sheet(name)
+        ws.append(cols)
+    tmp_path = path + ".tmp"
+    wb.save(tmp_path)
+    os.replace(tmp_path, path)
+
+
+class ShardManifest:
+    # manifest.json: {"mode", "shards": [entry, ...]} in write order; the last
+    # entry is the active shard. Written only under the store's compaction
+    # lock and swapped in atomically, so readers never see a partial file.
+
+    def __init__(self, directory=EXCEL_SHARD_DIR):
+        self.directory = directory
+        self.path = os.path.join(directory, "manifest.json")
+        os.makedirs(directory, exist_ok=True)
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, manifest):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def shards(self):
+        return (self.load() or {}).get("shards", [])
+
+    def active_file(self):
+        shards = self.shards()
+        return shards[-1]["file"] if shards else None
+
+    def new_shard_path(self, manifest, month):
+        n = len(manifest["shards"]) + 1
+        return os.path.join(self.directory, f"orders-{month}-{n:03d}.xlsx")
+
+    def files_for(self, sales_order_id):
+        # Shards whose ID range covers the order. Ranges of neighbouring
+        # shards can overlap a little (workers reserve IDs in blocks).
+        return [
+            shard["file"] for shard in self.shards()
+            if shard["minOrderId"] is not None and shard["minOrderId"] <= sales_order_id <= shard["maxOrderId"]
+        ]
+
+    def find_order(self, sales_order_id):
+        # {"header", "details", "file"} streamed from the matching shard only
+        for path in self.files_for(sales_order_id):
+            with XlsxReader(path) as reader:
+                cols = reader.header("SalesOrderHeader")
+                order_col = cols.index("SalesOrderID")
+                header = next((dict(zip(cols, row)) for row in reader.rows("SalesOrderHeader")
+                               if row[order_col] == sales_order_id), None)
+                if header is None:
+                    continue
+                cols = reader.header("SalesOrderDetail")
+                order_col = cols.index("SalesOrderID")
+                details = [dict(zip(cols, row)) for row in reader.rows("SalesOrderDetail")
+                           if row[order_col] == sales_order_id]
+                return {"header": header, "details": details, "file": path}
+        return None
+
+
+def merge_workbooks(paths, dest, extra_rows=None):
+    # One combined workbook from the shards, in order. Streamed in, write-only
+    # out: rows are never all held in memory. Columns follow the first shard;
+    # others are mapped by name. extra_rows ({sheet: [row dict, ...]}, e.g.
+    # journaled orders) are appended after the shards.
+    from openpyxl import Workbook
+
+    out = Workbook(write_only=True)
+    sheets = {name: out.create_sheet(name) for name in SHEETS}
+    columns = {}
+    counts = dict.fromkeys(SHEETS, 0)
+    for path in paths:
+        with XlsxReader(path) as reader:
+            for name in SHEETS:
+                cols = reader.header(name)
+                if name not in columns:
+                    columns[name] = cols
+                    sheets[name].append(cols)
+                positions = [cols.index(c) if c in cols else None for c in columns[name]]
+                for row in reader.rows(name):
+                    sheets[name].append([row[i] if i is not None and i < len(row) else None for i in positions])
+                    counts[name] += 1
+    for name, rows in (extra_rows or {}).items():
+        for row in rows:
+            sheets[name].append([row.get(c) for c in columns[name]])
+            counts[name] += 1
+
+    tmp_path = dest + ".tmp"
+    out.save(tmp_path)
+    os.replace(tmp_path, dest)
+    return counts
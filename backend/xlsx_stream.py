@@ -0,0 +1,262 @@
+import datetime
+import posixpath
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+
+# Streaming .xlsx reader: parses the sheet XML straight out of the zip, one
+# row at a time, and converts only the columns asked for. No workbook or cell
+# objects are built, so memory stays flat however large the sheet is (shared
+# strings are loaded lazily, only up to the highest index a row refers to).
+#
+#   with XlsxReader(path) as reader:
+#       for order_id, order_date in reader.rows("SalesOrderHeader", ["SalesOrderID", "OrderDate"]):
+#           ...
+
+MAIN_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+PKG_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+ROW, CELL, VALUE = MAIN_NS + "row", MAIN_NS + "c", MAIN_NS + "v"
+INLINE, TEXT, SHEET_DATA = MAIN_NS + "is", MAIN_NS + "t", MAIN_NS + "sheetData"
+
+# Built-in number formats that display dates/times
+DATE_FORMAT_IDS = set(range(14, 23)) | set(range(27, 37)) | set(range(45, 48)) | set(range(50, 59))
+# Quoted text, [colors]/[conditions] and escaped chars don't make a format a date
+_FORMAT_NOISE = re.compile(r'"[^"]*"|\[[^\]]*\]|\\.')
+_DIGITS = "0123456789"
+
+EPOCH_1900 = datetime.datetime(1899, 12, 30)
+EPOCH_1904 = datetime.datetime(1904, 1, 1)
+
+
+_column_indexes = {}
+
+
+def column_index(ref):
+    # "AB12" -> 27 (0-based); cached per column letters, since this runs
+    # once per cell
+    letters = ref.rstrip(_DIGITS)
+    index = _column_indexes.get(letters)
+    if index is None:
+        index = 0
+        for ch in letters:
+            index = index * 26 + ord(ch) - 64
+        index = _column_indexes[letters] = index - 1
+    return index
+
+
+def _is_date_format(code):
+    code = _FORMAT_NOISE.sub("", code).lower()
+    return any(ch in code for ch in "dmyhs") and "general" not in code
+
+
+def _number(text):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+class XlsxReader:
+
+    def __init__(self, path):
+        self.path = path
+        self._zip = zipfile.ZipFile(path)
+        self._sheets = self._sheet_paths()
+        self._epoch = EPOCH_1900
+        workbook = ET.fromstring(self._zip.read("xl/workbook.xml"))
+        props = workbook.find(MAIN_NS + "workbookPr")
+        if props is not None and props.get("date1904") in ("1", "true"):
+            self._epoch = EPOCH_1904
+        self._date_styles = self._load_date_styles()
+        self._strings = []
+        self._string_iter = None
+
+    # ---- workbook parts ----
+
+    def _sheet_paths(self):
+        workbook = ET.fromstring(self._zip.read("xl/workbook.xml"))
+        rels = ET.fromstring(self._zip.read("xl/_rels/workbook.xml.rels"))
+        targets = {rel.get("Id"): rel.get("Target") for rel in rels.iter(PKG_REL_NS + "Relationship")}
+        sheets = {}
+        for sheet in workbook.iter(MAIN_NS + "sheet"):
+            target = targets[sheet.get(REL_NS + "id")]
+            # Targets are relative to xl/ unless absolute within the package
+            sheets[sheet.get("name")] = target.lstrip("/") if target.startswith("/") else posixpath.join("xl", target)
+        return sheets
+
+    def _load_date_styles(self):
+        # Indexes of the cell formats (the `s` attribute) that show dates
+        try:
+            styles = ET.fromstring(self._zip.read("xl/styles.xml"))
+        except KeyError:
+            return frozenset()
+        custom = {int(fmt.get("numFmtId")): fmt.get("formatCode", "")
+                  for fmt in styles.iter(MAIN_NS + "numFmt")}
+        cell_xfs = styles.find(MAIN_NS + "cellXfs")
+        dates = set()
+        for i, xf in enumerate(cell_xfs if cell_xfs is not None else ()):
+            fmt_id = int(xf.get("numFmtId", 0))
+            if fmt_id in DATE_FORMAT_IDS or (fmt_id in custom and _is_date_format(custom[fmt_id])):
+                dates.add(i)
+        return frozenset(dates)
+
+    def _iter_shared_strings(self):
+        try:
+            source = self._zip.open("xl/sharedStrings.xml")
+        except KeyError:
+            return
+        with source:
+            for _, elem in ET.iterparse(source):
+                if elem.tag == MAIN_NS + "si":
+                    # Rich text is split into runs; the value is all of them
+                    yield "".join(t.text or "" for t in elem.iter(TEXT))
+                    elem.clear()
+
+    def _shared_string(self, i):
+        strings = self._strings
+        while i >= len(strings):
+            if self._string_iter is None:
+                self._string_iter = self._iter_shared_strings()
+            try:
+                strings.append(next(self._string_iter))
+            except StopIteration:
+                return None
+        return strings[i]
+
+    # ---- cells ----
+
+    def _value(self, cell):
+        kind = cell.get("t", "n")
+        if kind == "inlineStr":
+            inline = cell.find(INLINE)
+            return "".join(t.text or "" for t in inline.iter(TEXT)) if inline is not None else None
+
+        text = cell.findtext(VALUE)
+        if text is None:
+            return None
+        if kind == "n":
+            value = _number(text)
+            style = cell.get("s")
+            if style is not None and int(style) in self._date_styles:
+                return self._epoch + datetime.timedelta(days=value)
+            return value
+        if kind == "s":
+            return self._shared_string(int(text))
+        if kind == "b":
+            return text == "1"
+        if kind == "d":
+            return datetime.datetime.fromisoformat(text)
+        return text  # str (formula result), e (error)
+
+    def _iter_row_elements(self, sheet):
+        if sheet not in self._sheets:
+            raise KeyError(f"Worksheet {sheet} does not exist in {self.path}")
+        with self._zip.open(self._sheets[sheet]) as source:
+            sheet_data = None
+            for event, elem in ET.iterparse(source, events=("start", "end")):
+                if event == "start":
+                    if elem.tag == SHEET_DATA:
+                        sheet_data = elem
+                elif elem.tag == ROW:
+                    yield elem
+                    # Drop the parsed row so the tree never grows
+                    if sheet_data is not None:
+                        sheet_data.remove(elem)
+                    else:
+                        elem.clear()
+
+    # ---- public ----
+
+    @property
+    def sheetnames(self):
+        return list(self._sheets)
+
+    def _cells(self, row):
+        # (column index, cell element) for each cell of a row element; `r`
+        # is optional, in which case cells are consecutive
+        position = 0
+        for cell in row:
+            if cell.tag != CELL:
+                continue
+            ref = cell.get("r")
+            if ref:
+                position = column_index(ref)
+            yield position, cell
+            position += 1
+
+    def header(self, sheet):
+        # First row as a list of column names (None for blank header cells)
+        for row in self._iter_row_elements(sheet):
+            cells = {i: self._value(cell) for i, cell in self._cells(row)}
+            return [cells.get(i) for i in range(max(cells) + 1)] if cells else []
+        return []
+
+    def rows(self, sheet, columns=None):
+        # Data rows (below the header) as tuples of `columns`, in that order
+        # (every column when None). Cells of other columns are skipped
+        # without being converted. Blank rows are left out.
+        names = self.header(sheet)
+        if columns is None:
+            wanted = {i: i for i in range(len(names))}
+        else:
+            missing = [c for c in columns if c not in names]
+            if missing:
+                raise KeyError(f"{sheet} has no column(s) {', '.join(map(str, missing))}")
+            wanted = {names.index(c): slot for slot, c in enumerate(columns)}
+        width = len(wanted)
+
+        first = True
+        for row in self._iter_row_elements(sheet):
+            if first:
+                first = False
+                continue
+            values = [None] * width
+            found = False
+            for position, cell in self._cells(row):
+                slot = wanted.get(position)
+                if slot is not None:
+                    value = self._value(cell)
+                    if value is not None:
+                        values[slot] = value
+                        found = True
+            if found:
+                yield tuple(values)
+
+    def column_chunks(self, sheet, columns, chunk_rows=65536):
+        # {column: list of values} for up to chunk_rows rows at a time, e.g.
+        # to feed pyarrow/numpy without materializing the whole sheet
+        chunk = [[] for _ in columns]
+        for row in self.rows(sheet, columns):
+            for values, value in zip(chunk, row):
+                values.append(value)
+            if len(chunk[0]) >= chunk_rows:
+                yield dict(zip(columns, chunk))
+                chunk = [[] for _ in columns]
+        if chunk[0]:
+            yield dict(zip(columns, chunk))
+
+    def max_value(self, sheet, column):
+        # Largest numeric value in one column (None if there is none)
+        best = None
+        for (value,) in self.rows(sheet, [column]):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                best = value if best is None else max(best, value)
+        return best
+
+    def close(self):
+        self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def next_id(path, sheet, id_col):
+    # Next free ID in a column, read without loading the workbook
+    with XlsxReader(path) as reader:
+        max_id = reader.max_value(sheet, id_col)
+    return int(max_id) + 1 if max_id is not None else 1
@@ -16,6 +16,11 @@ export default function Home() {
   const [lastExtractedFile, setLastExtractedFile] = useState<any>(null);
   const [lastSavedResult, setLastSavedResult] = useState<any>(null);
 
+  // BATCH FLOW (MANY FILES OR .ZIP)
+  const [batchFiles, setBatchFiles] = useState<File[]>([]);
+  const [batchEvents, setBatchEvents] = useState<any[]>([]);
+  const [batchSummary, setBatchSummary] = useState<any>(null);
+
   function resetErrors() {
     setError(null);
   }
@@ -83,6 +88,75 @@ export default function Home() {
     }
   }
 
+  function handleBatchChange(e: React.ChangeEvent<HTMLInputElement>) {
+    setBatchFiles(Array.from(e.target.files || []));
+    setBatchEvents([]);
+    setBatchSummary(null);
+  }
+
+  // Extract & Save (Batch) - reads NDJSON progress events as files finish
+  async function extractAndSaveBatch() {
+    if (!batchFiles.length) return;
+
+    setBusy(true);
+    resetErrors();
+    setBatchEvents([]);
+    setBatchSummary(null);
+
+    try {
+      const form = new FormData();
+      batchFiles.forEach((f) => form.append("files", f));
+
+      const res = await fetch(`${API_BASE}/api/batch?stream=1`, {
+        method: "POST",
+        body: form,
+      });
+
+      if (!res.ok || !res.body) {
+        const data = await res.json().catch(() => ({}));
+        throw new Error(data?.error || `HTTP ${res.status}`);
+      }
+
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffered = "";
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+
+        buffered += decoder.decode(value, { stream: true });
+        const lines = buffered.split("\n");
+        buffered = lines.pop() || "";
+
+        for (const line of lines) {
+          if (!line.trim()) continue;
+          const event = JSON.parse(line);
+          if (event.event === "file") {
+            setBatchEvents((prev) => [...prev, event]);
+          } else if (event.event === "saved") {
+            const ids = new Map(
+              event.orders.map((o: any) => [o.index, o.salesOrderId])
+            );
+            setBatchEvents((prev) =>
+              prev.map((ev) =>
+                ids.has(ev.index)
+                  ? { ...ev, salesOrderId: ids.get(ev.index) }
+                  : ev
+              )
+            );
+          } else if (event.event === "done") {
+            setBatchSummary(event);
+          }
+        }
+      }
+    } catch (e: any) {
+      setError(e?.message || "Something went wrong");
+    } finally {
+      setBusy(false);
+    }
+  }
+
   return (
     <main
       style={{
@@ -108,12 +182,12 @@ export default function Home() {
         }}
       >
         <div style={{ fontWeight: 650, marginBottom: 8 }}>
-          Upload invoice image (jpg/png)
+          Upload invoice (jpg/png/pdf/tif)
         </div>
 
         <input
           type="file"
-          accept=".png,.jpg,.jpeg"
+          accept=".png,.jpg,.jpeg,.pdf,.tif,.tiff"
           onChange={handleFileChange}
         />
 
@@ -155,6 +229,55 @@ export default function Home() {
         )}
       </section>
 
+      {/* BATCH SECTION */}
+      <section
+        style={{
+          marginTop: 18,
+          padding: 12,
+          border: "1px solid #ddd",
+          borderRadius: 8,
+        }}
+      >
+        <div style={{ fontWeight: 650, marginBottom: 8 }}>
+          Batch upload (many jpg/png/pdf/tif files or a .zip)
+        </div>
+
+        <input
+          type="file"
+          multiple
+          accept=".png,.jpg,.jpeg,.pdf,.tif,.tiff,.zip"
+          onChange={handleBatchChange}
+        />
+
+        <div style={{ marginTop: 12 }}>
+          <button
+            onClick={extractAndSaveBatch}
+            disabled={busy || !batchFiles.length}
+            style={btnStyle(busy || !batchFiles.length)}
+          >
+            Extract & Save (Batch)
+          </button>
+        </div>
+
+        {(batchEvents.length > 0 || batchSummary) && (
+          <div style={{ marginTop: 14, fontSize: 13 }}>
+            {batchSummary && (
+              <div style={{ marginBottom: 6 }}>
+                <strong>Done:</strong> {batchSummary.succeeded} ok,{" "}
+                {batchSummary.failed} failed of {batchSummary.total}
+              </div>
+            )}
+            {batchEvents.map((ev, i) => (
+              <div key={i}>
+                {ev.ok ? "✅" : "❌"} {ev.filename}
+                {ev.salesOrderId && <> → SalesOrderId {ev.salesOrderId}</>}
+                {ev.error && <span style={{ color: "#a00" }}> {ev.error}</span>}
+              </div>
+            ))}
+          </div>
+        )}
+      </section>
+
       {/* ERROR */}
       {error && (
         <div